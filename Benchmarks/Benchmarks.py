@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+#
+
+"""
+Offline benchmarks of PyStocks.
+
+Times the parsing of recorded feed rows, batched quote downloads from
+the StandInServer, the PortfolioManager operations (add, remove, _save,
+_reload and getTotalProfits with a fake service) on portfolios of
+different sizes and YahooChartFinder URL building. Every benchmark
+reports its throughput, p50 and p99 latency and the peak memory of the
+process it ran in.
+
+The peak memory (ru_maxrss) is a high-water mark of the whole process,
+so every benchmark, and every size and fsync setting of the portfolio
+ones, runs in its own Python process. With --no-isolate they all run in
+this process and each row reports the largest peak so far.
+
+    $ python Benchmarks.py --sizes 10,1000,100000 --json run.json
+    $ python Benchmarks.py --compare run.json
+    $ python Benchmarks.py --only portfolio --fsync never,always
+
+Results written with --json can be given to --compare to print the
+throughput of the current run relative to a previous one.
+"""
+
+import os
+import sys
+import csv
+import time
+import shutil
+import resource
+import tempfile
+
+try:
+    import json
+except ImportError:
+    json = None
+
+from pystocks.YahooFinance import YahooChartFinder, YahooQuoteFinder
+from pystocks.YahooFinance import YahooFinance, Transport, QuoteCache
+from pystocks.YahooFinance.StandInServer import StandInServer
+from pystocks.PortfolioManager.Journal import (FSYNC_ALWAYS,
+                                               FSYNC_INTERVAL, FSYNC_NEVER)
+from pystocks.PortfolioManager.PortfolioManager import PortfolioManager
+
+__revision__ = "$Id$"
+
+SIZES = (10, 1000, 100000)
+
+BENCHMARKS = ('parse', 'fetch', 'portfolio', 'chart_url')
+
+# symbols the portfolios are spread over
+SYMBOLS = ['SYM%03d' % i for i in range(100)]
+
+class FakeService:
+    """
+    Price service answering without a network.
+    """
+    def getCurrentPrice(self, symbol):
+        return 10.0 + len(symbol)
+
+def _percentile(times, percent):
+    ordered = sorted(times)
+    pos = int(round((len(ordered) - 1) * percent / 100.0))
+    return ordered[pos]
+
+def _peak_memory():
+    """
+    Peak resident memory of the process since it started, in kilobytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak //= 1024 # bytes
+    return peak
+
+def measure(name, operation, count, items=1):
+    """
+    Call operation(pos) for pos in range(count) and return the
+    statistics of the calls.
+
+    items: amount of items processed by every call, for the throughput
+    """
+    times = []
+    clock = time.time
+    for pos in xrange(count):
+        start = clock()
+        operation(pos)
+        times.append(clock() - start)
+    total = sum(times)
+    if total > 0:
+        throughput = count * items / total
+    else:
+        throughput = float(count * items)
+    return {'name': name,
+            'count': count,
+            'items': count * items,
+            'seconds': total,
+            'throughput': throughput,
+            'p50': _percentile(times, 50),
+            'p99': _percentile(times, 99),
+            'peak_memory_kb': _peak_memory()}
+
+def _recorded_rows(server):
+    """
+    Return the feed rows of the recorded symbols, parsed by csv.
+    """
+    tags = YahooFinance.QUOTE_TAGS[:-2]
+    rows = []
+    for symbol in sorted(server.recordings):
+        line = server.render(symbol, tags + ['j2', 's', 'f6'])
+        row = YahooFinance._join_fundamentals(csv.reader([line]).next())
+        if len(row) >= len(YahooFinance.QUOTE_TAGS) and row[7] != 'N/A':
+            rows.append((symbol, row))
+    return rows
+
+def bench_parse(server, count):
+    rows = _recorded_rows(server)
+
+    def parse(pos):
+        (symbol, row) = rows[pos % len(rows)]
+        quote = YahooQuoteFinder.__new__(YahooQuoteFinder)
+        quote.symbol = symbol
+        quote._parse(row)
+    return [measure('parse', parse, count)]
+
+def bench_fetch(server, count):
+    symbols = sorted(server.recordings)
+    previous = QuoteCache.set_cache(None)
+    try:
+        def fetch(pos):
+            YahooQuoteFinder.fetch_many(symbols)
+        return [measure('fetch_many', fetch, count, len(symbols))]
+    finally:
+        QuoteCache.set_cache(previous)
+
+def bench_portfolio(size, repeat, fsync=FSYNC_NEVER):
+    """
+    fsync: journal fsync setting of the portfolio, see PortfolioManager
+           (default: FSYNC_NEVER)
+    """
+    directory = tempfile.mkdtemp(prefix='pystocks-bench-')
+    try:
+        pm = PortfolioManager('bench', directory, FakeService, fsync=fsync)
+        def name(operation):
+            return '%s[%d,%s]' % (operation, size, fsync)
+
+        def add(pos):
+            pm.add(SYMBOLS[pos % len(SYMBOLS)], 10, 10.0 + pos % 7,
+                   1000000000 + pos)
+        results = [measure(name('add'), add, size)]
+
+        symbols = list(pm)
+        def remove(pos):
+            pm.remove(symbols[pos % len(symbols)], 1)
+        results.append(measure(name('remove'), remove,
+                               min(size, repeat * 10)))
+
+        results.append(measure(name('_save'),
+                               lambda pos: pm._save(), repeat))
+        results.append(measure(name('_reload'),
+                               lambda pos: pm._reload(), repeat))
+        results.append(measure(name('getTotalProfits'),
+                               lambda pos: pm.getTotalProfits(), repeat))
+        pm.close()
+        return results
+    finally:
+        shutil.rmtree(directory)
+
+def bench_chart_url(count):
+    charts = []
+    for (pos, symbol) in enumerate(SYMBOLS):
+        charts.append(YahooChartFinder(symbol, '1y', 'candle', 'large',
+                                       'log', 'YHOO', 'GOOG', macd=True,
+                                       rsi=True, boll=True, m50=True))
+
+    def build(pos):
+        charts[pos % len(charts)]._build_url()
+    return [measure('chart_url', build, count)]
+
+def _isolated(name, repeat, count, size=None, fsync=FSYNC_NEVER):
+    """
+    Run a benchmark in a new Python process and return its results.
+    """
+    import subprocess
+
+    (fd, path) = tempfile.mkstemp(prefix='pystocks-bench-', suffix='.json')
+    os.close(fd)
+    argv = [sys.executable, '-m', 'pystocks.Benchmarks.Benchmarks',
+            '--no-isolate', '--only', name, '--repeat', str(repeat),
+            '--count', str(count), '--fsync', fsync, '--json', path]
+    if size is not None:
+        argv.extend(['--sizes', str(size)])
+    # the directory holding the pystocks package
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [root] + filter(None, [env.get('PYTHONPATH')]))
+    devnull = open(os.devnull, "w")
+    try:
+        status = subprocess.call(argv, stdout=devnull, env=env)
+        if status != 0:
+            raise RuntimeError("Benchmark %s exited with status %d" %
+                               (name, status))
+        f = open(path)
+        try:
+            return json.load(f)['results']
+        finally:
+            f.close()
+    finally:
+        devnull.close()
+        os.unlink(path)
+
+def run(sizes=SIZES, repeat=5, count=10000, only=None,
+        fsyncs=(FSYNC_NEVER,), isolate=True):
+    """
+    Run the benchmarks and return the list of their results.
+
+    sizes: amount of lots of the benchmarked portfolios
+    repeat: times the slow portfolio operations are run
+    count: times the fast operations (parse, URL building) are run
+    only: names of the benchmarks to run (parse, fetch, portfolio,
+          chart_url), default: all of them
+    fsyncs: journal fsync settings the portfolios are benchmarked with
+            (default: FSYNC_NEVER only)
+    isolate: run every benchmark in its own process, for its peak
+             memory (default: True, requires the json module)
+    """
+    results = []
+    def wanted(name):
+        return only is None or name in only
+
+    if isolate and json is not None:
+        for name in filter(wanted, BENCHMARKS):
+            if name != 'portfolio':
+                results.extend(_isolated(name, repeat, count))
+                continue
+            for size in sizes:
+                for fsync in fsyncs:
+                    results.extend(_isolated(name, repeat, count, size,
+                                             fsync))
+        return results
+
+    server = StandInServer()
+    server.start()
+    previous = Transport.set_transport(server.transport())
+    try:
+        if wanted('parse'):
+            results.extend(bench_parse(server, count))
+        if wanted('fetch'):
+            results.extend(bench_fetch(server, max(count // 100, 1)))
+    finally:
+        Transport.set_transport(previous)
+        server.stop()
+
+    if wanted('portfolio'):
+        for size in sizes:
+            for fsync in fsyncs:
+                results.extend(bench_portfolio(size, repeat, fsync))
+    if wanted('chart_url'):
+        results.extend(bench_chart_url(count))
+    return results
+
+def report(results, previous=None, out=sys.stdout):
+    """
+    Print results, and the throughput relative to previous results.
+    """
+    before = {}
+    for result in previous or []:
+        before[result['name']] = result
+    out.write("%-32s %8s %14s %11s %11s %10s" % (
+        "benchmark", "count", "items/s", "p50 (ms)", "p99 (ms)", "peak (KB)"))
+    if previous:
+        out.write(" %8s" % "change")
+    out.write("\n")
+    for result in results:
+        out.write("%-32s %8d %14.1f %11.3f %11.3f %10d" % (
+            result['name'], result['count'], result['throughput'],
+            result['p50'] * 1000, result['p99'] * 1000,
+            result['peak_memory_kb']))
+        if result['name'] in before:
+            ratio = result['throughput'] / before[result['name']]['throughput']
+            out.write(" %7.2fx" % ratio)
+        out.write("\n")
+
+def main(argv=sys.argv[1:]):
+    from optparse import OptionParser
+
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--sizes", default=",".join(map(str, SIZES)),
+                      help="portfolio sizes, in lots")
+    parser.add_option("--repeat", type="int", default=5)
+    parser.add_option("--count", type="int", default=10000)
+    parser.add_option("--only", default=None,
+                      help="parse, fetch, portfolio and/or chart_url")
+    parser.add_option("--fsync", default=FSYNC_NEVER,
+                      help="journal fsync settings of the portfolios:"
+                           " never, interval and/or always (default: never)")
+    parser.add_option("--no-isolate", dest="isolate", action="store_false",
+                      default=True,
+                      help="run every benchmark in this process")
+    parser.add_option("--json", default=None,
+                      help="write the results to this file")
+    parser.add_option("--compare", default=None,
+                      help="results of a previous run")
+    (options, args) = parser.parse_args(argv)
+    if json is None and (options.json or options.compare):
+        parser.error("--json and --compare require the json module")
+
+    only = None
+    if options.only:
+        only = options.only.split(",")
+    fsyncs = options.fsync.split(",")
+    for fsync in fsyncs:
+        if fsync not in (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER):
+            parser.error("invalid fsync setting: %s" % fsync)
+    results = run([int(size) for size in options.sizes.split(",")],
+                  options.repeat, options.count, only, fsyncs,
+                  options.isolate)
+
+    previous = None
+    if options.compare:
+        f = open(options.compare)
+        try:
+            previous = json.load(f)['results']
+        finally:
+            f.close()
+    report(results, previous)
+
+    if options.json:
+        f = open(options.json, "w")
+        try:
+            json.dump({'time': int(time.time()),
+                       'python': sys.version.split()[0],
+                       'platform': sys.platform,
+                       'results': results}, f, indent=1)
+        finally:
+            f.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+#
+
+"""
+Command line client of PyStocks.
+
+Commands are sent over a Unix domain socket to the PyStocks daemon (see
+Daemon), which keeps the quote cache, the feed connections and the
+loaded portfolios warm between calls. When no daemon answers, the
+command runs in this process and a daemon is started in the background
+for the next calls:
+
+    $ pystocks quote YHOO GOOG
+    $ pystocks portfolio report nicolas
+    $ pystocks daemon status
+
+This module only imports what is needed to talk to the daemon; the
+quote and portfolio modules are imported when a command runs here.
+
+The socket is ~/.pystocks/daemon.sock unless PYSTOCKS_SOCKET or
+--socket name another one. --no-daemon (or PYSTOCKS_NO_DAEMON) runs the
+command here without starting a daemon.
+"""
+
+import os
+import sys
+import errno
+import socket
+
+__revision__ = "$Id$"
+
+USAGE = """\
+usage: pystocks [--no-daemon] [--socket PATH] <command> [options]
+
+commands:
+  quote [--fresh] [-f FORMAT] SYMBOL...
+                                     price, change and volume of symbols
+  portfolio list [-c CONTAINER]      portfolios of a container
+  portfolio report [-c CONTAINER] [--lots] [-f FORMAT] NAME
+                                     value and gains of a portfolio
+  daemon start|stop|status           manage the background daemon
+  help                               show this message
+
+FORMAT is text (default), csv or json.
+"""
+
+# version of the request format, answered with PROTOCOL_ERROR by
+# daemons speaking another one
+PROTOCOL = "1"
+PROTOCOL_ERROR = -1
+
+SOCKET = os.path.join(os.path.expanduser("~/.pystocks"), "daemon.sock")
+
+# seconds to wait for a daemon being started
+START_TIMEOUT = 5.0
+
+class DaemonUnavailable(Exception):
+    """
+    Raised when no daemon answers on the socket.
+    """
+    pass
+
+def socket_path():
+    """
+    Return the path of the daemon socket.
+    """
+    return os.environ.get('PYSTOCKS_SOCKET') or SOCKET
+
+def encode_request(argv, cwd):
+    # arguments can not hold NUL characters
+    return "\0".join([PROTOCOL, cwd] + list(argv))
+
+def decode_request(data):
+    """
+    Return the (protocol, working directory, arguments) of a request.
+    """
+    fields = data.split("\0")
+    if len(fields) < 2:
+        raise ValueError("Malformed request")
+    return (fields[0], fields[1], fields[2:])
+
+def encode_reply(status, output):
+    return "%d\n%s" % (status, output)
+
+def decode_reply(data):
+    """
+    Return the (exit status, output) of a reply.
+    """
+    (status, output) = data.split("\n", 1)
+    return (int(status), output)
+
+def request(argv, path=None, timeout=None):
+    """
+    Run a command in the daemon.
+
+    argv: command and its arguments, e.g. ['quote', 'YHOO']
+    path: daemon socket (default: socket_path())
+    timeout: seconds to wait for the answer (default: no timeout)
+
+    Returns the (exit status, output) of the command. Raises
+    DaemonUnavailable when no daemon listens on path or the daemon
+    speaks another protocol.
+    """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.settimeout(timeout)
+        try:
+            connection.connect(path or socket_path())
+        except socket.error, e:
+            if e.args[0] in (errno.ENOENT, errno.ECONNREFUSED,
+                             errno.ENOTSOCK):
+                raise DaemonUnavailable(str(e))
+            raise
+        chunks = []
+        try:
+            connection.sendall(encode_request(argv, os.getcwd()))
+            connection.shutdown(socket.SHUT_WR)
+            while True:
+                data = connection.recv(65536)
+                if not data:
+                    break
+                chunks.append(data)
+        except socket.error, e:
+            # the daemon is stopping
+            if e.args[0] in (errno.EPIPE, errno.ECONNRESET):
+                raise DaemonUnavailable(str(e))
+            raise
+    finally:
+        connection.close()
+    try:
+        (status, output) = decode_reply("".join(chunks))
+    except ValueError:
+        # the daemon exited while running the command
+        raise DaemonUnavailable("No answer from the daemon")
+    if status == PROTOCOL_ERROR:
+        raise DaemonUnavailable(output.strip())
+    return (status, output)
+
+def start(path=None, wait=START_TIMEOUT):
+    """
+    Start a daemon listening on path in the background.
+
+    wait: seconds to wait for the daemon to answer, 0 to return at
+          once (default: START_TIMEOUT)
+
+    Returns True if the daemon answered.
+    """
+    import time
+    import subprocess
+
+    path = path or socket_path()
+    devnull = open(os.devnull, "r+")
+    try:
+        subprocess.Popen([sys.executable, "-m", "pystocks.Daemon.Daemon",
+                          "--socket", path],
+                         stdin=devnull, stdout=devnull, stderr=devnull,
+                         close_fds=True, preexec_fn=os.setsid)
+    finally:
+        devnull.close()
+    deadline = time.time() + wait
+    while time.time() < deadline:
+        try:
+            request(['daemon', 'status'], path)
+            return True
+        except DaemonUnavailable:
+            time.sleep(0.05)
+    return False
+
+def run_local(argv, out=sys.stdout):
+    """
+    Run a command in this process and return its exit status.
+    """
+    from pystocks.Daemon.Commands import Context, run
+
+    context = Context()
+    try:
+        return run(context, argv, out, os.getcwd())
+    finally:
+        context.close()
+
+def daemon(argv, path, out=sys.stdout):
+    """
+    Run the `daemon start|stop|status' commands.
+    """
+    if argv == ['start']:
+        try:
+            request(['daemon', 'status'], path)
+            out.write("pystocks daemon already running\n")
+            return 0
+        except DaemonUnavailable:
+            pass
+        if start(path):
+            out.write("pystocks daemon started\n")
+            return 0
+        out.write("pystocks daemon did not start\n")
+        return 1
+    if argv in (['stop'], ['status']):
+        try:
+            (status, output) = request(['daemon'] + argv, path)
+        except DaemonUnavailable:
+            out.write("pystocks daemon not running\n")
+            return 1
+        out.write(output)
+        return status
+    out.write(USAGE)
+    return 2
+
+def main(argv=sys.argv[1:]):
+    argv = list(argv)
+    path = socket_path()
+    use_daemon = not os.environ.get('PYSTOCKS_NO_DAEMON')
+    while argv and argv[0].startswith('-'):
+        option = argv.pop(0)
+        if option == '--no-daemon':
+            use_daemon = False
+        elif option == '--socket' and argv:
+            path = argv.pop(0)
+        elif option in ('-h', '--help'):
+            argv = ['help']
+        else:
+            sys.stderr.write(USAGE)
+            sys.exit(2)
+    if not argv or argv[0] == 'help':
+        sys.stdout.write(USAGE)
+        sys.exit(not argv and 2 or 0)
+
+    if argv[0] == 'daemon':
+        sys.exit(daemon(argv[1:], path))
+    if use_daemon:
+        try:
+            (status, output) = request(argv, path)
+        except DaemonUnavailable:
+            pass
+        else:
+            sys.stdout.write(output)
+            sys.exit(status)
+
+    status = run_local(argv)
+    if use_daemon:
+        sys.stdout.flush()
+        start(path, wait=0)
+    sys.exit(status)
+
+if __name__ == '__main__':
+    main()
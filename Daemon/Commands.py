@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+#
+
+"""
+Commands of the pystocks command line tool.
+
+The commands run in the daemon, or in the client when no daemon
+answers (see Client), and write their output to a file-like object
+with Reports.
+A Context keeps the portfolios they load from one command to the next;
+the quote cache and the feed connections are shared by the whole
+process:
+
+    >>> context = Context()
+    >>> run(context, ['quote', '-f', 'csv', 'YHOO'], sys.stdout)
+    symbol,company,price,change,%,volume
+    YHOO,YAHOO INC,25.56,0.38,1.51,21353092
+    0
+"""
+
+import os
+import threading
+
+from optparse import OptionParser
+
+from pystocks.Reports import (FORMATS, QUOTE_COLUMNS, SYMBOL_COLUMNS,
+                              LOT_COLUMNS, render, quote_rows,
+                              valuation_rows, lot_rows)
+from pystocks.YahooFinance import YahooQuoteFinder, FeedError, SymbolError
+from pystocks.PortfolioManager.PortfolioManager import (PortfolioManager,
+                                                        PortfolioError,
+                                                        QuoteFinder)
+from pystocks.PortfolioManager.Aggregate import AggregateManager
+from pystocks.PortfolioManager.SqliteStorage import (is_database,
+                                                     database_path)
+from pystocks.Daemon.Client import USAGE
+
+__revision__ = "$Id$"
+
+# attributes printed by the quote command
+QUOTE_FIELDS = ('company', 'last_price', 'change_cash', 'change_percent',
+                'volume_daily')
+
+class CommandError(Exception):
+    """
+    Raised when a command is given invalid arguments.
+    """
+    pass
+
+class _Parser(OptionParser):
+    """
+    OptionParser raising CommandError instead of exiting the process.
+    """
+    def __init__(self, usage):
+        OptionParser.__init__(self, usage=usage, add_help_option=False)
+
+    def error(self, msg):
+        raise CommandError("%s\npystocks: error: %s" % (self.get_usage(),
+                                                          msg))
+
+    def exit(self, status=0, msg=None):
+        raise CommandError(msg or "")
+
+class Context:
+    """
+    State kept from one command to the next.
+    """
+    def __init__(self, service=QuoteFinder):
+        """
+        service: (callable)
+                 Used to obtain current prices, see PortfolioManager
+                 (default: QuoteFinder)
+        """
+        self.service = service
+        self.portfolios = {}  # (container, name): portfolio
+        self._signatures = {} # (container, name): files when loaded
+        self._locks = {}      # (container, name): lock of the portfolio
+        self._lock = threading.Lock()
+
+    def portfolio(self, name, container):
+        """
+        Return the PortfolioManager of name, loaded on first use.
+
+        Portfolios are loaded without repairing their journal: the
+        process writing to it may be appending its last record.
+        """
+        key = (container, name.lower())
+        self._lock.acquire()
+        try:
+            portfolio = self.portfolios.get(key)
+            if portfolio is None:
+                names = AggregateManager(container).discover()
+                if name not in names and name.lower() not in names:
+                    raise PortfolioError("No such portfolio: %s" % name)
+                self._signatures[key] = _signature(container, name)
+                portfolio = PortfolioManager(name, container, self.service,
+                                             repair=False)
+                self._locks[key] = threading.Lock()
+                self.portfolios[key] = portfolio
+            return portfolio
+        finally:
+            self._lock.release()
+
+    def valuation(self, name, container):
+        """
+        Return the ValuationReport of the portfolio of name, reloaded
+        first if another process changed it since it was loaded.
+
+        The commands valuing a portfolio hold its lock, so a reload
+        never replaces the lots of a valuation in progress.
+        """
+        key = (container, name.lower())
+        portfolio = self.portfolio(name, container)
+        lock = self._locks[key]
+        lock.acquire()
+        try:
+            signature = _signature(container, name)
+            if signature != self._signatures[key]:
+                self._signatures[key] = signature
+                portfolio._reload()
+            return portfolio.getValuation()
+        finally:
+            lock.release()
+
+    def close(self):
+        """
+        Close every loaded portfolio.
+        """
+        self._lock.acquire()
+        try:
+            for (key, portfolio) in self.portfolios.items():
+                lock = self._locks[key]
+                lock.acquire()
+                try:
+                    portfolio.close()
+                finally:
+                    lock.release()
+            self.portfolios = {}
+            self._signatures = {}
+            self._locks = {}
+        finally:
+            self._lock.release()
+
+def _signature(container, name):
+    """
+    Return what changes when another process writes to the portfolio
+    files of name, None for SQLite portfolios which are always read
+    from the database.
+    """
+    if is_database(container):
+        return None
+    path = os.path.join(container, name + ".portfolio")
+    signature = []
+    for filename in (path, path + ".journal"):
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            signature.append(None)
+        else:
+            signature.append((stat.st_ino, stat.st_size, stat.st_mtime))
+    return tuple(signature)
+
+def _container(container, cwd):
+    """
+    Return the absolute form of container, relative paths being
+    relative to cwd (the client's directory).
+    """
+    if is_database(container):
+        return "sqlite:" + os.path.join(cwd, database_path(container))
+    return os.path.join(cwd, os.path.expanduser(container))
+
+def _format_option(parser):
+    parser.add_option("-f", "--format", default="text",
+                      choices=list(FORMATS),
+                      help="text, csv or json (default: text)")
+
+def quote(context, args, out, cwd):
+    parser = _Parser("pystocks quote [--fresh] [-f FORMAT] SYMBOL...")
+    parser.add_option("--fresh", action="store_true", default=False,
+                      help="do not answer from the quote cache")
+    _format_option(parser)
+    (options, symbols) = parser.parse_args(args)
+    if not symbols:
+        parser.error("no symbol given")
+    symbols = [symbol.upper() for symbol in symbols]
+    quotes = YahooQuoteFinder.fetch_many(symbols, fresh=options.fresh,
+                                         fields=QUOTE_FIELDS)
+    render(QUOTE_COLUMNS, quote_rows(quotes, symbols), out, options.format)
+    status = 0
+    for symbol in symbols:
+        if isinstance(quotes[symbol], Exception):
+            if options.format == 'text':
+                out.write("%-8s %s\n" % (symbol, quotes[symbol]))
+            status = 1
+    return status
+
+def portfolio_list(context, args, out, cwd):
+    parser = _Parser("pystocks portfolio list [-c CONTAINER]")
+    parser.add_option("-c", "--container", default="~/.pystocks/",
+                      help="directory or SQLite database")
+    (options, args) = parser.parse_args(args)
+    if args:
+        parser.error("unexpected arguments: %s" % " ".join(args))
+    for name in AggregateManager(_container(options.container,
+                                            cwd)).discover():
+        out.write("%s\n" % name)
+    return 0
+
+def portfolio_report(context, args, out, cwd):
+    parser = _Parser("pystocks portfolio report [-c CONTAINER] [--lots]"
+                     " [-f FORMAT] NAME")
+    parser.add_option("-c", "--container", default="~/.pystocks/",
+                      help="directory or SQLite database")
+    parser.add_option("--lots", action="store_true", default=False,
+                      help="list every batch of shares")
+    _format_option(parser)
+    (options, args) = parser.parse_args(args)
+    if len(args) != 1:
+        parser.error("one portfolio name expected")
+    report = context.valuation(args[0], _container(options.container, cwd))
+
+    # CSV and JSON reports hold a single table
+    if options.format == 'text' or not options.lots:
+        render(SYMBOL_COLUMNS, valuation_rows(report), out, options.format)
+    if options.lots:
+        if options.format == 'text':
+            out.write("\n")
+        render(LOT_COLUMNS, lot_rows(report), out, options.format)
+    return 0
+
+COMMANDS = {
+    ('quote',): quote,
+    ('portfolio', 'list'): portfolio_list,
+    ('portfolio', 'report'): portfolio_report,
+}
+
+def run(context, argv, out, cwd=None):
+    """
+    Run a command and return its exit status.
+
+    context: Context of the process
+    argv: command and its arguments, e.g. ['quote', 'YHOO']
+    out: file-like object receiving the output
+    cwd: directory relative paths are relative to (default: current)
+    """
+    cwd = cwd or os.getcwd()
+    for size in (2, 1):
+        command = COMMANDS.get(tuple(argv[:size]))
+        if command is not None:
+            break
+    else:
+        out.write(USAGE)
+        return 2
+    try:
+        return command(context, argv[size:], out, cwd)
+    except CommandError, e:
+        out.write("%s\n" % e)
+        return 2
+    except (PortfolioError, FeedError, SymbolError), e:
+        out.write("pystocks: error: %s\n" % e)
+        return 1
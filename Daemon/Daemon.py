@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+#
+
+"""
+Long-running PyStocks daemon.
+
+The daemon runs the commands of the pystocks command line tool (see
+Client and Commands) sent over a Unix domain socket. It keeps the quote
+cache, the feed connections and the loaded portfolios between commands,
+so only its first command pays for imports, connections and quote
+downloads. The daemon only reads portfolios, without repairing their
+journal; a portfolio changed by another process is reloaded before its
+next report.
+
+It is started by the client when needed, or from the command line:
+
+    $ python -m pystocks.Daemon.Daemon --socket ~/.pystocks/daemon.sock
+
+It exits after `idle_timeout' seconds without a request, on SIGTERM or
+on `pystocks daemon stop'. The socket is only accessible to its owner
+and a lock file (`<socket>.lock') keeps a second daemon from taking
+the socket of a running one.
+"""
+
+import os
+import sys
+import time
+import fcntl
+import signal
+import threading
+import SocketServer
+
+from cStringIO import StringIO
+
+from pystocks.YahooFinance import Transport
+from pystocks.YahooFinance.QuoteCache import get_cache
+from pystocks.PortfolioManager.PortfolioManager import QuoteFinder
+from pystocks.Daemon.Client import (PROTOCOL, PROTOCOL_ERROR, socket_path,
+                                    decode_request, encode_reply)
+from pystocks.Daemon.Commands import Context, run
+
+__revision__ = "$Id$"
+
+# seconds without a request before the daemon exits
+IDLE_TIMEOUT = 3600
+
+# largest request read, in bytes
+MAX_REQUEST = 65536
+
+class DaemonError(Exception):
+    """
+    Raised when the daemon can not listen on its socket.
+    """
+    pass
+
+class DaemonHandler(SocketServer.StreamRequestHandler):
+    """
+    Run the command of a client and send back its exit status and
+    output.
+    """
+    def handle(self):
+        server = self.server
+        out = StringIO()
+        try:
+            (protocol, cwd, argv) = decode_request(
+                self.rfile.read(MAX_REQUEST))
+        except ValueError:
+            protocol = None
+        if protocol != PROTOCOL:
+            status = PROTOCOL_ERROR
+            out.write("Unsupported protocol: %s\n" % protocol)
+        else:
+            try:
+                status = server.execute(argv, cwd, out)
+            except Exception, e:
+                status = 1
+                out.write("pystocks: internal error: %s\n" % e)
+        self.wfile.write(encode_reply(status, out.getvalue()))
+
+class DaemonServer(SocketServer.ThreadingMixIn,
+                   SocketServer.UnixStreamServer):
+    """
+    Threaded Unix domain socket server running pystocks commands.
+    """
+    daemon_threads = True
+
+    def __init__(self,
+                 path=None,
+                 idle_timeout=IDLE_TIMEOUT,
+                 service=QuoteFinder):
+        """
+        path: socket (default: Client.socket_path())
+        idle_timeout: seconds without a request before serve_forever()
+                      returns, None to serve until stopped
+                      (default: IDLE_TIMEOUT)
+        service: (callable)
+                 Used to obtain current prices, see PortfolioManager
+                 (default: QuoteFinder)
+        """
+        self.path = path or socket_path()
+        self.idle_timeout = idle_timeout
+        self.context = Context(service)
+        self.started = time.time()
+        self.last_request = self.started
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._lock_file = _lock(self.path)
+        try:
+            if os.path.exists(self.path):
+                # left by a daemon that did not exit cleanly
+                os.unlink(self.path)
+            umask = os.umask(077)
+            try:
+                SocketServer.UnixStreamServer.__init__(self, self.path,
+                                                       DaemonHandler)
+            finally:
+                os.umask(umask)
+        except:
+            self._lock_file.close()
+            raise
+
+    def execute(self, argv, cwd, out):
+        """
+        Run a command and return its exit status.
+        """
+        self._lock.acquire()
+        try:
+            self.requests += 1
+            self.last_request = time.time()
+        finally:
+            self._lock.release()
+        if argv == ['daemon', 'status']:
+            self.status(out)
+            return 0
+        if argv == ['daemon', 'stop']:
+            out.write("pystocks daemon stopped\n")
+            self.stop_later()
+            return 0
+        return run(self.context, argv, out, cwd)
+
+    def status(self, out):
+        """
+        Write the state of the daemon to out.
+        """
+        out.write("pid             %d\n" % os.getpid())
+        out.write("socket          %s\n" % self.path)
+        out.write("uptime          %ds\n" % (time.time() - self.started))
+        out.write("requests        %d\n" % self.requests)
+        out.write("portfolios      %d loaded\n" %
+                  len(self.context.portfolios))
+        cache = get_cache()
+        if cache is not None:
+            stats = cache.stats()
+            out.write("quote cache     %d symbols, %d hits, %d misses\n" % (
+                stats['symbols'], stats['hits'], stats['misses']))
+        transport = Transport.get_transport()
+        pool = getattr(transport, 'transport', transport)
+        if hasattr(pool, 'stats'):
+            stats = pool.stats()
+            if 'opened' in stats:
+                out.write("connections     %d opened, %d reused, %d idle\n"
+                          % (stats['opened'], stats['reused'],
+                             stats['idle']))
+
+    def serve_forever(self, poll_interval=0.5):
+        """
+        Serve requests until stopped or idle for idle_timeout seconds,
+        then remove the socket.
+        """
+        if self.idle_timeout is not None:
+            watcher = threading.Thread(target=self._watch_idle)
+            watcher.setDaemon(True)
+            watcher.start()
+        try:
+            SocketServer.UnixStreamServer.serve_forever(self, poll_interval)
+        finally:
+            self.server_close()
+
+    def start(self):
+        """
+        Serve requests from a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop serving requests and remove the socket.
+        """
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def stop_later(self):
+        """
+        Make serve_forever() return, from a request or signal handler.
+        """
+        stopper = threading.Thread(target=self.shutdown)
+        stopper.setDaemon(True)
+        stopper.start()
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        if self._lock_file.closed:
+            return
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        self._lock_file.close()
+        self.context.close()
+
+    def _watch_idle(self):
+        while True:
+            idle = time.time() - self.last_request
+            if idle >= self.idle_timeout:
+                self.shutdown()
+                return
+            time.sleep(min(self.idle_timeout - idle + 0.01, 60))
+
+def _lock(path):
+    """
+    Take the lock of the daemon of the socket path.
+
+    Returns the lock file, kept open while the daemon runs.
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory, 0700)
+    f = open(path + ".lock", "a")
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError:
+        f.close()
+        raise DaemonError("A daemon is already running on %s" % path)
+    return f
+
+def main(argv=sys.argv[1:]):
+    from optparse import OptionParser
+
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--socket", default=socket_path())
+    parser.add_option("--idle-timeout", type="int", default=IDLE_TIMEOUT,
+                      help="seconds, 0 to never exit when idle")
+    (options, args) = parser.parse_args(argv)
+
+    try:
+        server = DaemonServer(options.socket, options.idle_timeout or None)
+    except DaemonError, e:
+        sys.stderr.write("%s\n" % e)
+        sys.exit(1)
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.stop_later())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/python
+#
+
+"""
+Valuation of every portfolio of a container at once.
+
+AggregateManager loads every portfolio of a container (the
+`<name>.portfolio' files of a directory or the portfolios of a SQLite
+database) in parallel, indexes which portfolios hold every symbol,
+prices the union of their symbols once and values every portfolio and
+the whole firm with these prices:
+
+    >>> firm = AggregateManager('~/.pystocks/')
+    >>> firm.load()
+    >>> firm.index['YHOO']
+    ['alice', 'bob']
+    >>> report = firm.run()
+    >>> report.portfolios['alice'].gain
+    1250.25
+    >>> report.symbols['YHOO'].value, report.exposure()['YHOO']
+    (255600.0, 0.12)
+"""
+
+import os
+import time
+import Queue
+import threading
+
+from pystocks.PortfolioManager.PortfolioManager import (PortfolioManager,
+                                                        QuoteFinder,
+                                                        get_prices)
+from pystocks.PortfolioManager.Journal import FSYNC_ALWAYS
+from pystocks.PortfolioManager.Valuation import ValuationEngine, SymbolValue
+from pystocks.PortfolioManager.SqliteStorage import (is_database,
+                                                     database_path,
+                                                     portfolios)
+
+__revision__ = "$Id$"
+
+class AggregateReport:
+    """
+    Value of many portfolios at a given time.
+
+    time: when the prices were obtained (Epoch format)
+    prices: dictionary of the price per share of every symbol
+    portfolios: dictionary of the ValuationReport of every portfolio
+    symbols: dictionary of the firm-wide SymbolValue of every symbol
+    cost, value, gain: totals of every portfolio
+    """
+    def __init__(self, when, prices, portfolios):
+        self.time = when
+        self.prices = prices
+        self.portfolios = portfolios
+
+        totals = {}
+        for report in portfolios.values():
+            for value in report.symbols.values():
+                total = totals.setdefault(value.symbol, [0, 0.0, 0.0])
+                total[0] += value.amount
+                total[1] += value.cost
+                total[2] += value.value
+        self.symbols = {}
+        for (symbol, (amount, cost, value)) in totals.items():
+            self.symbols[symbol] = SymbolValue(symbol, amount, prices[symbol],
+                                               cost, value, value - cost)
+        self.cost = sum([s.cost for s in self.symbols.values()])
+        self.value = sum([s.value for s in self.symbols.values()])
+        self.gain = self.value - self.cost
+
+    def exposure(self):
+        """
+        Return a dictionary of the share of the firm's value held in
+        every symbol.
+        """
+        exposure = {}
+        for (symbol, value) in self.symbols.items():
+            if self.value:
+                exposure[symbol] = value.value / self.value
+            else:
+                exposure[symbol] = 0.0
+        return exposure
+
+    def __repr__(self):
+        return ("<AggregateReport portfolios=%d value=%.2f cost=%.2f"
+                " gain=%.2f>" % (len(self.portfolios), self.value,
+                                 self.cost, self.gain))
+
+class AggregateManager:
+    """
+    Manage every portfolio of a container.
+    """
+    def __init__(self,
+                 container=os.path.expanduser("~/.pystocks/"),
+                 service=QuoteFinder,
+                 concurrency=8,
+                 fsync=FSYNC_ALWAYS):
+        """
+        container: portfolio container, see PortfolioManager
+                   (default: ~/.pystocks)
+        service: (callable)
+                 Used to obtain current prices, see PortfolioManager
+                 (default: QuoteFinder)
+        concurrency: portfolios loaded at the same time (default: 8)
+        fsync: see PortfolioManager (default: FSYNC_ALWAYS)
+        """
+        if concurrency < 1:
+            raise ValueError("concurrency must be positive")
+        self.container = container
+        self.service = service
+        self.concurrency = concurrency
+        self.fsync = fsync
+        self.portfolios = {}
+        self.errors = {}   # portfolios that could not be loaded
+        self.index = {}    # symbol: names of the portfolios holding it
+
+    def discover(self):
+        """
+        Return the names of the portfolios of the container.
+        """
+        if is_database(self.container):
+            return portfolios(database_path(self.container))
+        directory = os.path.expanduser(self.container)
+        if not os.path.isdir(directory):
+            return []
+        names = {}
+        for name in os.listdir(directory):
+            # not compacted yet portfolios only have their journal
+            if name.endswith(".journal"):
+                name = name[:-len(".journal")]
+            if name.endswith(".portfolio"):
+                names[name[:-len(".portfolio")]] = True
+        return sorted(names)
+
+    def load(self, names=None):
+        """
+        Load portfolios in parallel, every portfolio of the container
+        by default, and index their symbols. They are only read: a
+        transaction being written by another process is left in their
+        journal, not repaired.
+
+        Portfolios that could not be loaded are left out and their
+        error is kept in `errors'.
+        """
+        if names is None:
+            names = self.discover()
+        queue = Queue.Queue()
+        for name in names:
+            queue.put(name)
+        lock = threading.Lock()
+        workers = []
+        for i in range(min(self.concurrency, len(names))):
+            worker = threading.Thread(target=self._work, args=(queue, lock))
+            worker.setDaemon(True)
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.join()
+        self._index()
+
+    def symbols(self):
+        """
+        Return the symbols held by any portfolio.
+        """
+        return sorted(self.index)
+
+    def run(self, prices=None):
+        """
+        Price every symbol once and return the AggregateReport of the
+        loaded portfolios.
+
+        prices: dictionary of prices to use instead of obtaining
+                them from the service
+        """
+        when = int(time.time())
+        if prices is None:
+            prices = get_prices(self.service, self.symbols())
+        reports = {}
+        for (name, portfolio) in self.portfolios.items():
+            reports[name] = ValuationEngine(portfolio).run(prices)
+        return AggregateReport(when, prices, reports)
+
+    def close(self):
+        """
+        Close every loaded portfolio.
+        """
+        for portfolio in self.portfolios.values():
+            portfolio.close()
+        self.portfolios = {}
+        self.index = {}
+
+    def _work(self, queue, lock):
+        while True:
+            try:
+                name = queue.get_nowait()
+            except Queue.Empty:
+                break
+            try:
+                portfolio = PortfolioManager(name, self.container,
+                                             self.service, self.fsync,
+                                             repair=False)
+                error = None
+            except Exception, e:
+                portfolio = None
+                error = e
+            lock.acquire()
+            try:
+                if error is None:
+                    self.portfolios[name] = portfolio
+                    self.errors.pop(name, None)
+                else:
+                    self.errors[name] = error
+            finally:
+                lock.release()
+
+    def _index(self):
+        index = {}
+        for (name, portfolio) in self.portfolios.items():
+            for symbol in portfolio.stocks:
+                index.setdefault(symbol, []).append(name)
+        for names in index.values():
+            names.sort()
+        self.index = index
@@ -0,0 +1,416 @@
+#!/usr/bin/python
+#
+
+"""
+Append-only transaction journal of a portfolio.
+
+A portfolio is stored as a snapshot (the pickled dictionary of the
+LotArray of every symbol and the realized sales, `<name>.portfolio')
+and a journal of the transactions applied since
+(`<name>.portfolio.journal'). Transactions are appended to the journal
+instead of rewriting the whole portfolio. Once the journal holds enough
+records it is compacted: a new snapshot is written to a temporary file
+and renamed over the previous one, then the journal is emptied.
+
+Every record carries a sequence number and the snapshot holds the
+number of the last record it contains, so records that were compacted
+are never applied twice, even after a crash between the rename and the
+emptying of the journal. A record that was only partially written when
+the process died is discarded on load, and cut off the journal unless
+the portfolio is loaded without repair by a reader (the daemon) while
+another process may be appending that record.
+"""
+
+import os
+import time
+import cPickle
+
+from pystocks.YahooFinance import Instrumentation
+from pystocks.PortfolioManager.Lots import LotArray, from_containers
+from pystocks.PortfolioManager.Matching import FIFO
+
+__revision__ = "$Id$"
+
+# fsync policies
+FSYNC_ALWAYS = 'always'      # fsync every record, nothing is ever lost
+FSYNC_INTERVAL = 'interval'  # fsync at most every `fsync_interval' seconds
+FSYNC_NEVER = 'never'        # leave it to the operating system
+
+class JournalError(Exception):
+    """
+    Raised when a portfolio can not be read or written.
+    """
+    pass
+
+class Journal:
+    """
+    Snapshot + append-only journal storage.
+    """
+    def __init__(self,
+                 path,
+                 fsync=FSYNC_ALWAYS,
+                 fsync_interval=1.0,
+                 compact_every=1000):
+        """
+        path: snapshot file, the journal is kept in `path'.journal
+        fsync: FSYNC_ALWAYS, FSYNC_INTERVAL or FSYNC_NEVER
+               (default: FSYNC_ALWAYS)
+        fsync_interval: seconds between fsyncs with FSYNC_INTERVAL
+        compact_every: compact after this many records (default: 1000)
+        """
+        if fsync not in (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER):
+            raise ValueError("Invalid fsync policy: %s" % fsync)
+        self.path = path
+        self.journal = path + ".journal"
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+        self.seq = 0      # sequence number of the last record
+        self.records = 0  # records in the journal
+        self.sales = []   # realized sales, saved with the snapshot
+        self._file = None
+        self._synced = time.time()
+
+    def load(self, apply, repair=True):
+        """
+        Load the snapshot and replay the journal.
+
+        apply: callable receiving the stocks dictionary and every
+               record tuple to replay, in order
+        repair: cut a partially written last record off the journal,
+                False when another process may be writing it
+                (default: True)
+
+        Returns the stocks dictionary, the sales of the snapshot are
+        in `sales'.
+        """
+        start = Instrumentation.enabled and time.time()
+        self.close()
+        (stocks, self.seq, self.sales) = self._load_snapshot()
+        self.records = 0
+        if os.path.isfile(self.journal):
+            self._replay(stocks, apply, repair)
+        if start:
+            Instrumentation.observe('storage.reload', time.time() - start)
+        return stocks
+
+    def _replay(self, stocks, apply, repair=True):
+        """
+        Apply the records of the journal that are not in the snapshot
+        to stocks, and cut a partially written last record if repair
+        is set.
+        """
+        f = open(self.journal, "rb")
+        try:
+            good = 0
+            while True:
+                try:
+                    record = cPickle.load(f)
+                except EOFError:
+                    break
+                except Exception:
+                    break # partially written record
+                good = f.tell()
+                if record[0] <= self.seq:
+                    continue # already in the snapshot
+                self.seq = record[0]
+                self.records += 1
+                apply(stocks, record[1:])
+            truncated = good < os.path.getsize(self.journal)
+        finally:
+            f.close()
+
+        if truncated and repair:
+            f = open(self.journal, "r+b")
+            try:
+                f.truncate(good)
+            finally:
+                f.close()
+
+    def append(self, *record):
+        """
+        Append a record to the journal.
+
+        Returns True when the journal should be compacted.
+        """
+        start = Instrumentation.enabled and time.time()
+        if self._file is None:
+            self._file = open(self.journal, "ab")
+        self.seq += 1
+        cPickle.dump((self.seq,) + record, self._file,
+                     cPickle.HIGHEST_PROTOCOL)
+        self._file.flush()
+        if self.fsync == FSYNC_ALWAYS or (
+            self.fsync == FSYNC_INTERVAL and
+            time.time() - self._synced >= self.fsync_interval):
+            os.fsync(self._file.fileno())
+            self._synced = time.time()
+        self.records += 1
+        if start:
+            Instrumentation.observe('storage.append', time.time() - start)
+        return self.records >= self.compact_every
+
+    def compact(self, stocks):
+        """
+        Write stocks as the new snapshot and empty the journal.
+        """
+        start = Instrumentation.enabled and time.time()
+        tmp = self.path + ".tmp"
+        f = open(tmp, "wb")
+        try:
+            cPickle.dump(stocks, f, cPickle.HIGHEST_PROTOCOL)
+            cPickle.dump(self.seq, f, cPickle.HIGHEST_PROTOCOL)
+            cPickle.dump(self.sales, f, cPickle.HIGHEST_PROTOCOL)
+            f.flush()
+            if self.fsync != FSYNC_NEVER:
+                os.fsync(f.fileno())
+        finally:
+            f.close()
+        if os.name == 'nt' and os.path.exists(self.path):
+            os.remove(self.path) # rename does not replace files
+        os.rename(tmp, self.path)
+        self._sync_directory()
+
+        self.close()
+        f = open(self.journal, "wb")
+        f.close()
+        self.records = 0
+        if start:
+            Instrumentation.observe('storage.save', time.time() - start)
+
+    def sync(self):
+        """
+        Force the journal to disk.
+        """
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._synced = time.time()
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+    def _load_snapshot(self):
+        """
+        Return the (stocks, sequence number, sales) of the snapshot.
+        Snapshots written before the journal existed only hold the
+        stocks, those written before sales were recorded have no sales.
+        """
+        if not os.path.isfile(self.path):
+            return ({}, 0, [])
+        f = open(self.path, "rb")
+        try:
+            try:
+                stocks = cPickle.load(f)
+            except Exception, e:
+                raise JournalError("Could not load %s: %s" % (self.path, e))
+            try:
+                seq = cPickle.load(f)
+            except EOFError:
+                seq = 0
+            try:
+                sales = cPickle.load(f)
+            except EOFError:
+                sales = []
+        finally:
+            f.close()
+        return (stocks, seq, sales)
+
+    def _sync_directory(self):
+        if self.fsync == FSYNC_NEVER or not hasattr(os, 'O_DIRECTORY'):
+            return
+        fd = os.open(os.path.dirname(os.path.abspath(self.path)),
+                     os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+class JournalStorage:
+    """
+    Portfolio storage kept in memory, persisted with a Journal.
+    """
+    def __init__(self,
+                 path,
+                 service=None,
+                 fsync=FSYNC_ALWAYS,
+                 compact_every=1000,
+                 repair=True):
+        """
+        path: portfolio file
+        service: callable used to obtain price per share with
+                 the getCurrentPrice methode, given to every LotArray
+        fsync: see Journal (default: FSYNC_ALWAYS)
+        compact_every: see Journal (default: 1000)
+        repair: see Journal.load(), False for processes that only read
+                the portfolio (default: True)
+        """
+        self.service = service
+        self.repair = repair
+        self.version = 0 # changed by every transaction
+        self.journal = Journal(path,
+                               fsync=fsync,
+                               compact_every=compact_every)
+        self.reload()
+
+    def add(self, symbol, amount, price, epoch):
+        """
+        Add a batch of shares of symbol.
+        """
+        self._apply(self.stocks, ('add', symbol, amount, price, epoch))
+        self._log('add', symbol, amount, price, epoch)
+
+    def add_many(self, lots, chunk_size=1000):
+        """
+        Add (symbol, amount, price, epoch) batches of shares in a single
+        transaction: one journal record for up to chunk_size batches,
+        a new snapshot for more. lots may be a generator; nothing is
+        added if it raises.
+
+        Returns the amount of batches added.
+        """
+        added = []
+        count = 0
+        try:
+            for (symbol, amount, price, epoch) in lots:
+                self._apply(self.stocks, ('add', symbol, amount, price, epoch))
+                if count < chunk_size:
+                    added.append((symbol, amount, price, epoch))
+                count += 1
+        except:
+            self.reload() # forget what was applied
+            raise
+        if count > chunk_size:
+            self.version += 1
+            self.save()
+        elif added:
+            self._log('add_many', added)
+        return count
+
+    def set(self, symbol, lots):
+        """
+        Replace the batches of shares of symbol by lots, a list of
+        (amount, price, epoch) tuples.
+        """
+        if not lots:
+            return self.delete(symbol)
+        self._apply(self.stocks, ('set', symbol, lots))
+        self._log('set', symbol, lots)
+
+    def delete(self, symbol):
+        """
+        Remove every batch of shares of symbol.
+        """
+        del(self.stocks[symbol])
+        self._log('del', symbol)
+
+    def candidates(self, symbol, method=FIFO, indexes=None, price=None):
+        """
+        Iterate over the (index, amount, price, epoch) of the batches of
+        shares of symbol in the order of method, see Matching.
+        """
+        return self.stocks[symbol].candidates(method, indexes, price)
+
+    def reduce(self, symbol, changes, sale=None):
+        """
+        Apply the (index, shares left) changes of Matching.match() to
+        the batches of shares of symbol and record sale, in a single
+        transaction that only holds the batches touched.
+        """
+        self._apply(self.stocks, ('reduce', symbol, changes, sale))
+        self._log('reduce', symbol, changes, sale)
+
+    def sales(self, symbol=None):
+        """
+        Return the Sale list of symbol, or of every symbol.
+        """
+        return [sale for sale in self.journal.sales
+                if symbol is None or sale.symbol == symbol]
+
+    def position(self, symbol):
+        """
+        Return the (amount of shares, price paid) of symbol.
+        """
+        return self.stocks[symbol].position()
+
+    def positions(self):
+        """
+        Return a dictionary of the (amount of shares, price paid)
+        of every symbol.
+        """
+        positions = {}
+        for (symbol, lots) in self.stocks.items():
+            positions[symbol] = lots.position()
+        return positions
+
+    def rows(self):
+        """
+        Iterate over the (symbol, amount, price, epoch) of every
+        batch of shares.
+        """
+        for (symbol, lots) in self.stocks.items():
+            for (amount, price, epoch) in lots.rows():
+                yield (symbol, amount, price, epoch)
+
+    def save(self):
+        """
+        Write the whole portfolio and empty the journal.
+        """
+        self.journal.compact(self.stocks)
+
+    def reload(self):
+        """
+        Load the last saved portfolio and replay the journal.
+        Portfolios saved as lists of StockContainer are converted.
+        """
+        stocks = self.journal.load(self._apply, self.repair)
+        for (symbol, lots) in stocks.items():
+            if not isinstance(lots, LotArray):
+                lots = stocks[symbol] = from_containers(symbol, self.service,
+                                                        lots)
+            lots.service = self.service
+        self.stocks = stocks
+        self.version += 1
+
+    def close(self):
+        self.journal.close()
+
+    def _log(self, *record):
+        self.version += 1
+        if self.journal.append(*record):
+            self.save()
+
+    def _apply(self, stocks, record):
+        if record[0] == 'add':
+            (action, symbol, amount, price, epoch) = record
+            lots = stocks.get(symbol)
+            if lots is None:
+                lots = stocks[symbol] = LotArray(symbol, self.service)
+            elif not isinstance(lots, LotArray):
+                lots = stocks[symbol] = from_containers(symbol, self.service,
+                                                        lots)
+            lots.append(amount, price, epoch)
+        elif record[0] == 'add_many':
+            for (symbol, amount, price, epoch) in record[1]:
+                self._apply(stocks, ('add', symbol, amount, price, epoch))
+        elif record[0] == 'set':
+            (action, symbol, lots) = record
+            stocks[symbol] = LotArray(symbol, self.service, lots)
+        elif record[0] == 'del':
+            stocks.pop(record[1], None)
+        elif record[0] == 'reduce':
+            (action, symbol, changes, sale) = record
+            lots = stocks[symbol]
+            if not isinstance(lots, LotArray):
+                lots = stocks[symbol] = from_containers(symbol, self.service,
+                                                        lots)
+            lots.reduce(changes)
+            if not len(lots):
+                del(stocks[symbol])
+            if sale is not None:
+                self.journal.sales.append(sale)
+        else:
+            raise JournalError("Unknown transaction: %r" % (record,))
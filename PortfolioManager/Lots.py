@@ -0,0 +1,267 @@
+#!/usr/bin/python
+#
+
+"""
+Columnar storage of the batches of shares of a symbol.
+
+A LotArray keeps the amount, price paid and time bought of every batch
+of shares in three parallel arrays: a batch costs 24 bytes instead of a
+whole StockContainer instance, pickling writes the arrays as raw
+buffers and totals are computed over contiguous memory (with NumPy when
+it is installed).
+
+Indexing a LotArray returns a LotView, which behaves like the
+StockContainer it replaces:
+
+    >>> lots = LotArray('YHOO', QuoteFinder, [(100, 25.56, 1166800000)])
+    >>> lots[0].amount
+    100
+    >>> lots[0].getInitialValue()
+    2556.0
+    >>> lots.position()
+    (100, 2556.0)
+"""
+
+import sys
+import time
+import array
+import struct
+
+from pystocks.PortfolioManager.Matching import FIFO, order
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__revision__ = "$Id$"
+
+_INTEGER = 'l'
+_FLOAT = 'd'
+
+class LotView(object):
+    """
+    A batch of shares stored in a LotArray.
+    """
+    __slots__ = ('lots', 'index')
+
+    def __init__(self, lots, index):
+        self.lots = lots
+        self.index = index
+
+    def _get_symbol(self):
+        return self.lots.symbol
+
+    symbol = property(_get_symbol)
+
+    def _get_service(self):
+        return self.lots.service
+
+    service = property(_get_service)
+
+    def _get_amount(self):
+        return self.lots.amounts[self.index]
+
+    def _set_amount(self, amount):
+        self.lots.amounts[self.index] = int(amount)
+
+    amount = property(_get_amount, _set_amount)
+
+    def _get_price(self):
+        return self.lots.prices[self.index]
+
+    def _set_price(self, price):
+        self.lots.prices[self.index] = float(price)
+
+    price = property(_get_price, _set_price)
+
+    def _get_time(self):
+        return self.lots.epochs[self.index]
+
+    def _set_time(self, epoch):
+        self.lots.epochs[self.index] = int(epoch)
+
+    time = property(_get_time, _set_time)
+
+    def getInitialValue(self):
+        """
+        Price paid. (float)
+        """
+        return float(self.price * self.amount)
+
+    def getCurrentValue(self):
+        """
+        Current sell value. (float)
+        """
+        price = self.service().getCurrentPrice(self.symbol)
+        return float(price * self.amount)
+
+    def getTotalGains(self):
+        """
+        Total gains. (float)
+        """
+        return self.getCurrentValue() - self.getInitialValue()
+
+    def owned_time(self):
+        """
+        Amount of days owned (int)
+        """
+        raise NotImplementedError #TODO
+
+    def __repr__(self):
+        return "<%s %d @ %.2f (%d)>" % (self.symbol, self.amount,
+                                        self.price, self.time)
+
+class LotArray(object):
+    """
+    Batches of shares of one symbol, oldest first.
+    """
+    __slots__ = ('symbol', 'service', 'amounts', 'prices', 'epochs')
+
+    def __init__(self, symbol, service=None, lots=()):
+        """
+        symbol: security
+        service: callable used to obtain price per share with
+                 the getCurrentPrice methode (not saved)
+        lots: (amount, price, epoch) tuples
+        """
+        self.symbol = symbol
+        self.service = service
+        self.amounts = array.array(_INTEGER)
+        self.prices = array.array(_FLOAT)
+        self.epochs = array.array(_INTEGER)
+        for (amount, price, epoch) in lots:
+            self.append(amount, price, epoch)
+
+    def append(self, amount, price, epoch):
+        self.amounts.append(int(amount))
+        self.prices.append(float(price))
+        self.epochs.append(int(epoch))
+
+    def __len__(self):
+        return len(self.amounts)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.amounts)
+        if not 0 <= index < len(self.amounts):
+            raise IndexError("lot index out of range")
+        return LotView(self, index)
+
+    def __delitem__(self, index):
+        del self.amounts[index]
+        del self.prices[index]
+        del self.epochs[index]
+
+    def __iter__(self):
+        for index in xrange(len(self.amounts)):
+            yield LotView(self, index)
+
+    def candidates(self, method=FIFO, indexes=None, price=None):
+        """
+        Iterate over the (index, amount, price, epoch) of the batches of
+        shares in the order of method, see Matching.order().
+        """
+        for index in order(self.amounts, self.prices, method, indexes, price):
+            yield (index, self.amounts[index], self.prices[index],
+                   self.epochs[index])
+
+    def reduce(self, changes):
+        """
+        Apply (index, shares left) changes: batches left without shares
+        are removed, the others keep their place.
+        """
+        empty = []
+        for (index, left) in changes:
+            if left:
+                self.amounts[index] = int(left)
+            else:
+                empty.append(index)
+        empty.sort()
+        # delete runs of consecutive batches at once, last run first
+        while empty:
+            end = empty.pop()
+            start = end
+            while empty and empty[-1] == start - 1:
+                start = empty.pop()
+            del self.amounts[start:end + 1]
+            del self.prices[start:end + 1]
+            del self.epochs[start:end + 1]
+
+    def rows(self):
+        """
+        Return the (amount, price, epoch) of every batch of shares.
+        """
+        return zip(self.amounts, self.prices, self.epochs)
+
+    def amount(self):
+        """
+        Total amount of shares.
+        """
+        return sum(self.amounts)
+
+    def cost(self):
+        """
+        Total price paid.
+        """
+        if numpy is not None and len(self.amounts) > 64:
+            return float(numpy.dot(numpy.frombuffer(self.amounts, numpy.int_),
+                                   numpy.frombuffer(self.prices,
+                                                    numpy.float64)))
+        total = 0.0
+        for (amount, price) in zip(self.amounts, self.prices):
+            total += amount * price
+        return total
+
+    def position(self):
+        """
+        Return the (amount of shares, price paid).
+        """
+        return (self.amount(), self.cost())
+
+    def __getstate__(self):
+        return (self.symbol,
+                sys.byteorder,
+                self.amounts.itemsize,
+                self.amounts.tostring(),
+                self.prices.tostring(),
+                self.epochs.tostring())
+
+    def __setstate__(self, state):
+        (self.symbol, byteorder, itemsize, amounts, prices, epochs) = state
+        self.service = None
+        self.amounts = _load(_INTEGER, amounts, byteorder, itemsize)
+        self.prices = _load(_FLOAT, prices, byteorder, 8)
+        self.epochs = _load(_INTEGER, epochs, byteorder, itemsize)
+
+    def __repr__(self):
+        return repr(list(self))
+
+def _load(typecode, data, byteorder, itemsize):
+    """
+    Rebuild an array saved on a platform with another byte order or
+    integer size if needed.
+    """
+    values = array.array(typecode)
+    if itemsize == values.itemsize:
+        values.fromstring(data)
+        if byteorder != sys.byteorder:
+            values.byteswap()
+        return values
+    if byteorder == 'little':
+        endian = '<'
+    else:
+        endian = '>'
+    format = {4: 'i', 8: 'q'}[itemsize]
+    count = len(data) // itemsize
+    values.extend(struct.unpack("%s%d%s" % (endian, count, format), data))
+    return values
+
+def from_containers(symbol, service, containers):
+    """
+    Convert a list of StockContainer (portfolios saved before
+    LotArray existed) to a LotArray.
+    """
+    return LotArray(symbol, service,
+                    [(c.amount, c.price, c.time or int(time.time()))
+                     for c in containers])
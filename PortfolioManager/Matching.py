@@ -0,0 +1,117 @@
+#!/usr/bin/python
+#
+
+"""
+Selection of the batches of shares removed or sold from a portfolio.
+
+The storages list the batches of shares of a symbol as candidates, in
+the order given by the matching method, and match() takes shares from
+them until the requested amount is reached. Candidates are produced
+lazily, so only the batches actually touched are read and rewritten:
+
+    FIFO          oldest batches first
+    LIFO          newest batches first
+    HIGHEST_COST  batches bought at the highest price first
+    SPECIFIC      the given batches, by index, in the given order
+
+Shares sold are recorded as a Sale, with the part of every batch that
+was sold (a Fill) and the realized gain:
+
+    >>> sale = pm.sell('YHOO', 150, 27.10, method=HIGHEST_COST)
+    >>> sale.gain
+    210.5
+    >>> sale.lots
+    (Fill(amount=100, price=25.56, epoch=1166800000),
+     Fill(amount=50, price=26.05, epoch=1166900000))
+"""
+
+import heapq
+
+from collections import namedtuple
+
+__revision__ = "$Id$"
+
+# matching methods
+FIFO = 'fifo'
+LIFO = 'lifo'
+HIGHEST_COST = 'highest-cost'
+SPECIFIC = 'specific'
+
+METHODS = (FIFO, LIFO, HIGHEST_COST, SPECIFIC)
+
+Fill = namedtuple('Fill', 'amount price epoch')
+Sale = namedtuple('Sale',
+                  'symbol amount price epoch cost proceeds gain lots')
+
+def order(amounts, prices, method=FIFO, indexes=None, price=None):
+    """
+    Iterate over the positions of the batches held in the parallel
+    amounts and prices sequences, in the order of method.
+
+    indexes: batches to use with SPECIFIC
+    price: only use batches bought at price
+    """
+    if method == FIFO:
+        positions = xrange(len(amounts))
+    elif method == LIFO:
+        positions = xrange(len(amounts) - 1, -1, -1)
+    elif method == HIGHEST_COST:
+        positions = _by_cost(prices)
+    elif method == SPECIFIC:
+        positions = indexes or ()
+        for index in positions:
+            if not 0 <= index < len(amounts):
+                raise IndexError("lot index out of range: %s" % index)
+    else:
+        raise ValueError("Unknown matching method: %s" % method)
+    for index in positions:
+        if price is None or prices[index] == price:
+            yield index
+
+def _by_cost(prices):
+    """
+    Iterate over the positions of prices, highest first, oldest first
+    among equal prices. The heap is built in linear time and every
+    position taken costs a logarithmic pop.
+    """
+    heap = [(-paid, index) for (index, paid) in enumerate(prices)]
+    heapq.heapify(heap)
+    while heap:
+        yield heapq.heappop(heap)[1]
+
+def match(candidates, amount=0):
+    """
+    Take amount shares (default: 0, every share) from candidates,
+    (key, amount, price, epoch) tuples, in order, stopping at the
+    first candidate not needed.
+
+    Returns a list of (key, shares left, Fill) for every batch touched.
+    """
+    matched = []
+    wanted = int(amount)
+    for (key, available, paid, epoch) in candidates:
+        if wanted:
+            if not available:
+                continue
+            taken = min(available, wanted)
+        else:
+            taken = available
+        matched.append((key, available - taken, Fill(taken, paid, epoch)))
+        if wanted:
+            wanted -= taken
+            if not wanted:
+                break
+    return matched
+
+def make_sale(symbol, price, epoch, fills):
+    """
+    Return the Sale of the shares of fills at price.
+    """
+    amount = 0
+    cost = 0.0
+    for fill in fills:
+        amount += fill.amount
+        cost += fill.amount * fill.price
+    proceeds = float(amount * price)
+    return Sale(symbol, amount, float(price), int(epoch), cost, proceeds,
+                proceeds - cost, tuple(fills))
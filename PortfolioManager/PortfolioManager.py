@@ -4,9 +4,21 @@
 
 import os
 import time
-import cPickle
-
-from pystocks.YahooFinance import YahooQuoteFinder, SymbolError, FeedError
+import threading
+
+from pystocks.YahooFinance import YahooQuoteFinder, SymbolError, FeedError, NA
+from pystocks.YahooFinance import Instrumentation
+from pystocks.YahooFinance.QuoteCache import get_cache
+from pystocks.YahooFinance.AsyncQuoteFinder import (AsyncQuoteFinder,
+                                                    PRICE_FIELDS)
+from pystocks.PortfolioManager.Journal import JournalStorage, FSYNC_ALWAYS
+from pystocks.PortfolioManager.Valuation import ValuationEngine
+from pystocks.PortfolioManager.Matching import (FIFO, SPECIFIC, METHODS,
+                                                match, make_sale)
+from pystocks.PortfolioManager.SqliteStorage import (SqliteStorage,
+                                                     SqliteError,
+                                                     is_database,
+                                                     database_path)
 
 __version__ = "$Id$"
 
@@ -16,10 +28,42 @@ class PortfolioError(Exception):
     """
     pass
 
+class StalePrice(float):
+    """
+    Last known price of a stock, given by QuoteFinder while its
+    current price is being obtained.
+
+    age: seconds since the price was obtained
+    """
+    stale = True
+
+    def __new__(cls, price, age):
+        self = float.__new__(cls, price)
+        self.age = age
+        return self
+
+    def __repr__(self):
+        return "StalePrice(%r, age=%.1f)" % (float(self), self.age)
+
 class QuoteFinder(YahooQuoteFinder):
     """
     Gives the current price of a stock to PortfolioManager.
+
+    Stale-while-revalidate: when max_stale is set, a price that expired
+    from the quote cache less than max_stale seconds ago is returned at
+    once as a StalePrice while it is refreshed in the background, so a
+    slow or failing feed does not stall valuations.
+
+        >>> QuoteFinder.max_stale = 300
     """
+    # shared by every instance, started on first use
+    finder = None
+    # seconds a stale price may be returned, None disables it
+    max_stale = None
+    # symbols being refreshed in the background
+    _refreshing = {}
+    _refresh_lock = threading.Lock()
+
     def __init__(self):
         pass
     
@@ -28,14 +72,121 @@ class QuoteFinder(YahooQuoteFinder):
         This is called by a PortfolioManager instance and
         returns a float.
         """
+        start = Instrumentation.enabled and time.time()
+        try:
+            return self._get_price(symbol)
+        finally:
+            if start:
+                Instrumentation.observe('portfolio.price',
+                                        time.time() - start)
+
+    def _get_price(self, symbol):
+        cache = get_cache()
+        if cache is not None:
+            price = cache.get(symbol, 'l1')
+            if price is NA:
+                raise PortfolioError("No price available for: %s" % symbol)
+            if price is not None:
+                return price
+            price = self._get_stale(symbol)
+            if price is not None:
+                self._revalidate([symbol])
+                return price
+
         try:
-            YahooQuoteFinder.__init__(self, symbol)
+            YahooQuoteFinder.__init__(self, symbol, PRICE_FIELDS)
         except SymbolError, e:
             raise PortfolioError(e)
         except FeedError, e:
             raise PortfolioError(e)
 
-        return float(self.last_price)
+        if self.last_price is NA:
+            raise PortfolioError("No price available for: %s" % symbol)
+        return self.last_price
+
+    def getCurrentPrices(self, symbols):
+        """
+        Look up the price of many stocks concurrently and
+        return a dictionary of floats.
+        """
+        prices = {}
+        cache = get_cache()
+        if QuoteFinder.max_stale is not None and cache is not None:
+            for symbol in symbols:
+                if cache.get(symbol, 'l1') is None:
+                    price = self._get_stale(symbol)
+                    if price is not None:
+                        prices[symbol] = price
+            self._revalidate(list(prices))
+
+        missing = [symbol for symbol in symbols if symbol not in prices]
+        if missing:
+            if QuoteFinder.finder is None:
+                QuoteFinder.finder = AsyncQuoteFinder()
+            found = QuoteFinder.finder.getCurrentPrices(missing)
+            for price in found.values():
+                if isinstance(price, Exception):
+                    raise PortfolioError(price)
+            prices.update(found)
+        return prices
+
+    def _get_stale(self, symbol):
+        """
+        Return the StalePrice of symbol, or None when stale prices are
+        disabled or the last known price is too old.
+        """
+        cache = get_cache()
+        if QuoteFinder.max_stale is None or cache is None:
+            return None
+        found = cache.get_stale(symbol, 'l1')
+        if found is None:
+            return None
+        (price, age) = found
+        if price is NA or age > QuoteFinder.max_stale:
+            return None
+        if Instrumentation.enabled:
+            Instrumentation.count('quote.stale')
+        return StalePrice(price, age)
+
+    def _revalidate(self, symbols):
+        """
+        Refresh the price of symbols in a background thread, except the
+        symbols already being refreshed.
+        """
+        QuoteFinder._refresh_lock.acquire()
+        try:
+            symbols = [symbol for symbol in symbols
+                       if symbol not in QuoteFinder._refreshing]
+            for symbol in symbols:
+                QuoteFinder._refreshing[symbol] = True
+        finally:
+            QuoteFinder._refresh_lock.release()
+        if symbols:
+            thread = threading.Thread(target=_refresh, args=(symbols,))
+            thread.setDaemon(True)
+            thread.start()
+
+def _refresh(symbols):
+    """
+    Download the prices of symbols into the quote cache.
+    """
+    try:
+        try:
+            quotes = YahooQuoteFinder.fetch_many(symbols, fresh=True,
+                                                 fields=PRICE_FIELDS)
+            errors = len([quote for quote in quotes.values()
+                          if isinstance(quote, Exception)])
+        except Exception:
+            errors = len(symbols)
+        if errors and Instrumentation.enabled:
+            Instrumentation.count('quote.refresh.errors', errors)
+    finally:
+        QuoteFinder._refresh_lock.acquire()
+        try:
+            for symbol in symbols:
+                QuoteFinder._refreshing.pop(symbol, None)
+        finally:
+            QuoteFinder._refresh_lock.release()
 
 class StockContainer:
     """
@@ -97,6 +248,24 @@ class StockContainer:
         """
         raise NotImplementedError #TODO
 
+def get_prices(service, symbols):
+    """
+    Obtain the price of every symbol from service, concurrently when
+    it provides a `getCurrentPrices' methode. Returns a dictionary of
+    floats.
+    """
+    service = service()
+    if hasattr(service, 'getCurrentPrices'):
+        prices = service.getCurrentPrices(symbols)
+    else:
+        prices = {}
+        for symbol in symbols:
+            prices[symbol] = service.getCurrentPrice(symbol)
+    for symbol in symbols:
+        if not isinstance(prices[symbol], float): # keeps StalePrice
+            prices[symbol] = float(prices[symbol])
+    return prices
+
 class PortfolioManager:
     """
     Manage a dictionary of stocks.
@@ -106,31 +275,57 @@ class PortfolioManager:
     def __init__(self,
                  name,
                  container=os.path.expanduser("~/.pystocks/"),
-                 service=QuoteFinder):
+                 service=QuoteFinder,
+                 fsync=FSYNC_ALWAYS,
+                 compact_every=1000,
+                 repair=True):
         """
         Create or load an existing portfolio.
 
         name: specify portfolio
-        container: portfolio container (default: ~/.pystocks)
+        container: portfolio container, a directory or a SQLite
+                   database (*.db, *.sqlite or sqlite:path)
+                   (default: ~/.pystocks)
         service: (callable)
                  Used to obtain current prices with
                  getCurrentPrice method (default: QuoteFinder)
+        fsync: when transactions are forced to disk, see
+               Journal.FSYNC_* (default: FSYNC_ALWAYS)
+        compact_every: amount of transactions journaled before
+                       the portfolio is rewritten (default: 1000)
+        repair: cut a transaction left partially written by a crash
+                off the journal when loading (it is never applied);
+                False when the portfolio is only read while another
+                process may be writing it (default: True)
         """
         self.name = name.lower()
-        self.container = os.path.expanduser(container)
-        self.portfolio = os.path.join(self.container,
-                                      name + ".portfolio")
         self.service = service
         if not hasattr(QuoteFinder, 'getCurrentPrice'):
             raise PortfolioError("service callable must provide a"
                                  " `getCurrentPrice' methode")
-        if not os.path.isdir(self.container):
-            os.mkdir(self.container)
 
-        if os.path.isfile(self.portfolio):
-            self._reload()
+        if is_database(container):
+            self.container = database_path(container)
+            self.portfolio = self.container
+            try:
+                self.storage = SqliteStorage(self.portfolio,
+                                             self.name,
+                                             self.service,
+                                             fsync=fsync)
+            except SqliteError, e:
+                raise PortfolioError(e)
         else:
-            self.stocks = {}
+            self.container = os.path.expanduser(container)
+            self.portfolio = os.path.join(self.container,
+                                          name + ".portfolio")
+            if not os.path.isdir(self.container):
+                os.mkdir(self.container)
+            self.storage = JournalStorage(self.portfolio,
+                                          self.service,
+                                          fsync=fsync,
+                                          compact_every=compact_every,
+                                          repair=repair)
+        self.stocks = self.storage.stocks
 
     def __iter__(self):
         for key in self.stocks:
@@ -142,7 +337,7 @@ class PortfolioManager:
     def __contains__(self, key):
         return key.upper() in self.stocks
 
-    def __setitem__(self, key, val):
+    def __setitem__(self, symbol, data):
         """
         Manipulate portfolio data.
 
@@ -168,8 +363,9 @@ class PortfolioManager:
         
     def __delitem__(self, symbol):
         symbol = symbol.upper()
-        del(self.stocks[symbol])
-        self._save()
+        if not symbol in self.stocks:
+            raise KeyError(symbol)
+        self.storage.delete(symbol)
         
     def __repr__(self):
         return `self.stocks`
@@ -194,23 +390,35 @@ class PortfolioManager:
         price = price or self._get_last_price(symbol)
         epoch = epoch or int(time.time())
             
-        if not symbol in self.stocks:
-            self.stocks[symbol] = []
-        self.stocks[symbol].append(StockContainer(self.service,
-                                                  symbol,
-                                                  amount,
-                                                  price,
-                                                  epoch))
-        self._save()
+        self.storage.add(symbol, amount, price, epoch)
         return (symbol, amount, price)
 
-    def remove(self, symbol, amount=0, price=None):
+    def add_many(self, lots, chunk_size=1000):
+        """
+        Add many stocks to portfolio in a single persistence pass.
+
+        lots: iterable of (symbol, amount, price, epoch) tuples, read
+              chunk_size at a time; a price or time of None is the
+              current price or time, as with add(). The current prices
+              missing from a chunk are obtained at once.
+
+          * Nothing is added if a batch is invalid.
+
+        Returns the amount of batches of shares added.
+        """
+        return self.storage.add_many(self._normalize(lots, chunk_size))
+
+    def remove(self, symbol, amount=0, price=None, method=FIFO, lots=None):
         """
         Remove a stock from portfolio.
 
         symbol: specify security
         amount: amount to remove (default: 0, remove all shares)
         price : if specified, only remove shares bought at 'price'
+        method: batches of shares removed first, Matching.FIFO, LIFO,
+                HIGHEST_COST or SPECIFIC (default: FIFO)
+        lots  : indexes of the batches of shares to remove from, in
+                order, as in portfolio[symbol] (implies SPECIFIC)
 
           * The amount and price values are mutually exclusive.
 
@@ -223,69 +431,70 @@ class PortfolioManager:
         symbol = symbol.upper()
         if not symbol in self.stocks:
             raise PortfolioError("Could not find '%s' in your portfolio" % symbol)
+        amount = int(amount)
+        if amount < 0:
+            raise PortfolioError("share amount must be positive")
 
-        removed = 0
-        to_remove = int(amount)
-
-        if amount == 0 and not price:
-            for container in self.stocks[symbol]:
-                removed += container.amount
-            del(self.stocks[symbol])
-
-        # remove all shares at 'price'
-        if price:
-            for (pos, shares) in enumerate(self.stocks[symbol]):
-                print "Price: %s In Price: %s" % (price, shares.price)
-                if shares.price == price:
-                    removed += shares.amount
-                    del(self.stocks[symbol][pos])
-                    continue
-            # if all share containers were removed, remove the reference
-            if len(self.stocks[symbol]) == 0:
-                del(self.stocks[symbol])
-
-        # remove only 'amount' of shares
-        elif to_remove != 0:
-            while removed != to_remove:
-                if len(self.stocks[symbol]) == 0:
-                    break # no shares left to be removed
-                
-                for (pos, shares) in enumerate(self.stocks[symbol]):
-                    if removed == to_remove:
-                        break # we removed enough shares
-
-                    # container that has less than what we
-                    # need to remove
-                    if shares.amount < to_remove:
-                        # remove it entirely
-                        removed += shares.amount
-                        del(self.stocks[symbol][pos])
-
-                    # container that has more than what we
-                    # need to remove
-                    elif shares.amount > to_remove:
-                        # remove it partially
-                        amount = (to_remove - removed)
-                        shares.amount -= amount
-                        removed += amount
-                        if shares.amount == 0:
-                            del(self.stocks[symbol][pos])
-
-                    # container that has the exact amount
-                    # we need to remove
-                    elif shares.amount == to_remove:
-                        # remove it entirely
-                        amount = (to_remove - removed)
-                        shares.amount -= amount
-                        removed += amount
-                        if shares.amount == 0:
-                            del(self.stocks[symbol][pos])
-
-        #
-        ############################################################
-
-        self._save()
-        return removed
+        if not amount and price is None and lots is None:
+            removed = self.storage.position(symbol)[0]
+            self.storage.delete(symbol)
+            return removed
+
+        (changes, fills) = self._match(symbol, amount, method, lots, price)
+        self.storage.reduce(symbol, changes)
+        return sum([fill.amount for fill in fills])
+
+    def sell(self, symbol, amount=0, price=None, method=FIFO, lots=None,
+             epoch=None):
+        """
+        Sell shares of a stock and record the realized gain.
+
+        symbol: specify security
+        amount: amount to sell (default: 0, sell all shares)
+        price : price obtained for one share
+                (default: current price)
+        method: batches of shares sold first, see remove()
+                (default: FIFO)
+        lots  : indexes of the batches of shares to sell from, in
+                order, as in portfolio[symbol] (implies SPECIFIC)
+        epoch : optional sale time in Epoch format
+                (default: current time)
+
+        Returns a Matching.Sale, also kept in getSales().
+        """
+        symbol = symbol.upper()
+        if not symbol in self.stocks:
+            raise PortfolioError("You do not own shares of '%s'" % symbol)
+        amount = int(amount)
+        if amount < 0:
+            raise PortfolioError("share amount must be positive")
+
+        (changes, fills) = self._match(symbol, amount, method, lots)
+        sold = sum([fill.amount for fill in fills])
+        if amount and sold < amount:
+            raise PortfolioError("Only %d shares of '%s' can be sold"
+                                 % (sold, symbol))
+        if price is None:
+            price = self._get_last_price(symbol)
+        sale = make_sale(symbol, price, epoch or int(time.time()), fills)
+        self.storage.reduce(symbol, changes, sale)
+        return sale
+
+    def getSales(self, symbol=None):
+        """
+        Return the Matching.Sale list of 'symbol', or of every
+        security sold.
+        """
+        if symbol is not None:
+            symbol = symbol.upper()
+        return self.storage.sales(symbol)
+
+    def getRealizedProfits(self, symbol=None):
+        """
+        Return a float that is the sum of the gains realized by
+        selling 'symbol', or every security sold.
+        """
+        return sum([sale.gain for sale in self.getSales(symbol)], 0.0)
 
     def getProfitsFrom(self, symbol):
         """
@@ -294,38 +503,123 @@ class PortfolioManager:
         symbol = symbol.upper()
 
         if not symbol in self.stocks:
-            raise PortfolioError("You do not own shares of '%s'")
+            raise PortfolioError("You do not own shares of '%s'" % symbol)
 
-        total = 0
-        last_price = self._get_last_price(symbol)
-        current_price = last_price
-        for shares in self.stocks[symbol]:
-            paid_price = shares.getInitialValue()
-            sell_price = shares.getCurrentValue()
-            total += (sell_price - paid_price)
-        return total
+        return self._get_profits(symbol, self._get_last_price(symbol))
 
     def getTotalProfits(self):
         """
         Return a float that is the sum of profits for
         every security in portfolio.
         """
+        prices = self._get_last_prices(list(self.stocks))
         total = 0
         for symbol in self.stocks:
-            total += self.getProfitsFrom(symbol)
+            total += self._get_profits(symbol, prices[symbol])
         return total
 
+    def getValuation(self):
+        """
+        Return a ValuationReport of the value and gains of every
+        batch of shares, every symbol and of the whole portfolio.
+        The price of every symbol is obtained once.
+        """
+        return ValuationEngine(self).run()
+
+    def _normalize(self, lots, chunk_size):
+        chunk = []
+        for lot in lots:
+            chunk.append(lot)
+            if len(chunk) >= chunk_size:
+                for lot in self._normalize_chunk(chunk):
+                    yield lot
+                chunk = []
+        for lot in self._normalize_chunk(chunk):
+            yield lot
+
+    def _normalize_chunk(self, chunk):
+        missing = {}
+        for (symbol, amount, price, epoch) in chunk:
+            if price is None:
+                missing[symbol.upper()] = True
+        prices = {}
+        if missing:
+            prices = self._get_last_prices(list(missing))
+        now = int(time.time())
+        lots = []
+        for (symbol, amount, price, epoch) in chunk:
+            symbol = symbol.upper()
+            amount = int(amount)
+            if amount < 0:
+                raise PortfolioError("share amount must be positive")
+            if price is None:
+                price = prices[symbol]
+            lots.append((symbol, amount, float(price), int(epoch or now)))
+        return lots
+
+    def _match(self, symbol, amount, method, lots, price=None):
+        """
+        Select the batches of shares of symbol to take amount shares
+        from. Only the batches needed are read.
+
+        Returns the (key, shares left) changes for the storage and the
+        Matching.Fill of every batch touched.
+        """
+        if lots is not None:
+            method = SPECIFIC
+            indexes = []
+            for index in lots:
+                if int(index) not in indexes:
+                    indexes.append(int(index))
+            lots = indexes
+        if method not in METHODS:
+            raise PortfolioError("Unknown matching method: %s" % method)
+        if method == SPECIFIC and not lots:
+            raise PortfolioError("The batches of shares must be given"
+                                 " with the SPECIFIC method")
+
+        candidates = self.storage.candidates(symbol, method, lots, price)
+        try:
+            try:
+                matched = match(candidates, amount)
+            except IndexError, e:
+                raise PortfolioError(e)
+        finally:
+            candidates.close()
+        return ([(key, left) for (key, left, fill) in matched],
+                [fill for (key, left, fill) in matched])
+
+    def _get_profits(self, symbol, current_price):
+        (amount, paid_price) = self.storage.position(symbol)
+        sell_price = float(current_price * amount)
+        return sell_price - paid_price
+
     def _get_last_price(self, symbol):
         service = self.service()
         return float(service.getCurrentPrice(symbol))
 
+    def _get_last_prices(self, symbols):
+        """
+        Obtain the price of every symbol, concurrently when
+        the service provides a `getCurrentPrices' methode.
+        """
+        return get_prices(self.service, symbols)
+
+    def close(self):
+        """
+        Force pending transactions to disk and release the storage.
+        """
+        self.storage.close()
+
     def _save(self):
-        f = open(self.portfolio, "w")
-        cPickle.dump(self.stocks, f)
-        f.close()
-        self._reload()
+        """
+        Write the whole portfolio.
+        """
+        self.storage.save()
 
     def _reload(self):
-        f = open(self.portfolio, "r")
-        self.stocks = cPickle.load(f)
-        f.close()
+        """
+        Load the last saved portfolio.
+        """
+        self.storage.reload()
+        self.stocks = self.storage.stocks
@@ -0,0 +1,547 @@
+#!/usr/bin/python
+#
+
+"""
+SQLite portfolio storage.
+
+Portfolios are stored as rows of a `lots' table, indexed by symbol and
+by purchase time, so looking up, removing or valuing the shares of one
+symbol only reads the rows of that symbol. Realized sales are kept in
+the `sales' and `sale_lots' tables. One database holds as many
+portfolios as needed.
+
+PortfolioManager uses this storage when its container is a database:
+a path ending with .db or .sqlite, or a path prefixed by `sqlite:'.
+
+    >>> pm = PortfolioManager('retirement', '~/.pystocks/portfolios.db')
+
+Portfolios saved by the pickle storage can be imported with migrate().
+
+The standard library sqlite3 module is used when it is available,
+pysqlite2 otherwise.
+"""
+
+import os
+import time
+import threading
+
+try:
+    import sqlite3
+except ImportError:
+    try:
+        from pysqlite2 import dbapi2 as sqlite3
+    except ImportError:
+        sqlite3 = None
+
+from pystocks.YahooFinance import Instrumentation
+from pystocks.PortfolioManager.Lots import LotArray
+from pystocks.PortfolioManager.Matching import (FIFO, LIFO, HIGHEST_COST,
+                                                SPECIFIC, Fill, make_sale)
+from pystocks.PortfolioManager.Journal import (JournalStorage,
+                                               FSYNC_ALWAYS,
+                                               FSYNC_INTERVAL,
+                                               FSYNC_NEVER)
+
+__revision__ = "$Id$"
+
+_extensions = ('.db', '.sqlite')
+
+_schema = """
+CREATE TABLE IF NOT EXISTS lots (
+    id        INTEGER PRIMARY KEY,
+    portfolio TEXT NOT NULL,
+    symbol    TEXT NOT NULL,
+    amount    INTEGER NOT NULL,
+    price     REAL NOT NULL,
+    epoch     INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS lots_symbol ON lots (portfolio, symbol, epoch);
+CREATE INDEX IF NOT EXISTS lots_epoch ON lots (portfolio, epoch);
+CREATE INDEX IF NOT EXISTS lots_order ON lots (portfolio, symbol, id);
+CREATE TABLE IF NOT EXISTS sales (
+    id        INTEGER PRIMARY KEY,
+    portfolio TEXT NOT NULL,
+    symbol    TEXT NOT NULL,
+    amount    INTEGER NOT NULL,
+    price     REAL NOT NULL,
+    epoch     INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sale_lots (
+    sale      INTEGER NOT NULL REFERENCES sales (id),
+    amount    INTEGER NOT NULL,
+    price     REAL NOT NULL,
+    epoch     INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sales_symbol ON sales (portfolio, symbol, epoch);
+CREATE INDEX IF NOT EXISTS sale_lots_sale ON sale_lots (sale);
+"""
+
+# ORDER BY clause of the matching methods
+_orders = {
+    FIFO: 'id',
+    LIFO: 'id DESC',
+    HIGHEST_COST: 'price DESC, id',
+}
+
+_synchronous = {
+    FSYNC_ALWAYS: 'FULL',
+    FSYNC_INTERVAL: 'NORMAL',
+    FSYNC_NEVER: 'OFF',
+}
+
+class SqliteError(Exception):
+    """
+    Raised when the SQLite storage can not be used.
+    """
+    pass
+
+def is_database(container):
+    """
+    Return True if container names a SQLite database.
+    """
+    return (container.startswith('sqlite:') or
+            os.path.splitext(container)[1].lower() in _extensions)
+
+def database_path(container):
+    """
+    Return the path of the database named by container.
+    """
+    if container.startswith('sqlite:'):
+        container = container[len('sqlite:'):]
+    return os.path.expanduser(container)
+
+def portfolios(path):
+    """
+    Return the names of the portfolios stored in the database path.
+    """
+    if sqlite3 is None:
+        raise SqliteError("SQLite storage requires the sqlite3 or"
+                          " pysqlite2 module")
+    if not os.path.isfile(path):
+        return []
+    connection = sqlite3.connect(path)
+    try:
+        connection.text_factory = str
+        try:
+            rows = connection.execute("SELECT DISTINCT portfolio FROM lots"
+                                      " ORDER BY portfolio").fetchall()
+        except sqlite3.OperationalError:
+            return [] # no lots table
+    finally:
+        connection.close()
+    return [row[0] for row in rows]
+
+class SqliteStocks:
+    """
+    Read-only dictionary-like view of the stocks of a portfolio.
+    Every access reads the rows of the database it needs.
+    """
+    def __init__(self, storage):
+        self.storage = storage
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return self.storage._query("SELECT COUNT(DISTINCT symbol) FROM lots"
+                                   " WHERE portfolio = ?")[0][0]
+
+    def __contains__(self, symbol):
+        return bool(self.storage._query("SELECT 1 FROM lots WHERE"
+                                        " portfolio = ? AND symbol = ?"
+                                        " LIMIT 1", symbol))
+
+    def __getitem__(self, symbol):
+        lots = self.storage.lots(symbol)
+        if not lots:
+            raise KeyError(symbol)
+        return lots
+
+    def get(self, symbol, default=None):
+        try:
+            return self[symbol]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [row[0] for row in
+                self.storage._query("SELECT DISTINCT symbol FROM lots"
+                                    " WHERE portfolio = ? ORDER BY symbol")]
+
+    def items(self):
+        return [(symbol, self[symbol]) for symbol in self.keys()]
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+class SqliteStorage:
+    """
+    Portfolio storage kept in a SQLite database.
+    """
+    def __init__(self,
+                 path,
+                 name,
+                 service=None,
+                 fsync=FSYNC_ALWAYS):
+        """
+        path: database file
+        name: portfolio name
+        service: callable used to obtain price per share with
+                 the getCurrentPrice methode, given to every LotArray
+        fsync: Journal.FSYNC_* policy, mapped to SQLite's
+               synchronous setting (default: FSYNC_ALWAYS)
+        """
+        if sqlite3 is None:
+            raise SqliteError("SQLite storage requires the sqlite3 or"
+                              " pysqlite2 module")
+        if fsync not in _synchronous:
+            raise ValueError("Invalid fsync policy: %s" % fsync)
+        self.path = path
+        self.name = name
+        self.service = service
+        self.version = 0 # changed by every change of the lots
+        self._lock = threading.RLock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.text_factory = str
+        self.connection.execute("PRAGMA synchronous = %s" %
+                                _synchronous[fsync])
+        self.connection.executescript(_schema)
+        self.stocks = SqliteStocks(self)
+
+    def lots(self, symbol):
+        """
+        Return the LotArray of the batches of shares of symbol.
+        """
+        start = Instrumentation.enabled and time.time()
+        rows = self._query("SELECT amount, price, epoch FROM lots"
+                           " WHERE portfolio = ? AND symbol = ?"
+                           " ORDER BY id", symbol)
+        lots = LotArray(symbol, self.service, rows)
+        if start:
+            Instrumentation.observe('storage.reload', time.time() - start)
+        return lots
+
+    def bought(self, start=None, end=None, symbol=None):
+        """
+        Return the (symbol, amount, price, epoch) of the batches of shares
+        bought between start and end (Epoch format, inclusive).
+        """
+        query = ("SELECT symbol, amount, price, epoch FROM lots"
+                 " WHERE portfolio = ?")
+        args = []
+        if symbol is not None:
+            query += " AND symbol = ?"
+            args.append(symbol)
+        if start is not None:
+            query += " AND epoch >= ?"
+            args.append(int(start))
+        if end is not None:
+            query += " AND epoch <= ?"
+            args.append(int(end))
+        return self._query(query + " ORDER BY epoch, id", *args)
+
+    def add(self, symbol, amount, price, epoch):
+        """
+        Add a batch of shares of symbol.
+        """
+        self.add_many([(symbol, amount, price, epoch)])
+
+    def add_many(self, lots):
+        """
+        Add (symbol, amount, price, epoch) batches of shares in a single
+        transaction. lots may be a generator, it is read as the rows are
+        inserted; nothing is added if it raises.
+
+        Returns the amount of batches added.
+        """
+        return self._execute_many("INSERT INTO lots (portfolio, symbol,"
+                                  " amount, price, epoch)"
+                                  " VALUES (?, ?, ?, ?, ?)",
+                                  ((self.name,) + tuple(lot)
+                                   for lot in lots))
+
+    def set(self, symbol, lots):
+        """
+        Replace the batches of shares of symbol by lots, a list of
+        (amount, price, epoch) tuples.
+        """
+        self._lock.acquire()
+        try:
+            connection = self.connection
+            try:
+                connection.execute("DELETE FROM lots WHERE portfolio = ?"
+                                   " AND symbol = ?", (self.name, symbol))
+                connection.executemany(
+                    "INSERT INTO lots (portfolio, symbol, amount,"
+                    " price, epoch) VALUES (?, ?, ?, ?, ?)",
+                    [(self.name, symbol) + tuple(lot) for lot in lots])
+                self._commit()
+            except:
+                connection.rollback()
+                raise
+            self.version += 1
+        finally:
+            self._lock.release()
+
+    def delete(self, symbol):
+        """
+        Remove every batch of shares of symbol.
+        """
+        self.set(symbol, [])
+
+    def candidates(self, symbol, method=FIFO, indexes=None, price=None,
+                   size=64):
+        """
+        Iterate over the (id, amount, price, epoch) of the batches of
+        shares of symbol in the order of method, see Matching, reading
+        `size' rows at a time. Indexes are positions in lots(symbol).
+        """
+        query = ("SELECT id, amount, price, epoch FROM lots"
+                 " WHERE portfolio = ? AND symbol = ?")
+        if method == SPECIFIC:
+            indexes = indexes or ()
+            if not indexes:
+                return
+            rows = self._query(query + " ORDER BY id LIMIT ?",
+                               symbol, max(indexes) + 1)
+            for index in indexes:
+                if not 0 <= index < len(rows):
+                    raise IndexError("lot index out of range: %s" % index)
+                if price is None or rows[index][2] == price:
+                    yield rows[index]
+            return
+        if method not in _orders:
+            raise ValueError("Unknown matching method: %s" % method)
+        args = [symbol]
+        if price is not None:
+            query += " AND price = ?"
+            args.append(float(price))
+        for row in self._iterate(query + " ORDER BY " + _orders[method],
+                                 args, size):
+            yield row
+
+    def reduce(self, symbol, changes, sale=None):
+        """
+        Apply the (id, shares left) changes of Matching.match() to the
+        batches of shares of symbol and record sale, in a single
+        transaction that only touches the rows changed.
+        """
+        self._lock.acquire()
+        try:
+            connection = self.connection
+            try:
+                connection.executemany(
+                    "UPDATE lots SET amount = ? WHERE id = ?",
+                    [(left, key) for (key, left) in changes if left])
+                connection.executemany(
+                    "DELETE FROM lots WHERE id = ?",
+                    [(key,) for (key, left) in changes if not left])
+                if sale is not None:
+                    self._insert_sale(sale)
+                self._commit()
+            except:
+                connection.rollback()
+                raise
+            self.version += 1
+        finally:
+            self._lock.release()
+
+    def add_sales(self, sales):
+        """
+        Record Sale objects in a single transaction.
+        """
+        self._lock.acquire()
+        try:
+            try:
+                for sale in sales:
+                    self._insert_sale(sale)
+                self._commit()
+            except:
+                self.connection.rollback()
+                raise
+        finally:
+            self._lock.release()
+
+    def sales(self, symbol=None):
+        """
+        Return the Sale list of symbol, or of every symbol.
+        """
+        where = " WHERE sales.portfolio = ?"
+        args = ()
+        if symbol is not None:
+            where += " AND sales.symbol = ?"
+            args = (symbol,)
+        fills = {}
+        for (sale, amount, price, epoch) in self._query(
+            "SELECT sale, sale_lots.amount, sale_lots.price, sale_lots.epoch"
+            " FROM sale_lots JOIN sales ON sales.id = sale_lots.sale" +
+            where + " ORDER BY sale_lots.rowid", *args):
+            fills.setdefault(sale, []).append(Fill(amount, price, epoch))
+        return [make_sale(sold, price, epoch, fills.get(sale, ()))
+                for (sale, sold, price, epoch) in self._query(
+                    "SELECT id, symbol, price, epoch FROM sales" + where +
+                    " ORDER BY id", *args)]
+
+    def position(self, symbol):
+        """
+        Return the (amount of shares, price paid) of symbol.
+        """
+        (amount, paid) = self._query("SELECT SUM(amount),"
+                                     " SUM(amount * price) FROM lots"
+                                     " WHERE portfolio = ? AND symbol = ?",
+                                     symbol)[0]
+        return (amount or 0, paid or 0.0)
+
+    def positions(self):
+        """
+        Return a dictionary of the (amount of shares, price paid)
+        of every symbol.
+        """
+        positions = {}
+        for (symbol, amount, paid) in self._query(
+            "SELECT symbol, SUM(amount), SUM(amount * price) FROM lots"
+            " WHERE portfolio = ? GROUP BY symbol"):
+            positions[symbol] = (amount, paid)
+        return positions
+
+    def rows(self, size=1000):
+        """
+        Iterate over the (symbol, amount, price, epoch) of every
+        batch of shares, reading `size' rows at a time.
+        """
+        return self._iterate("SELECT symbol, amount, price, epoch FROM lots"
+                             " WHERE portfolio = ? ORDER BY symbol, id",
+                             (), size)
+
+    def _iterate(self, query, args, size):
+        self._lock.acquire()
+        try:
+            cursor = self.connection.execute(query,
+                                             (self.name,) + tuple(args))
+        finally:
+            self._lock.release()
+        while True:
+            self._lock.acquire()
+            try:
+                rows = cursor.fetchmany(size)
+            finally:
+                self._lock.release()
+            if not rows:
+                break
+            for row in rows:
+                yield row
+
+    def save(self):
+        """
+        Every change is committed as it is made.
+        """
+        self._lock.acquire()
+        try:
+            self._commit()
+        finally:
+            self._lock.release()
+
+    def reload(self):
+        """
+        Rows are read when they are accessed.
+        """
+        pass
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            self.connection.close()
+        finally:
+            self._lock.release()
+
+    def _query(self, query, *args):
+        self._lock.acquire()
+        try:
+            return self.connection.execute(query,
+                                           (self.name,) + args).fetchall()
+        finally:
+            self._lock.release()
+
+    def _commit(self):
+        start = Instrumentation.enabled and time.time()
+        self.connection.commit()
+        if start:
+            Instrumentation.observe('storage.save', time.time() - start)
+
+    def _insert_sale(self, sale):
+        cursor = self.connection.execute(
+            "INSERT INTO sales (portfolio, symbol, amount, price, epoch)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (self.name, sale.symbol, sale.amount, sale.price, sale.epoch))
+        self.connection.executemany(
+            "INSERT INTO sale_lots (sale, amount, price, epoch)"
+            " VALUES (?, ?, ?, ?)",
+            [(cursor.lastrowid,) + tuple(fill) for fill in sale.lots])
+
+    def _execute_many(self, query, rows):
+        self._lock.acquire()
+        try:
+            try:
+                cursor = self.connection.executemany(query, rows)
+                self._commit()
+            except:
+                self.connection.rollback()
+                raise
+            self.version += 1
+            return cursor.rowcount
+        finally:
+            self._lock.release()
+
+def migrate(portfolio, database, name=None):
+    """
+    Import a portfolio saved by the pickle storage (and its journal)
+    in a database.
+
+    portfolio: path of the `<name>.portfolio' file
+    database: path of the database
+    name: portfolio name in the database (default: from the file name)
+
+    Returns the amount of batches of shares imported. Realized sales
+    are imported as well, in the same transaction. Raises a SqliteError
+    if the database already holds a portfolio of that name.
+    """
+    if name is None:
+        name = os.path.splitext(os.path.basename(portfolio))[0]
+    source = JournalStorage(portfolio)
+    try:
+        lots = list(source.rows())
+        sales = source.sales()
+    finally:
+        source.close()
+
+    target = SqliteStorage(database, name.lower())
+    connection = target.connection
+    try:
+        try:
+            # lock the database until the commit, another process can not
+            # create the portfolio between the check and the inserts
+            connection.execute("BEGIN IMMEDIATE")
+            for table in ('lots', 'sales'):
+                if connection.execute("SELECT 1 FROM %s WHERE portfolio = ?"
+                                      " LIMIT 1" % table,
+                                      (target.name,)).fetchall():
+                    raise SqliteError("Portfolio %s already exists in %s" %
+                                      (target.name, database))
+            connection.executemany("INSERT INTO lots (portfolio, symbol,"
+                                   " amount, price, epoch)"
+                                   " VALUES (?, ?, ?, ?, ?)",
+                                   [(target.name,) + tuple(lot)
+                                    for lot in lots])
+            for sale in sales:
+                target._insert_sale(sale)
+            target._commit()
+        except:
+            connection.rollback()
+            raise
+    finally:
+        target.close()
+    return len(lots)
@@ -0,0 +1,260 @@
+#!/usr/bin/python
+#
+
+"""
+Bulk import and export of portfolios as CSV statements.
+
+StatementReader reads the positions of a broker statement one row at a
+time, finds its columns from their headers (Symbol, Quantity, Price,
+Trade Date, ...) and validates and normalizes every row into a
+(symbol, amount, price, epoch) tuple. import_statement() adds them to a
+portfolio in a single persistence pass and export_statement() writes a
+portfolio back, reading its batches of shares as it writes them:
+
+    >>> import_statement(pm, 'positions.csv')
+    100000
+    >>> export_statement(pm, 'backup.csv')
+    100000
+
+Rows without a symbol (blank lines) and total rows are ignored. Invalid rows
+raise a StatementError, or are skipped and listed in `errors' when the
+reader is not strict.
+"""
+
+import re
+import csv
+import time
+
+from pystocks.PortfolioManager.PortfolioManager import PortfolioError
+
+__revision__ = "$Id$"
+
+# headers recognized for every field, lowercase
+HEADERS = {
+    'symbol': ('symbol', 'ticker', 'security', 'sym'),
+    'amount': ('amount', 'quantity', 'qty', 'shares'),
+    'price': ('price', 'price paid', 'unit cost', 'cost per share',
+              'cost basis per share', 'purchase price'),
+    'epoch': ('epoch', 'time'),
+    'date': ('date', 'trade date', 'acquired', 'date acquired',
+             'open date', 'purchase date'),
+}
+
+DATE_FORMATS = ('%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%m/%d/%Y',
+                '%m/%d/%Y %H:%M:%S', '%m/%d/%y', '%d-%b-%Y', '%Y%m%d')
+
+# columns written by export_statement()
+EXPORT_HEADERS = ('symbol', 'amount', 'price', 'epoch', 'date')
+
+# lines searched for the headers, statements often start with a preamble
+MAX_PREAMBLE = 20
+
+_symbol_re = re.compile(r"^[A-Z0-9.^=\-]+$")
+
+class StatementError(PortfolioError):
+    """
+    Raised when a statement can not be read.
+    """
+    def __init__(self, message, line=None):
+        if line is not None:
+            message = "line %d: %s" % (line, message)
+        PortfolioError.__init__(self, message)
+        self.line = line
+
+class StatementReader:
+    """
+    Iterate over the (symbol, amount, price, epoch) of the rows of a
+    CSV statement. A missing price or time is None.
+    """
+    def __init__(self, f, columns=None, strict=True, dialect='excel'):
+        """
+        f: file-like object or path of the statement
+        columns: dictionary of the header of fields whose header is not
+                 recognized, e.g. {'amount': 'Units'}
+        strict: raise a StatementError on the first invalid row instead
+                of skipping it (default: True)
+        dialect: csv dialect (default: excel)
+        """
+        self.opened = isinstance(f, basestring) # closed by close()
+        if self.opened:
+            f = open(f, "rb")
+        self.file = f
+        self.strict = strict
+        self.errors = []  # (line, message) of the rows skipped
+        self.line = 0
+        try:
+            self._rows = csv.reader(f, dialect)
+            self._positions = self._find_headers(columns or {})
+        except:
+            if self.opened:
+                f.close()
+            raise
+        self._format = DATE_FORMATS[0]
+
+    def __iter__(self):
+        (symbol_pos, amount_pos, price_pos, epoch_pos, date_pos) = \
+            self._positions
+        for row in self._rows:
+            self.line += 1
+            if len(row) <= symbol_pos:
+                continue
+            name = row[symbol_pos].strip()
+            if not name or name.lower().startswith('total'):
+                continue
+            try:
+                symbol = self._symbol(name)
+                amount = self._amount(_cell(row, amount_pos))
+                price = self._price(_cell(row, price_pos))
+                epoch = self._epoch(_cell(row, epoch_pos),
+                                    _cell(row, date_pos))
+            except ValueError, e:
+                if self.strict:
+                    raise StatementError(str(e), self.line)
+                self.errors.append((self.line, str(e)))
+                continue
+            yield (symbol, amount, price, epoch)
+
+    def chunks(self, size=1000):
+        """
+        Iterate over lists of up to size rows.
+        """
+        chunk = []
+        for row in self:
+            chunk.append(row)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def close(self):
+        """
+        Close the statement if the reader opened it; a file-like object
+        given by the caller is left open.
+        """
+        if self.opened:
+            self.file.close()
+
+    def _find_headers(self, columns):
+        """
+        Read lines until the headers and return the positions of the
+        columns of every field, None for missing optional fields.
+        """
+        wanted = {}
+        for (field, headers) in HEADERS.items():
+            if field in columns:
+                headers = (columns[field].strip().lower(),)
+            wanted[field] = headers
+        for row in self._rows:
+            self.line += 1
+            names = [name.strip().lower() for name in row]
+            found = {}
+            for (field, headers) in wanted.items():
+                for header in headers:
+                    if header in names:
+                        found[field] = names.index(header)
+                        break
+            if 'symbol' in found and 'amount' in found:
+                return tuple([found.get(field) for field in
+                              ('symbol', 'amount', 'price', 'epoch',
+                               'date')])
+            if self.line >= MAX_PREAMBLE:
+                break
+        raise StatementError("No symbol and amount columns found")
+
+    def _symbol(self, value):
+        symbol = value.strip().upper()
+        if not _symbol_re.match(symbol):
+            raise ValueError("Invalid symbol: %r" % value)
+        return symbol
+
+    def _amount(self, value):
+        if value is None:
+            raise ValueError("Missing amount")
+        try:
+            amount = float(value.replace(',', ''))
+        except ValueError:
+            raise ValueError("Invalid amount: %r" % value)
+        if amount < 0 or amount != int(amount):
+            raise ValueError("Invalid amount: %r" % value)
+        return int(amount)
+
+    def _price(self, value):
+        if value is None:
+            return None
+        try:
+            price = float(value.replace(',', '').replace('$', ''))
+        except ValueError:
+            raise ValueError("Invalid price: %r" % value)
+        if price < 0:
+            raise ValueError("Invalid price: %r" % value)
+        return price
+
+    def _epoch(self, epoch, date):
+        if epoch is not None:
+            try:
+                return int(float(epoch))
+            except ValueError:
+                raise ValueError("Invalid time: %r" % epoch)
+        if date is None:
+            return None
+        # statements use a single format, try the last one first
+        for format in (self._format,) + DATE_FORMATS:
+            try:
+                parsed = time.strptime(date, format)
+            except ValueError:
+                continue
+            self._format = format
+            return int(time.mktime(parsed))
+        raise ValueError("Invalid date: %r" % date)
+
+def _cell(row, pos):
+    """
+    Return the stripped value of row at pos, None if it is empty.
+    """
+    if pos is None or pos >= len(row):
+        return None
+    value = row[pos].strip()
+    if not value:
+        return None
+    return value
+
+def import_statement(portfolio, f, columns=None, strict=True,
+                     chunk_size=1000):
+    """
+    Add the rows of a statement to portfolio in a single persistence
+    pass, see StatementReader and PortfolioManager.add_many().
+
+    Returns the amount of batches of shares added.
+    """
+    reader = StatementReader(f, columns, strict)
+    try:
+        return portfolio.add_many(reader, chunk_size)
+    finally:
+        reader.close()
+
+def export_statement(portfolio, f, dialect='excel'):
+    """
+    Write the batches of shares of portfolio as a CSV statement that
+    import_statement() reads back.
+
+    f: file-like object or path of the statement
+
+    Returns the amount of batches of shares written.
+    """
+    opened = isinstance(f, basestring)
+    if opened:
+        f = open(f, "wb")
+    try:
+        writer = csv.writer(f, dialect)
+        writer.writerow(EXPORT_HEADERS)
+        count = 0
+        for (symbol, amount, price, epoch) in portfolio.storage.rows():
+            writer.writerow((symbol, amount, repr(price), epoch,
+                             time.strftime('%Y-%m-%d %H:%M:%S',
+                                           time.localtime(epoch))))
+            count += 1
+        return count
+    finally:
+        if opened:
+            f.close()
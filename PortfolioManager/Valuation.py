@@ -0,0 +1,181 @@
+#!/usr/bin/python
+#
+
+"""
+Portfolio valuation.
+
+ValuationEngine prices every distinct symbol of a portfolio once, in a
+single batched request when the service provides `getCurrentPrices',
+then computes the value and gains of every batch of shares, symbol and
+of the whole portfolio in one pass. The computation is vectorized with
+NumPy when it is installed.
+
+Example:
+
+    >>> report = ValuationEngine(portfolio).run()
+    >>> report.gain
+    1250.25
+    >>> report.symbols['YHOO'].value
+    2556.0
+    >>> for lot in report.iterlots():
+    ...     print lot.symbol, lot.amount, lot.gain
+"""
+
+import time
+
+from collections import namedtuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__revision__ = "$Id$"
+
+LotValue = namedtuple('LotValue',
+                      'symbol amount paid epoch price cost value gain')
+SymbolValue = namedtuple('SymbolValue',
+                         'symbol amount price cost value gain')
+
+class ValuationReport:
+    """
+    Value of a portfolio at a given time.
+
+    time: when the prices were obtained (Epoch format)
+    prices: dictionary of the price per share of every symbol
+    symbols: dictionary of SymbolValue, by symbol
+    cost, value, gain: totals of the portfolio
+    lots: columns of the batches of shares (symbol, amount, paid,
+          epoch, price, cost, value and gain); NumPy arrays when
+          NumPy is installed, lists otherwise
+    """
+    def __init__(self, when, prices, lots, symbols):
+        self.time = when
+        self.prices = prices
+        self.lots = lots
+        self.symbols = symbols
+        self.cost = sum([s.cost for s in symbols.values()])
+        self.value = sum([s.value for s in symbols.values()])
+        self.gain = self.value - self.cost
+
+    def iterlots(self):
+        """
+        Iterate over the LotValue of every batch of shares.
+        """
+        lots = self.lots
+        for pos in xrange(len(lots['symbol'])):
+            yield LotValue(lots['symbol'][pos],
+                           int(lots['amount'][pos]),
+                           float(lots['paid'][pos]),
+                           int(lots['epoch'][pos]),
+                           float(lots['price'][pos]),
+                           float(lots['cost'][pos]),
+                           float(lots['value'][pos]),
+                           float(lots['gain'][pos]))
+
+    def __len__(self):
+        return len(self.lots['symbol'])
+
+    def __repr__(self):
+        return "<ValuationReport value=%.2f cost=%.2f gain=%.2f>" % (
+            self.value, self.cost, self.gain)
+
+class ValuationEngine:
+    """
+    Value every batch of shares of a PortfolioManager.
+    """
+    def __init__(self, portfolio, vectorize=True):
+        """
+        portfolio: PortfolioManager instance
+        vectorize: use NumPy when it is installed (default: True)
+        """
+        self.portfolio = portfolio
+        self.vectorize = vectorize and numpy is not None
+
+    def run(self, prices=None):
+        """
+        Value the portfolio and return a ValuationReport.
+
+        prices: dictionary of prices to use instead of obtaining
+                them from the portfolio's service
+        """
+        symbols = []
+        index = {}
+        columns = ([], [], [], [])
+        (lot_symbols, amounts, paid, epochs) = columns
+        for (symbol, amount, price, epoch) in self.portfolio.storage.rows():
+            if symbol not in index:
+                index[symbol] = len(symbols)
+                symbols.append(symbol)
+            lot_symbols.append(symbol)
+            amounts.append(amount)
+            paid.append(price)
+            epochs.append(epoch)
+
+        when = int(time.time())
+        if prices is None:
+            prices = self.portfolio._get_last_prices(symbols)
+        positions = [index[symbol] for symbol in lot_symbols]
+
+        if self.vectorize:
+            (lots, totals) = self._compute_arrays(symbols, prices,
+                                                  positions, columns)
+        else:
+            (lots, totals) = self._compute_lists(symbols, prices,
+                                                 positions, columns)
+
+        values = {}
+        for (symbol, (amount, cost, value)) in zip(symbols, totals):
+            values[symbol] = SymbolValue(symbol, int(amount), prices[symbol],
+                                         float(cost), float(value),
+                                         float(value - cost))
+        return ValuationReport(when, prices, lots, values)
+
+    def _compute_arrays(self, symbols, prices, positions, columns):
+        (lot_symbols, amounts, paid, epochs) = columns
+        amount = numpy.array(amounts, dtype=numpy.int64)
+        paid = numpy.array(paid, dtype=numpy.float64)
+        price = numpy.array([prices[s] for s in symbols],
+                            dtype=numpy.float64)
+        positions = numpy.array(positions, dtype=numpy.intp)
+        price = price[positions]
+        cost = amount * paid
+        value = amount * price
+
+        # sums by symbol
+        size = len(symbols)
+        totals = zip(numpy.bincount(positions, amount, size),
+                     numpy.bincount(positions, cost, size),
+                     numpy.bincount(positions, value, size))
+        lots = {'symbol': lot_symbols,
+                'amount': amount,
+                'paid': paid,
+                'epoch': numpy.array(epochs, dtype=numpy.int64),
+                'price': price,
+                'cost': cost,
+                'value': value,
+                'gain': value - cost}
+        return (lots, totals)
+
+    def _compute_lists(self, symbols, prices, positions, columns):
+        (lot_symbols, amounts, paid, epochs) = columns
+        price = [prices[symbols[pos]] for pos in positions]
+        cost = [a * p for (a, p) in zip(amounts, paid)]
+        value = [a * p for (a, p) in zip(amounts, price)]
+
+        # sums by symbol
+        totals = [[0, 0.0, 0.0] for symbol in symbols]
+        for (pos, a, c, v) in zip(positions, amounts, cost, value):
+            total = totals[pos]
+            total[0] += a
+            total[1] += c
+            total[2] += v
+        lots = {'symbol': lot_symbols,
+                'amount': amounts,
+                'paid': paid,
+                'epoch': epochs,
+                'price': price,
+                'cost': cost,
+                'value': value,
+                'gain': [v - c for (v, c) in zip(value, cost)]}
+        return (lots, totals)
@@ -0,0 +1,619 @@
+#!/usr/bin/python
+#
+
+"""
+Valuation history of a portfolio.
+
+ValuationHistory records snapshots of the amount, price, cost, value and
+gain of every symbol of a portfolio and of its totals, e.g. every
+minute, and returns the P&L curves of any time range:
+
+    >>> history = ValuationHistory(pm)
+    >>> history.record()                       # or history.run(60)
+    >>> curve = history.curve(time.time() - 86400)
+    >>> curve.gain[-1]
+    1250.25
+    >>> daily = history.curve().resample(86400)
+    >>> history.symbol('YHOO', start, end).value[-1]
+    2556.0
+    >>> history.at(start)['YHOO'].gain
+    -12.5
+
+Snapshots are incremental: positions are only read again when the
+portfolio changed and only the symbols whose price or position changed
+since the previous snapshot are recomputed and written (a delta). Every
+`keyframe_every' snapshots the whole portfolio is written, so the value
+of every symbol at any time is rebuilt from the last keyframe before it.
+
+Like the bars of YahooFinance.History, snapshots and deltas are stored
+as files of fixed size little-endian values, in the `<name>.history'
+directory next to the portfolio: 32 bytes per snapshot and 28 bytes per
+symbol that changed. Time ranges are found by bisection and, with NumPy
+installed, read from memory-mapped files.
+"""
+
+import os
+import sys
+import mmap
+import time
+import array
+import bisect
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from pystocks.YahooFinance import FeedError, SymbolError
+from pystocks.YahooFinance.History import _load
+from pystocks.PortfolioManager.Valuation import SymbolValue
+from pystocks.PortfolioManager.PortfolioManager import PortfolioError
+
+__revision__ = "$Id$"
+
+# (name, numpy type, array typecode) of the columns of every table
+SNAPSHOTS = (
+    ('time', '<f8', 'd'),    # Epoch format
+    ('first', '<u4', 'I'),   # position of the first delta
+    ('count', '<u4', 'I'),   # amount of deltas
+    ('cost', '<f8', 'd'),    # totals of the portfolio
+    ('value', '<f8', 'd'),
+)
+DELTAS = (
+    ('symbol', '<u4', 'I'),  # line of the symbol in the `symbols' file
+    ('amount', '<f8', 'd'),
+    ('price', '<f8', 'd'),
+    ('cost', '<f8', 'd'),
+)
+KEYFRAMES = (
+    ('snapshot', '<u4', 'I'),
+)
+
+class ValuationCurve:
+    """
+    Value of a portfolio, or of one of its symbols, over time, as
+    columns; NumPy arrays when NumPy is installed, arrays otherwise.
+
+    time: time of every snapshot (Epoch format)
+    cost, value, gain: at every snapshot
+    amount, price: of the symbol, for the curves of a symbol
+    """
+    def __init__(self, columns):
+        self.names = [name for name in ('time', 'amount', 'price', 'cost',
+                                        'value', 'gain')
+                      if name in columns]
+        for name in self.names:
+            setattr(self, name, columns[name])
+
+    def __len__(self):
+        return len(self.time)
+
+    def between(self, start=None, end=None):
+        """
+        Return the ValuationCurve from start to end (Epoch format,
+        inclusive).
+        """
+        first = 0
+        last = len(self.time)
+        if start is not None:
+            first = bisect.bisect_left(self.time, start)
+        if end is not None:
+            last = bisect.bisect_right(self.time, end)
+        return self._take(None, first, last)
+
+    def resample(self, interval, offset=0):
+        """
+        Return the ValuationCurve of the last snapshot of every interval,
+        e.g. 86400 for end-of-day values.
+
+        interval: seconds
+        offset: seconds added to the times before they are split in
+                intervals, e.g. -5 * 3600 for days in EST (default: 0)
+        """
+        if numpy is not None:
+            if not len(self.time):
+                return self
+            buckets = numpy.floor((numpy.asarray(self.time) + offset) /
+                                  float(interval))
+            positions = numpy.append(numpy.nonzero(numpy.diff(buckets))[0],
+                                     len(buckets) - 1)
+            return self._take(positions)
+        times = self.time
+        positions = []
+        for pos in xrange(len(times)):
+            if (pos + 1 == len(times) or
+                (times[pos] + offset) // interval !=
+                (times[pos + 1] + offset) // interval):
+                positions.append(pos)
+        return self._take(positions)
+
+    def rows(self):
+        """
+        Iterate over the values of every snapshot, in the order of
+        `names'.
+        """
+        columns = [getattr(self, name) for name in self.names]
+        for pos in xrange(len(self.time)):
+            yield tuple([column[pos] for column in columns])
+
+    def _take(self, positions, first=None, last=None):
+        columns = {}
+        for name in self.names:
+            column = getattr(self, name)
+            if first is not None:
+                columns[name] = column[first:last]
+            elif numpy is not None:
+                columns[name] = numpy.asarray(column)[positions]
+            else:
+                columns[name] = array.array(column.typecode,
+                                            [column[pos] for pos in positions])
+        return ValuationCurve(columns)
+
+    def __repr__(self):
+        return "<ValuationCurve %d snapshots>" % len(self)
+
+class ValuationHistory:
+    """
+    Record and query the valuation history of a PortfolioManager.
+    """
+    def __init__(self, portfolio, directory=None, keyframe_every=1440):
+        """
+        portfolio: PortfolioManager instance
+        directory: where the history is kept
+                   (default: <name>.history next to the portfolio)
+        keyframe_every: snapshots between two complete snapshots
+                        (default: 1440, a day of 1-minute snapshots)
+        """
+        if keyframe_every < 1:
+            raise ValueError("keyframe_every must be positive")
+        if directory is None:
+            directory = os.path.join(os.path.dirname(portfolio.portfolio),
+                                     portfolio.name + ".history")
+        self.portfolio = portfolio
+        self.directory = directory
+        self.keyframe_every = keyframe_every
+        self.error = None     # error of the last snapshot run() missed
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._files = {}
+        self._symbols = []    # symbol of every id
+        self._ids = {}
+        self._version = None  # storage version of _positions
+        self._positions = {}
+        self._state = {}      # last (amount, price, cost) of every symbol
+        self._cost = 0.0
+        self._value = 0.0
+        self._stopped = False
+        self._open()
+
+    def __len__(self):
+        return self._count
+
+    def record(self, prices=None, when=None):
+        """
+        Record a snapshot of the portfolio.
+
+        prices: dictionary of prices to use instead of obtaining
+                them from the portfolio's service
+        when: time of the snapshot (default: now)
+
+        Returns the symbols that were recomputed.
+        """
+        if when is None:
+            when = time.time()
+        if self._count and when < self._last:
+            raise ValueError("Snapshots must be recorded in time order")
+        storage = self.portfolio.storage
+        if storage.version != self._version:
+            self._positions = storage.positions()
+            self._version = storage.version
+        positions = self._positions
+        if prices is None:
+            prices = self.portfolio._get_last_prices(list(positions))
+
+        keyframe = self._count % self.keyframe_every == 0
+        state = self._state
+        held = {}
+        deltas = []
+        for (symbol, (amount, cost)) in positions.items():
+            if not (amount or cost):
+                continue
+            held[symbol] = True
+            entry = (amount, float(prices[symbol]), cost)
+            if keyframe or state.get(symbol) != entry:
+                deltas.append((symbol,) + entry)
+        if not keyframe:
+            for symbol in state:
+                if symbol not in held:
+                    deltas.append((symbol, 0, state[symbol][1], 0.0))
+
+        if keyframe:
+            state.clear()
+            self._cost = self._value = 0.0
+        for (symbol, amount, price, cost) in deltas:
+            previous = state.get(symbol)
+            if previous is not None:
+                self._cost -= previous[2]
+                self._value -= previous[0] * previous[1]
+            if amount or cost:
+                state[symbol] = (amount, price, cost)
+                self._cost += cost
+                self._value += amount * price
+            elif previous is not None:
+                del(state[symbol])
+        self._write(when, deltas, keyframe)
+        return [delta[0] for delta in deltas]
+
+    def run(self, interval=60):
+        """
+        Record a snapshot every `interval' seconds until stop() is
+        called. Snapshots that could not be priced are skipped and
+        their SymbolError, FeedError or PortfolioError is kept in
+        `error'.
+        """
+        self._stopped = False
+        while not self._stopped:
+            start = time.time()
+            try:
+                self.record()
+                self.error = None
+            except (SymbolError, FeedError, PortfolioError), e:
+                self.error = e
+            if self._stopped:
+                break
+            wait = interval - (time.time() - start)
+            if wait > 0:
+                time.sleep(wait)
+
+    def stop(self):
+        """
+        End run() after the current snapshot.
+        """
+        self._stopped = True
+
+    def curve(self, start=None, end=None):
+        """
+        Return the ValuationCurve of the totals of the portfolio from
+        start to end (Epoch format, inclusive). Only the snapshots of
+        the range are read.
+        """
+        (first, last) = self._range(start, end)
+        columns = {}
+        for name in ('time', 'cost', 'value'):
+            columns[name] = self._read('snapshots', name, first, last)
+        columns['gain'] = _subtract(columns['value'], columns['cost'])
+        return ValuationCurve(columns)
+
+    def symbol(self, symbol, start=None, end=None):
+        """
+        Return the ValuationCurve of symbol from start to end (Epoch
+        format, inclusive). The deltas are read from the last keyframe
+        before start.
+        """
+        (first, last) = self._range(start, end)
+        times = self._read('snapshots', 'time', first, last)
+        count = last - first
+        if symbol not in self._ids or not count:
+            amounts = prices = costs = _zeros(count)
+        else:
+            keyframe = self._keyframe(first)
+            starts = self._read('snapshots', 'first', keyframe, last)
+            end_delta = self._end(last - 1)
+            lo = starts[0]
+            ids = self._read('deltas', 'symbol', lo, end_delta)
+            columns = [self._read('deltas', name, lo, end_delta)
+                       for name in ('amount', 'price', 'cost')]
+            (amounts, prices, costs) = _fill(self._ids[symbol], ids, columns,
+                                             starts, first - keyframe)
+        values = _multiply(amounts, prices)
+        return ValuationCurve({'time': times,
+                               'amount': amounts,
+                               'price': prices,
+                               'cost': costs,
+                               'value': values,
+                               'gain': _subtract(values, costs)})
+
+    def at(self, when):
+        """
+        Return a dictionary of the SymbolValue of every symbol held at
+        the last snapshot taken at or before when.
+        """
+        pos = self._search(when, True) - 1
+        if pos < 0:
+            return {}
+        state = self._replay(self._keyframe(pos), pos + 1)
+        values = {}
+        for (symbol, (amount, price, cost)) in state.items():
+            value = float(amount * price)
+            values[symbol] = SymbolValue(symbol, int(amount), price, cost,
+                                         value, value - cost)
+        return values
+
+    def sync(self):
+        """
+        Force the history to disk.
+        """
+        for f in self._files.values():
+            f.flush()
+            os.fsync(f.fileno())
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+    def _open(self):
+        """
+        Load the symbols and the state of the last snapshot. Columns
+        left longer than the others by an interrupted snapshot are cut.
+        """
+        path = os.path.join(self.directory, "symbols")
+        if os.path.exists(path):
+            f = open(path, "r")
+            try:
+                self._symbols = f.read().split()
+            finally:
+                f.close()
+        for (pos, symbol) in enumerate(self._symbols):
+            self._ids[symbol] = pos
+
+        self._count = self._truncate('snapshots', SNAPSHOTS)
+        self._deltas = 0
+        self._last = None
+        if self._count:
+            pos = self._count - 1
+            self._deltas = self._end(pos)
+            self._last = float(self._read('snapshots', 'time',
+                                          pos, pos + 1)[0])
+        self._truncate('deltas', DELTAS, self._deltas)
+        keyframes = [int(pos) for pos in
+                     self._read('keyframes', 'snapshot', 0,
+                                self._size('keyframes', KEYFRAMES[0]))]
+        kept = bisect.bisect_left(keyframes, self._count)
+        self._truncate('keyframes', KEYFRAMES, kept)
+        self._keyframes = keyframes[:kept]
+
+        if self._count:
+            self._state = self._replay(self._keyframe(self._count - 1),
+                                       self._count)
+            for (amount, price, cost) in self._state.values():
+                self._cost += cost
+                self._value += amount * price
+
+    def _write(self, when, deltas, keyframe):
+        new = [symbol for (symbol, a, p, c) in deltas
+               if symbol not in self._ids]
+        if new:
+            f = open(os.path.join(self.directory, "symbols"), "a")
+            try:
+                for symbol in new:
+                    self._ids[symbol] = len(self._symbols)
+                    self._symbols.append(symbol)
+                    f.write(symbol + "\n")
+            finally:
+                f.close()
+        # deltas and keyframes first, the snapshot commits them
+        rows = [(self._ids[symbol], amount, price, cost)
+                for (symbol, amount, price, cost) in deltas]
+        self._append('deltas', DELTAS, rows)
+        if keyframe:
+            self._append('keyframes', KEYFRAMES, [(self._count,)])
+            self._keyframes.append(self._count)
+        self._append('snapshots', SNAPSHOTS,
+                     [(when, self._deltas, len(rows), self._cost,
+                       self._value)])
+        self._deltas += len(rows)
+        self._count += 1
+        self._last = when
+
+    def _append(self, table, columns, rows):
+        if not rows:
+            return
+        for (pos, (name, dtype, typecode)) in enumerate(columns):
+            values = array.array(typecode, [row[pos] for row in rows])
+            if sys.byteorder != 'little':
+                values.byteswap()
+            key = (table, name)
+            f = self._files.get(key)
+            if f is None:
+                f = self._files[key] = open(self._path(table, name), "ab")
+            values.tofile(f)
+            f.flush()
+
+    def _replay(self, first, last):
+        """
+        Return the {symbol: (amount, price, cost)} state after the
+        snapshots first (a keyframe) to last.
+        """
+        state = {}
+        if first >= last:
+            return state
+        lo = self._read('snapshots', 'first', first, first + 1)[0]
+        hi = self._end(last - 1)
+        columns = [self._read('deltas', name, lo, hi)
+                   for (name, dtype, typecode) in DELTAS]
+        for (symbol, amount, price, cost) in zip(*columns):
+            symbol = self._symbols[int(symbol)]
+            if amount or cost:
+                state[symbol] = (int(amount), float(price), float(cost))
+            else:
+                state.pop(symbol, None)
+        return state
+
+    def _end(self, pos):
+        """
+        Return the position after the last delta of the snapshot pos.
+        """
+        return int(self._read('snapshots', 'first', pos, pos + 1)[0] +
+                   self._read('snapshots', 'count', pos, pos + 1)[0])
+
+    def _keyframe(self, pos):
+        """
+        Return the last keyframe at or before the snapshot pos.
+        """
+        index = bisect.bisect_right(self._keyframes, pos) - 1
+        if index < 0:
+            return 0
+        return self._keyframes[index]
+
+    def _range(self, start, end):
+        first = 0
+        last = self._count
+        if start is not None:
+            first = self._search(start, False)
+        if end is not None:
+            last = self._search(end, True)
+        return (first, max(first, last))
+
+    def _search(self, when, right):
+        """
+        Return the position where when would be inserted among the
+        times of the snapshots.
+        """
+        if not self._count:
+            return 0
+        self._flush()
+        path = self._path('snapshots', 'time')
+        if numpy is not None:
+            times = numpy.memmap(path, dtype='<f8', mode='r',
+                                 shape=(self._count,))
+            return int(numpy.searchsorted(times, when,
+                                          right and 'right' or 'left'))
+        f = open(path, "rb")
+        try:
+            view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                (lo, hi) = (0, self._count)
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    value = struct.unpack_from('<d', view, mid * 8)[0]
+                    if value < when or (right and value == when):
+                        lo = mid + 1
+                    else:
+                        hi = mid
+                return lo
+            finally:
+                view.close()
+        finally:
+            f.close()
+
+    def _read(self, table, name, start, stop):
+        """
+        Return the values start to stop of a column.
+        """
+        (dtype, typecode) = _types[(table, name)]
+        if stop <= start:
+            return _empty(dtype, typecode)
+        self._flush()
+        path = self._path(table, name)
+        if numpy is not None:
+            return numpy.memmap(path, dtype=dtype, mode='r',
+                                shape=(stop,))[start:stop]
+        size = array.array(typecode).itemsize
+        f = open(path, "rb")
+        try:
+            f.seek(start * size)
+            return _load(typecode, f.read((stop - start) * size))
+        finally:
+            f.close()
+
+    def _flush(self):
+        for f in self._files.values():
+            f.flush()
+
+    def _size(self, table, column):
+        path = self._path(table, column[0])
+        if not os.path.exists(path):
+            return 0
+        return os.path.getsize(path) // array.array(column[2]).itemsize
+
+    def _truncate(self, table, columns, count=None):
+        """
+        Cut the columns of table to count values (default: to the
+        shortest column) and return count.
+        """
+        sizes = [self._size(table, column) for column in columns]
+        if count is None:
+            count = min(sizes)
+        for (column, size) in zip(columns, sizes):
+            if size > count:
+                f = open(self._path(table, column[0]), "r+b")
+                try:
+                    f.truncate(count * array.array(column[2]).itemsize)
+                finally:
+                    f.close()
+        return count
+
+    def _path(self, table, name):
+        return os.path.join(self.directory, "%s.%s" % (table, name))
+
+_types = {}
+for (_table, _columns) in (('snapshots', SNAPSHOTS),
+                           ('deltas', DELTAS),
+                           ('keyframes', KEYFRAMES)):
+    for (_name, _dtype, _typecode) in _columns:
+        _types[(_table, _name)] = (_dtype, _typecode)
+
+def _empty(dtype, typecode):
+    if numpy is not None:
+        return numpy.zeros(0, dtype)
+    return array.array(typecode)
+
+def _zeros(count):
+    if numpy is not None:
+        return numpy.zeros(count)
+    return array.array('d', [0.0]) * count
+
+def _subtract(left, right):
+    if numpy is not None:
+        return numpy.asarray(left) - numpy.asarray(right)
+    return array.array('d', [l - r for (l, r) in zip(left, right)])
+
+def _multiply(left, right):
+    if numpy is not None:
+        return numpy.asarray(left) * numpy.asarray(right)
+    return array.array('d', [l * r for (l, r) in zip(left, right)])
+
+def _fill(key, ids, columns, starts, skip):
+    """
+    Return the (amounts, prices, costs) of symbol key at every snapshot
+    whose first delta is in starts, from the deltas ids and columns,
+    without the first skip snapshots. The values of a snapshot where
+    the symbol did not change are the values of the previous one.
+    """
+    count = len(starts)
+    base = starts[0]
+    if numpy is not None:
+        found = numpy.nonzero(numpy.asarray(ids) == key)[0]
+        snapshots = numpy.searchsorted(numpy.asarray(starts), found + base,
+                                       'right') - 1
+        # delta of the symbol in effect at every snapshot, -1 before the
+        # first one, which picks the 0.0 appended to the values
+        latest = numpy.zeros(count, int) - 1
+        latest[snapshots] = numpy.arange(len(found))
+        latest = numpy.maximum.accumulate(latest)
+        results = []
+        for column in columns:
+            values = numpy.append(numpy.asarray(column, float)[found], 0.0)
+            results.append(values[latest][skip:])
+        return tuple(results)
+
+    results = [array.array('d', [0.0]) * count for column in columns]
+    current = [0.0] * len(columns)
+    snapshot = 0
+    for (pos, symbol) in enumerate(ids):
+        if symbol != key:
+            continue
+        found = bisect.bisect_right(starts, pos + base) - 1
+        while snapshot < found:
+            for (result, value) in zip(results, current):
+                result[snapshot] = value
+            snapshot += 1
+        current = [column[pos] for column in columns]
+    while snapshot < count:
+        for (result, value) in zip(results, current):
+            result[snapshot] = value
+        snapshot += 1
+    return tuple([result[skip:] for result in results])
@@ -0,0 +1,374 @@
+#!/usr/bin/python
+#
+
+"""
+Rendering of quote and portfolio reports as text, CSV or JSON.
+
+A report is a list of Column and an iterable of rows. Rows are read
+`chunk_size' at a time and every column of a chunk is formatted at
+once with a format spec compiled when the report starts, so very large
+reports render in constant memory:
+
+    >>> render(SYMBOL_COLUMNS, valuation_rows(pm.getValuation()))
+    symbol       amount      price           cost          value           gain
+    YHOO            100      25.56       2,000.00       2,556.00        +556.00
+    total                                2,000.00       2,556.00        +556.00
+    >>> render(LOT_COLUMNS, lot_rows(report), f, 'csv')
+    100000
+
+Columns have a kind: TEXT, INTEGER (amounts, volumes), PRICE, MONEY,
+GAIN (signed), PERCENT (signed, the value being a percentage) or DATE
+(Epoch format). Text reports align them in fixed width columns with
+thousands separators, CSV reports hold the exact values (dates as text)
+and JSON reports a list of objects keyed by column name (dates in
+Epoch format). None is left blank and NA written as N/A (null in JSON).
+"""
+
+import csv
+import sys
+import time
+
+from itertools import izip
+
+try:
+    import json
+except ImportError:
+    json = None
+
+from pystocks.YahooFinance import NA
+
+__revision__ = "$Id$"
+
+# column kinds
+TEXT = 'text'
+INTEGER = 'integer'
+PRICE = 'price'
+MONEY = 'money'
+GAIN = 'gain'
+PERCENT = 'percent'
+DATE = 'date'
+
+# default width of the columns of every kind in text reports
+WIDTHS = {TEXT: 8, INTEGER: 12, PRICE: 10, MONEY: 14, GAIN: 14,
+          PERCENT: 8, DATE: 19}
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# output formats
+FORMATS = ('text', 'csv', 'json')
+
+class Column:
+    """
+    A column of a report.
+    """
+    def __init__(self, name, kind=TEXT, width=None, title=None,
+                 decimals=2):
+        """
+        name: key of the column in JSON reports
+        kind: TEXT, INTEGER, PRICE, MONEY, GAIN, PERCENT or DATE
+              (default: TEXT)
+        width: characters of the column in text reports, longer text
+               is cut (default: WIDTHS[kind])
+        title: header of the column (default: name)
+        decimals: digits after the decimal point of PRICE, MONEY, GAIN
+                  and PERCENT columns in text reports (default: 2)
+        """
+        if kind not in WIDTHS:
+            raise ValueError("Unknown column kind: %s" % kind)
+        self.name = name
+        self.kind = kind
+        self.width = width or WIDTHS[kind]
+        self.title = title or name
+        self.decimals = decimals
+
+    def text_format(self):
+        """
+        Return the str.format() spec of the values of the column in text
+        reports, padding included.
+        """
+        if self.kind == TEXT:
+            return "{:<%d.%d}" % (self.width, self.width)
+        if self.kind == INTEGER:
+            return "{:>%d,d}" % self.width
+        if self.kind in (PRICE, MONEY):
+            return "{:>%d,.%df}" % (self.width, self.decimals)
+        if self.kind == GAIN:
+            return "{:>+%d,.%df}" % (self.width, self.decimals)
+        if self.kind == PERCENT:
+            return "{:>+%d.%df}%%" % (self.width - 1, self.decimals)
+        return "{:>%d}" % self.width
+
+    def __repr__(self):
+        return "<Column %s %s>" % (self.name, self.kind)
+
+def _cast(kind):
+    """
+    Return the conversion of the values of a kind of column before
+    they are formatted, when formatting them as is failed.
+    """
+    if kind in (INTEGER, DATE):
+        return int
+    if kind == TEXT:
+        return str
+    return float
+
+def _format_dates(values):
+    # lots bought together share their time, format it once
+    dates = {}
+    formatted = []
+    for value in values:
+        if value is None or value is NA:
+            formatted.append(value)
+            continue
+        date = dates.get(value)
+        if date is None:
+            date = dates[value] = time.strftime(DATE_FORMAT,
+                                                time.localtime(value))
+        formatted.append(date)
+    return formatted
+
+def _replace(values, blank, missing):
+    """
+    Replace None by blank and NA by missing in a TEXT or DATE column.
+    """
+    replaced = []
+    for value in values:
+        if value is None:
+            value = blank
+        elif value is NA:
+            value = missing
+        replaced.append(value)
+    return replaced
+
+def format_column(values, format, cast, blank="", missing="N/A"):
+    """
+    Format a column of values at once with format, a callable.
+
+    cast: conversion applied to the values format does not accept
+    blank: text of None values
+    missing: text of NA values
+    """
+    try:
+        return map(format, values)
+    except (TypeError, ValueError):
+        pass
+    formatted = []
+    for value in values:
+        if value is None:
+            formatted.append(blank)
+        elif value is NA:
+            formatted.append(missing)
+        else:
+            formatted.append(format(cast(value)))
+    return formatted
+
+class TextRenderer:
+    """
+    Render rows as fixed width columns.
+    """
+    def __init__(self, columns, out=sys.stdout, header=True):
+        self.columns = columns
+        self.out = out
+        self.header = header
+        self._formats = [column.text_format().format for column in columns]
+        self._blanks = [" " * column.width for column in columns]
+        self._missing = []
+        for column in columns:
+            if column.kind == TEXT:
+                self._missing.append("%-*s" % (column.width, "N/A"))
+            else:
+                self._missing.append("%*s" % (column.width, "N/A"))
+        self._casts = [_cast(column.kind) for column in columns]
+
+    def begin(self):
+        if not self.header:
+            return
+        titles = []
+        for column in self.columns:
+            if column.kind == TEXT:
+                titles.append("%-*.*s" % (column.width, column.width,
+                                          column.title))
+            else:
+                titles.append("%*s" % (column.width, column.title))
+        self.out.write(" ".join(titles).rstrip() + "\n")
+
+    def write(self, columns):
+        formatted = []
+        for (pos, values) in enumerate(columns):
+            kind = self.columns[pos].kind
+            if kind == DATE:
+                values = _format_dates(values)
+            if kind in (TEXT, DATE):
+                values = _replace(values, "", "N/A")
+            formatted.append(format_column(values, self._formats[pos],
+                                           self._casts[pos],
+                                           self._blanks[pos],
+                                           self._missing[pos]))
+        lines = [" ".join(row).rstrip() for row in izip(*formatted)]
+        self.out.write("\n".join(lines) + "\n")
+
+    def end(self):
+        pass
+
+class CSVRenderer:
+    """
+    Render rows as CSV, with exact values.
+    """
+    def __init__(self, columns, out=sys.stdout, header=True,
+                 dialect='excel'):
+        self.columns = columns
+        self.out = out
+        self.header = header
+        self._writer = csv.writer(out, dialect)
+
+    def begin(self):
+        if self.header:
+            self._writer.writerow([column.title for column in self.columns])
+
+    def write(self, columns):
+        formatted = []
+        for (column, values) in zip(self.columns, columns):
+            if column.kind == DATE:
+                values = _format_dates(values)
+            if column.kind in (TEXT, DATE):
+                # the csv module leaves None blank
+                formatted.append(_replace(values, None, "N/A"))
+                continue
+            if column.kind == INTEGER:
+                format = "{:d}".format
+            else:
+                format = float.__repr__
+            formatted.append(format_column(values, format,
+                                           _cast(column.kind), "", "N/A"))
+        self._writer.writerows(izip(*formatted))
+
+    def end(self):
+        pass
+
+class JSONRenderer:
+    """
+    Render rows as a JSON list of objects, written as the rows come.
+    """
+    def __init__(self, columns, out=sys.stdout, header=True):
+        if json is None:
+            raise ValueError("JSON reports require the json module")
+        self.columns = columns
+        self.out = out
+        self._names = [column.name for column in columns]
+        self._first = True
+
+    def begin(self):
+        self.out.write("[")
+
+    def write(self, columns):
+        converted = []
+        for (column, values) in zip(self.columns, columns):
+            if column.kind == TEXT:
+                converted.append(_replace(values, None, None))
+            else:
+                convert = _cast(column.kind)
+                converted.append(format_column(values, convert, convert,
+                                               None, None))
+        names = self._names
+        objects = [dict(izip(names, row)) for row in izip(*converted)]
+        if not self._first:
+            self.out.write(",")
+        self._first = False
+        # the objects of the chunk without the brackets of the list
+        self.out.write(json.dumps(objects)[1:-1])
+
+    def end(self):
+        self.out.write("]\n")
+
+RENDERERS = {'text': TextRenderer, 'csv': CSVRenderer, 'json': JSONRenderer}
+
+def render(columns, rows, out=sys.stdout, format='text', header=True,
+           chunk_size=1000):
+    """
+    Write a report.
+
+    columns: list of Column
+    rows: iterable of tuples of the values of every column
+    out: file-like object (default: sys.stdout)
+    format: 'text', 'csv' or 'json' (default: 'text')
+    header: write the titles of the columns (default: True)
+    chunk_size: rows formatted at once (default: 1000)
+
+    Returns the amount of rows written.
+    """
+    if format not in RENDERERS:
+        raise ValueError("Unknown report format: %s" % format)
+    renderer = RENDERERS[format](columns, out, header)
+    renderer.begin()
+    count = 0
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            renderer.write(zip(*chunk))
+            count += len(chunk)
+            chunk = []
+    if chunk:
+        renderer.write(zip(*chunk))
+        count += len(chunk)
+    renderer.end()
+    return count
+
+QUOTE_COLUMNS = (Column('symbol'),
+                 Column('company', width=24),
+                 Column('price', PRICE),
+                 Column('change', GAIN, width=9),
+                 Column('percent', PERCENT, title='%'),
+                 Column('volume', INTEGER, width=14))
+
+SYMBOL_COLUMNS = (Column('symbol'),
+                  Column('amount', INTEGER, width=10),
+                  Column('price', PRICE),
+                  Column('cost', MONEY),
+                  Column('value', MONEY),
+                  Column('gain', GAIN))
+
+LOT_COLUMNS = (Column('symbol'),
+               Column('amount', INTEGER, width=10),
+               Column('paid', PRICE),
+               Column('bought', DATE),
+               Column('price', PRICE),
+               Column('cost', MONEY),
+               Column('value', MONEY),
+               Column('gain', GAIN))
+
+def quote_rows(quotes, symbols=None):
+    """
+    Iterate over the rows of QUOTE_COLUMNS of quotes, a dictionary of
+    YahooQuoteFinder by symbol (see YahooQuoteFinder.fetch_many()).
+    Symbols that could not be looked up are left out.
+
+    symbols: order of the rows (default: sorted symbols)
+    """
+    for symbol in symbols or sorted(quotes):
+        quote = quotes[symbol]
+        if isinstance(quote, Exception):
+            continue
+        yield (symbol, quote.company, quote.last_price, quote.change_cash,
+               quote.change_percent, quote.volume_daily)
+
+def valuation_rows(report, total=True):
+    """
+    Iterate over the rows of SYMBOL_COLUMNS of a ValuationReport, the
+    totals of the portfolio last.
+    """
+    for symbol in sorted(report.symbols):
+        value = report.symbols[symbol]
+        yield (symbol, value.amount, value.price, value.cost, value.value,
+               value.gain)
+    if total:
+        yield ('total', None, None, report.cost, report.value, report.gain)
+
+def lot_rows(report):
+    """
+    Iterate over the rows of LOT_COLUMNS of a ValuationReport, read
+    from its columns.
+    """
+    lots = report.lots
+    return izip(lots['symbol'], lots['amount'], lots['paid'], lots['epoch'],
+                lots['price'], lots['cost'], lots['value'], lots['gain'])
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+#
+
+"""
+Unit tests of PyStocks.
+
+The tests never reach the network: quotes are answered by a
+FeedTransport from recorded rows (see StandInServer), which tests
+change to make the feed return N/A, markup or malformed rows. They are
+run from the directory holding the pystocks package:
+
+    $ python -m unittest discover -s pystocks/Tests -t .
+"""
+
+import re
+import urlparse
+
+from pystocks.YahooFinance import Transport
+from pystocks.YahooFinance import QuoteCache
+from pystocks.YahooFinance.StandInServer import load_recordings
+
+__revision__ = "$Id$"
+
+_tag_re = re.compile(r'[a-z][0-9]?')
+_number_re = re.compile(r'^[-+]?[0-9]*\.?[0-9]+$')
+
+class FeedTransport(Transport.Transport):
+    """
+    Answer quote requests from recorded rows without a server.
+    """
+    def __init__(self):
+        (self.tags, self.recordings) = load_recordings()
+        self.requests = 0
+        self.fail = False
+        self.blank = set() # symbols answered by a blank line
+        self.short = {} # symbol -> columns kept of its cut rows
+        self.gate = None # threading.Event requests wait for
+
+    def set(self, symbol, **values):
+        """
+        Change the recorded tag values of symbol, e.g. l1='N/A'.
+        """
+        self.recordings.setdefault(symbol.upper(), {'s': symbol.upper(),
+                                                    'v': '1000'})
+        self.recordings[symbol.upper()].update(values)
+
+    def open(self, url, timeout=None):
+        self.requests += 1
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.fail:
+            raise IOError("feed unavailable")
+        query = urlparse.parse_qs(urlparse.urlsplit(url)[3])
+        tags = _tag_re.findall(query['f'][0])
+        lines = [self.render(symbol, tags)
+                 for symbol in query['s'][0].split()]
+        return Transport.Response(url, 200, {},
+                                  "".join([l + "\r\n" for l in lines]))
+
+    def render(self, symbol, tags):
+        if symbol.upper() in self.blank:
+            return ""
+        record = self.recordings.get(symbol.upper(), {'s': symbol})
+        items = []
+        for tag in tags:
+            value = record.get(tag, 'N/A')
+            if value == 'N/A' or _number_re.match(value):
+                items.append(value)
+            else:
+                items.append('"%s"' % value.replace('"', '""'))
+        if symbol.upper() in self.short:
+            items = items[:self.short[symbol.upper()]]
+        return ",".join(items)
+
+def install_feed():
+    """
+    Answer the quote requests with a new FeedTransport and an empty
+    quote cache.
+
+    Returns the transport, restore_feed() puts the previous one back.
+    """
+    feed = FeedTransport()
+    feed.previous = (Transport.set_transport(feed),
+                     QuoteCache.set_cache(QuoteCache.QuoteCache()))
+    return feed
+
+def restore_feed(feed):
+    (transport, cache) = feed.previous
+    Transport.set_transport(transport)
+    QuoteCache.set_cache(cache)
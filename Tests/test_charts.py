@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+#
+
+"""
+Tests of ChartCache and ChartFetcher.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pystocks.YahooFinance import FeedError
+from pystocks.YahooFinance.ChartCache import ChartCache, ChartFetcher
+
+__revision__ = "$Id$"
+
+class StubChart:
+    """
+    Chart downloading a made-up image of its symbol.
+    """
+    def __init__(self, symbol, range='1y', fail=False):
+        self.symbol = symbol
+        self.range = range
+        self.fail = fail
+        self.downloads = 0
+
+    def _build_url(self):
+        return ("http://chart.finance.yahoo.com/z?s=%s&t=%s&q=l" %
+                (self.symbol, self.range))
+
+    def download(self, timeout=None):
+        self.downloads += 1
+        if self.fail:
+            raise FeedError("Could not fetch chart: %s" % self.symbol)
+        return "GIF89a" + self.symbol
+
+class ChartFetcherTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='pystocks-test-')
+        self.cache = ChartCache(self.directory)
+        self.fetcher = ChartFetcher(self.cache, concurrency=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_cached_image_is_not_downloaded_again(self):
+        chart = StubChart('YHOO')
+        self.assertEqual(self.fetcher.get(chart), "GIF89aYHOO")
+        self.assertEqual(self.fetcher.get(chart), "GIF89aYHOO")
+        self.assertEqual(chart.downloads, 1)
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 1})
+
+    def test_failed_download(self):
+        charts = [StubChart('YHOO'), StubChart('GOOG', fail=True)]
+        images = self.fetcher.fetch(charts)
+        self.assertEqual(images[charts[0]], "GIF89aYHOO")
+        self.assertTrue(isinstance(images[charts[1]], FeedError))
+        self.assertRaises(FeedError, self.fetcher.get, charts[1])
+
+    def test_unwritable_cache(self):
+        chart = StubChart('YHOO')
+        # a file where the image's directory should be
+        directory = os.path.dirname(self.cache.path(chart))
+        open(directory, "w").close()
+        self.assertRaises(IOError, self.cache.set, chart, "GIF89a")
+        other = StubChart('GOOG')
+        images = self.fetcher.fetch([chart, other])
+        self.assertEqual(images[chart], "GIF89aYHOO")
+        self.assertEqual(images[other], "GIF89aGOOG")
+        self.assertEqual(self.fetcher.get(chart), "GIF89aYHOO")
+        self.assertEqual(chart.downloads, 2)
+        self.assertEqual(self.cache.get(chart), None)
+        self.assertEqual(self.cache.get(other), "GIF89aGOOG")
+
+if __name__ == '__main__':
+    unittest.main()
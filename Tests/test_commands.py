@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#
+
+"""
+Tests of the commands of the pystocks command line tool.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from cStringIO import StringIO
+
+from pystocks.Daemon.Commands import Context, run
+from pystocks.PortfolioManager.PortfolioManager import PortfolioManager
+
+__revision__ = "$Id$"
+
+class FakeService:
+    def getCurrentPrice(self, symbol):
+        return 25.0
+
+class ContextTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='pystocks-test-')
+        self.writer = PortfolioManager('test', self.directory, FakeService)
+        self.writer.add('YHOO', 100, 20.0, 1000)
+        self.context = Context(FakeService)
+
+    def tearDown(self):
+        self.context.close()
+        self.writer.close()
+        shutil.rmtree(self.directory)
+
+    def test_report(self):
+        out = StringIO()
+        status = run(self.context, ['portfolio', 'report', '-c',
+                                    self.directory, '-f', 'csv', 'test'],
+                     out)
+        self.assertEqual(status, 0)
+        self.assertEqual(out.getvalue().splitlines()[1],
+                         'YHOO,100,25.0,2000.0,2500.0,500.0')
+
+    def test_reload(self):
+        self.assertEqual(self.context.valuation('test',
+                                                self.directory).value,
+                         2500.0)
+        self.writer.add('GOOG', 10, 400.0, 2000)
+        report = self.context.valuation('test', self.directory)
+        self.assertEqual(sorted(report.symbols), ['GOOG', 'YHOO'])
+
+    def test_reload_keeps_record_being_written(self):
+        self.context.valuation('test', self.directory)
+        journal = os.path.join(self.directory, 'test.portfolio.journal')
+        # another process is appending a record
+        f = open(journal, 'ab')
+        f.write('\x80\x02(K\x02U\x03add')
+        f.close()
+        size = os.path.getsize(journal)
+        report = self.context.valuation('test', self.directory)
+        self.assertEqual(list(report.symbols), ['YHOO'])
+        self.assertEqual(os.path.getsize(journal), size)
+
+    def test_concurrent_valuations(self):
+        errors = []
+        def value():
+            try:
+                for pos in range(20):
+                    report = self.context.valuation('test', self.directory)
+                    if report.symbols['YHOO'].amount != 100:
+                        errors.append(report)
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target=value) for pos in range(4)]
+        for thread in threads:
+            thread.start()
+        for pos in range(20):
+            self.writer.add('GOOG', 1, 400.0, 2000 + pos)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+#
+
+"""
+Tests of HistoryStore, with the history table answered by a
+HistoryTransport.
+"""
+
+import os
+import shutil
+import urlparse
+import datetime
+import tempfile
+import unittest
+
+from pystocks.YahooFinance import Transport
+from pystocks.YahooFinance.History import HistoryStore, EPOCH
+
+__revision__ = "$Id$"
+
+# first day traded by the fake symbol
+LISTED = datetime.date(2000, 1, 3)
+TODAY = datetime.date(2010, 6, 30)
+
+class HistoryTransport(Transport.Transport):
+    """
+    Answer history requests with one bar a day from LISTED, closing at
+    the day's ordinal modulo 1000.
+    """
+    def __init__(self):
+        self.requests = []
+
+    def open(self, url, timeout=None):
+        query = dict([(k, int(v[0])) for (k, v) in
+                      urlparse.parse_qs(urlparse.urlsplit(url)[3]).items()
+                      if k in 'abcdef'])
+        start = datetime.date(query['c'], query['a'] + 1, query['b'])
+        end = datetime.date(query['f'], query['d'] + 1, query['e'])
+        self.requests.append((start, end))
+        lines = ["Date,Open,High,Low,Close,Volume,Adj Close"]
+        day = end
+        while day >= max(start, LISTED):
+            close = day.toordinal() % 1000
+            lines.append("%s,%d,%d,%d,%d,1000,%d" % (day.isoformat(), close,
+                                                     close, close, close,
+                                                     close))
+            day -= datetime.timedelta(days=1)
+        return Transport.Response(url, 200, {}, "\n".join(lines) + "\n")
+
+class HistoryStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='pystocks-test-')
+        self.store = HistoryStore(self.directory)
+        self.feed = HistoryTransport()
+        self.previous = Transport.set_transport(self.feed)
+
+    def tearDown(self):
+        Transport.set_transport(self.previous)
+        shutil.rmtree(self.directory)
+
+    def days(self, start, end):
+        return (end - start).days + 1
+
+    def check(self, start, end):
+        """
+        Check that the store holds every day from start to end, in order.
+        """
+        bars = self.store.bars('PSTK')
+        self.assertEqual(len(bars), self.days(start, end))
+        dates = bars.dates()
+        self.assertEqual((dates[0], dates[-1]), (start, end))
+        self.assertEqual(dates, sorted(dates))
+        for (date, close) in zip(dates, bars.close):
+            self.assertEqual(close, date.toordinal() % 1000)
+
+    def test_update(self):
+        added = self.store.update('PSTK', '1y', TODAY)
+        start = TODAY - datetime.timedelta(days=366)
+        self.assertEqual(added, self.days(start, TODAY))
+        self.assertEqual(self.store.symbols(), ['PSTK'])
+        self.assertEqual(self.store.last_date('PSTK'), TODAY)
+        self.check(start, TODAY)
+
+    def test_update_appends_new_days(self):
+        self.store.update('PSTK', '1y', TODAY)
+        tomorrow = TODAY + datetime.timedelta(days=1)
+        self.assertEqual(self.store.update('PSTK', '1y', tomorrow), 1)
+        self.assertEqual(self.feed.requests[-1], (tomorrow, tomorrow))
+        self.assertEqual(self.store.update('PSTK', '1y', tomorrow), 0)
+        self.assertEqual(len(self.feed.requests), 2)
+
+    def test_longer_range_backfills(self):
+        self.store.update('PSTK', '1y', TODAY)
+        start = TODAY - datetime.timedelta(days=366)
+        added = self.store.update('PSTK', 'max', TODAY)
+        self.assertEqual(added, self.days(LISTED, start) - 1)
+        self.assertEqual(self.feed.requests[-1],
+                         (EPOCH, start - datetime.timedelta(days=1)))
+        self.check(LISTED, TODAY)
+        self.assertEqual(self.store.symbols(), ['PSTK'])
+
+    def test_days_before_listing_are_not_asked_again(self):
+        self.store.update('PSTK', 'max', TODAY)
+        self.check(LISTED, TODAY)
+        self.assertEqual(self.store.start_date('PSTK'), EPOCH)
+        self.assertEqual(self.store.update('PSTK', 'max', TODAY), 0)
+        self.assertEqual(len(self.feed.requests), 1)
+
+    def test_shorter_range_keeps_earlier_days(self):
+        self.store.update('PSTK', '2y', TODAY)
+        self.assertEqual(self.store.update('PSTK', '1y', TODAY), 0)
+        self.check(TODAY - datetime.timedelta(days=731), TODAY)
+
+    def test_between(self):
+        self.store.update('PSTK', '1y', TODAY)
+        start = datetime.date(2010, 1, 1)
+        end = datetime.date(2010, 1, 31)
+        bars = self.store.bars('PSTK').between(start, end)
+        self.assertEqual(len(bars), 31)
+        rows = list(bars.rows())
+        self.assertEqual(rows[0][0], start)
+        self.assertEqual(rows[-1][0], end)
+
+    def test_interrupted_append_is_cut(self):
+        self.store.update('PSTK', '5d', TODAY)
+        # a crash after writing the first column of the next bar
+        f = open(os.path.join(self.directory, 'PSTK', 'date'), "ab")
+        f.write("\0\0\0\0")
+        f.close()
+        self.assertEqual(len(self.store.bars('PSTK')), 6)
+        self.assertEqual(self.store.last_date('PSTK'), TODAY)
+
+    def test_remove(self):
+        self.store.update('PSTK', '5d', TODAY)
+        self.store.remove('PSTK')
+        self.assertFalse('PSTK' in self.store)
+        self.assertEqual(self.store.symbols(), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+#
+
+"""
+Tests of the indicators: the vectorized functions agree with the
+classes updated one bar at a time.
+"""
+
+import math
+import unittest
+
+from pystocks.YahooFinance import Indicators
+
+__revision__ = "$Id$"
+
+PRICES = [25.0, 25.5, 0.0, 24.75, 26.0, 26.0, 0.0, 0.0, 27.25, 26.5, 25.75,
+          26.25, 27.0]
+
+class IndicatorsTest(unittest.TestCase):
+    def assertSeriesEqual(self, first, second):
+        self.assertEqual(len(first), len(second))
+        for (a, b) in zip(first, second):
+            if math.isnan(a) or math.isnan(b):
+                self.assertTrue(math.isnan(a) and math.isnan(b),
+                                "%r != %r" % (list(first), list(second)))
+            else:
+                self.assertAlmostEqual(a, b)
+
+    def test_sma(self):
+        for period in (1, 3, 20):
+            self.assertSeriesEqual(
+                Indicators.sma(PRICES, period),
+                Indicators._run(Indicators.SMA(period), PRICES))
+
+    def test_roc(self):
+        for period in (1, 2, 20):
+            self.assertSeriesEqual(
+                Indicators.roc(PRICES, period),
+                Indicators._run(Indicators.ROC(period), PRICES))
+
+    def test_roc_zero_base(self):
+        values = Indicators.roc([0.0, 1.0, 2.0], 1)
+        self.assertTrue(math.isnan(values[1]))
+        self.assertEqual(values[2], 100.0)
+
+    def test_bollinger(self):
+        expected = Indicators._run(Indicators.Bollinger(3, 2.0), PRICES)
+        for (vectorized, streamed) in zip(Indicators.bollinger(PRICES, 3),
+                                          expected):
+            self.assertSeriesEqual(vectorized, streamed)
+
+if __name__ == '__main__':
+    unittest.main()
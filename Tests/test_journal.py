@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+#
+
+"""
+Tests of the replay of the portfolio journal after a crash.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pystocks.PortfolioManager.Journal import JournalStorage, FSYNC_NEVER
+
+__revision__ = "$Id$"
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='pystocks-test-')
+        self.path = os.path.join(self.directory, 'test.portfolio')
+        self.journal = self.path + '.journal'
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def open(self):
+        return JournalStorage(self.path, fsync=FSYNC_NEVER)
+
+    def rows(self, storage):
+        return sorted(storage.rows())
+
+    def write(self, count, start=0):
+        storage = self.open()
+        for pos in range(start, start + count):
+            storage.add('YHOO', 10, 25.0, 1000 + pos)
+        storage.close()
+
+    def test_replay(self):
+        self.write(3)
+        storage = self.open()
+        self.assertEqual(len(self.rows(storage)), 3)
+        self.assertEqual(storage.journal.records, 3)
+        storage.close()
+
+    def test_torn_record(self):
+        self.write(3)
+        size = os.path.getsize(self.journal)
+        self.write(1, 3)
+        # the last record was only partially written
+        f = open(self.journal, 'r+b')
+        f.truncate(size + (os.path.getsize(self.journal) - size) // 2)
+        f.close()
+
+        storage = self.open()
+        self.assertEqual([row[3] for row in self.rows(storage)],
+                         [1000, 1001, 1002])
+        self.assertEqual(os.path.getsize(self.journal), size)
+        # records appended after the repair are read back
+        storage.add('GOOG', 5, 450.0, 2000)
+        storage.close()
+        self.assertEqual(len(self.rows(self.open())), 4)
+
+    def test_torn_record_without_repair(self):
+        self.write(2)
+        f = open(self.journal, 'ab')
+        f.write('\x80\x02(garbage')
+        f.close()
+        size = os.path.getsize(self.journal)
+        storage = JournalStorage(self.path, fsync=FSYNC_NEVER, repair=False)
+        self.assertEqual(len(self.rows(storage)), 2)
+        storage.reload()
+        self.assertEqual(len(self.rows(storage)), 2)
+        self.assertEqual(os.path.getsize(self.journal), size)
+
+    def test_garbage_after_last_record(self):
+        self.write(2)
+        size = os.path.getsize(self.journal)
+        f = open(self.journal, 'ab')
+        f.write('\x80\x02(garbage')
+        f.close()
+        storage = self.open()
+        self.assertEqual(len(self.rows(storage)), 2)
+        self.assertEqual(os.path.getsize(self.journal), size)
+        storage.close()
+
+    def test_crash_between_snapshot_and_truncation(self):
+        self.write(3)
+        f = open(self.journal, 'rb')
+        journal = f.read()
+        f.close()
+        storage = self.open()
+        storage.save()
+        storage.close()
+        # the journal was not emptied after the snapshot was renamed
+        f = open(self.journal, 'wb')
+        f.write(journal)
+        f.close()
+        self.assertEqual(len(self.rows(self.open())), 3)
+
+if __name__ == '__main__':
+    unittest.main()
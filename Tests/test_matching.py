@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+#
+
+"""
+Tests of the selection of the batches of shares removed or sold, with
+the journal and SQLite storages.
+"""
+
+import shutil
+import tempfile
+import unittest
+
+from pystocks.PortfolioManager.Matching import (FIFO, LIFO, HIGHEST_COST,
+                                                SPECIFIC, Fill, match)
+from pystocks.PortfolioManager.PortfolioManager import (PortfolioManager,
+                                                        PortfolioError)
+
+__revision__ = "$Id$"
+
+class FakeService:
+    def getCurrentPrice(self, symbol):
+        return 25.0
+
+# (amount, price, epoch), oldest first
+LOTS = [(100, 10.0, 1000), (100, 20.0, 2000), (100, 15.0, 3000)]
+
+class MatchTest(unittest.TestCase):
+    def test_partial_fill(self):
+        candidates = [(0, 100, 10.0, 1000), (1, 100, 20.0, 2000)]
+        self.assertEqual(match(iter(candidates), 150),
+                         [(0, 0, Fill(100, 10.0, 1000)),
+                          (1, 50, Fill(50, 20.0, 2000))])
+
+    def test_stops_at_first_batch_not_needed(self):
+        def candidates():
+            yield (0, 100, 10.0, 1000)
+            raise AssertionError("read a batch that was not needed")
+        self.assertEqual(match(candidates(), 100),
+                         [(0, 0, Fill(100, 10.0, 1000))])
+
+    def test_every_share(self):
+        candidates = [(0, 100, 10.0, 1000), (1, 0, 20.0, 2000)]
+        self.assertEqual(len(match(iter(candidates))), 2)
+
+class JournalMatchingTest(unittest.TestCase):
+    container = ''
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='pystocks-test-')
+        self.pm = self.open()
+        for (amount, price, epoch) in LOTS:
+            self.pm.add('YHOO', amount, price, epoch)
+
+    def tearDown(self):
+        self.pm.close()
+        shutil.rmtree(self.directory)
+
+    def open(self):
+        return PortfolioManager('test', self.directory + self.container,
+                                FakeService)
+
+    def lots(self):
+        return [(lot.amount, lot.price, lot.time)
+                for lot in self.pm.stocks['YHOO']]
+
+    def sell(self, amount, method, lots=None):
+        return self.pm.sell('YHOO', amount, 25.0, method, lots, 5000)
+
+    def test_fifo(self):
+        sale = self.sell(150, FIFO)
+        self.assertEqual(sale.lots, (Fill(100, 10.0, 1000),
+                                     Fill(50, 20.0, 2000)))
+        self.assertEqual(self.lots(), [(50, 20.0, 2000), (100, 15.0, 3000)])
+
+    def test_lifo(self):
+        sale = self.sell(150, LIFO)
+        self.assertEqual(sale.lots, (Fill(100, 15.0, 3000),
+                                     Fill(50, 20.0, 2000)))
+        self.assertEqual(self.lots(), [(100, 10.0, 1000), (50, 20.0, 2000)])
+
+    def test_highest_cost(self):
+        sale = self.sell(150, HIGHEST_COST)
+        self.assertEqual(sale.lots, (Fill(100, 20.0, 2000),
+                                     Fill(50, 15.0, 3000)))
+        self.assertEqual(self.lots(), [(100, 10.0, 1000), (50, 15.0, 3000)])
+
+    def test_specific(self):
+        sale = self.sell(150, SPECIFIC, [2, 0])
+        self.assertEqual(sale.lots, (Fill(100, 15.0, 3000),
+                                     Fill(50, 10.0, 1000)))
+        self.assertEqual(self.lots(), [(50, 10.0, 1000), (100, 20.0, 2000)])
+
+    def test_specific_requires_lots(self):
+        self.assertRaises(PortfolioError, self.sell, 10, SPECIFIC)
+        self.assertRaises(PortfolioError, self.sell, 10, SPECIFIC, [3])
+
+    def test_realized_gain(self):
+        sale = self.sell(150, FIFO)
+        self.assertEqual(sale.amount, 150)
+        self.assertEqual(sale.cost, 2000.0)
+        self.assertEqual(sale.proceeds, 3750.0)
+        self.assertEqual(sale.gain, 1750.0)
+        self.assertEqual(self.pm.getSales('YHOO'), [sale])
+
+    def test_sell_everything(self):
+        sale = self.sell(0, FIFO)
+        self.assertEqual(sale.amount, 300)
+        self.assertEqual(sale.gain, 7500.0 - 4500.0)
+        self.assertFalse('YHOO' in self.pm.stocks)
+
+    def test_oversell_changes_nothing(self):
+        self.assertRaises(PortfolioError, self.sell, 301, FIFO)
+        self.assertEqual(self.lots(), LOTS)
+        self.assertEqual(self.pm.getSales(), [])
+
+    def test_remove_at_price(self):
+        self.assertEqual(self.pm.remove('YHOO', price=20.0), 100)
+        self.assertEqual(self.lots(), [LOTS[0], LOTS[2]])
+
+    def test_negative_amount(self):
+        self.assertRaises(PortfolioError, self.pm.remove, 'YHOO', -50)
+        self.assertRaises(PortfolioError, self.sell, -50, FIFO)
+        self.assertEqual(self.lots(), LOTS)
+
+    def test_reloaded(self):
+        sale = self.sell(150, HIGHEST_COST)
+        self.pm.close()
+        self.pm = self.open()
+        self.assertEqual(self.lots(), [(100, 10.0, 1000), (50, 15.0, 3000)])
+        self.assertEqual(self.pm.getSales(), [sale])
+
+class SqliteMatchingTest(JournalMatchingTest):
+    container = '/portfolios.db'
+
+if __name__ == '__main__':
+    unittest.main()
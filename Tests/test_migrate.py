@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+#
+
+"""
+Tests of the import of a journal portfolio in a SQLite database.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pystocks.PortfolioManager import SqliteStorage
+from pystocks.PortfolioManager.Matching import FIFO
+from pystocks.PortfolioManager.PortfolioManager import PortfolioManager
+
+__revision__ = "$Id$"
+
+class FakeService:
+    def getCurrentPrice(self, symbol):
+        return 25.0
+
+class MigrateTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='pystocks-test-')
+        self.database = os.path.join(self.directory, 'portfolios.db')
+        pm = PortfolioManager('test', self.directory, FakeService)
+        pm.add('YHOO', 100, 10.0, 1000)
+        pm.add('YHOO', 100, 20.0, 2000)
+        pm.add('GOOG', 10, 400.0, 1500)
+        self.sale = pm.sell('YHOO', 150, 25.0, FIFO, None, 5000)
+        pm.close()
+        self.portfolio = os.path.join(self.directory, 'test.portfolio')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def open(self):
+        return PortfolioManager('test', self.database, FakeService)
+
+    def lots(self, pm):
+        return sorted([(symbol, lot.amount, lot.price, lot.time)
+                       for (symbol, lots) in pm.stocks.items()
+                       for lot in lots])
+
+    def test_migrate(self):
+        self.assertEqual(SqliteStorage.migrate(self.portfolio,
+                                               self.database), 2)
+        pm = self.open()
+        try:
+            self.assertEqual(self.lots(pm), [('GOOG', 10, 400.0, 1500),
+                                             ('YHOO', 50, 20.0, 2000)])
+            self.assertEqual(pm.getSales(), [self.sale])
+        finally:
+            pm.close()
+
+    def test_existing_portfolio_is_refused(self):
+        SqliteStorage.migrate(self.portfolio, self.database)
+        self.assertRaises(SqliteStorage.SqliteError, SqliteStorage.migrate,
+                          self.portfolio, self.database)
+        pm = self.open()
+        try:
+            self.assertEqual(len(self.lots(pm)), 2)
+            self.assertEqual(len(pm.getSales()), 1)
+        finally:
+            pm.close()
+        # under another name it is imported again
+        SqliteStorage.migrate(self.portfolio, self.database, 'copy')
+        self.assertEqual(SqliteStorage.portfolios(self.database),
+                         ['copy', 'test'])
+
+    def test_failed_sales_import_adds_no_lots(self):
+        def fail(storage, sale):
+            raise SqliteStorage.SqliteError("disk full")
+        insert = SqliteStorage.SqliteStorage._insert_sale
+        SqliteStorage.SqliteStorage._insert_sale = fail
+        try:
+            self.assertRaises(SqliteStorage.SqliteError,
+                              SqliteStorage.migrate, self.portfolio,
+                              self.database)
+        finally:
+            SqliteStorage.SqliteStorage._insert_sale = insert
+        self.assertEqual(SqliteStorage.portfolios(self.database), [])
+        # nothing was left behind, the import can be run again
+        self.assertEqual(SqliteStorage.migrate(self.portfolio,
+                                               self.database), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+#
+
+"""
+Tests of the prices QuoteFinder gives to PortfolioManager.
+"""
+
+import time
+import unittest
+
+from pystocks.YahooFinance.QuoteCache import get_cache
+from pystocks.PortfolioManager.PortfolioManager import (QuoteFinder,
+                                                        StalePrice,
+                                                        PortfolioError)
+from pystocks.Tests import install_feed, restore_feed
+
+__revision__ = "$Id$"
+
+class QuoteFinderTest(unittest.TestCase):
+    def setUp(self):
+        self.feed = install_feed()
+        self.max_stale = QuoteFinder.max_stale
+
+    def tearDown(self):
+        self.wait_refresh()
+        QuoteFinder.max_stale = self.max_stale
+        restore_feed(self.feed)
+
+    def wait_refresh(self):
+        deadline = time.time() + 5
+        while QuoteFinder._refreshing and time.time() < deadline:
+            time.sleep(0.01)
+
+    def expire(self):
+        # prices are cached already expired
+        get_cache().ttls['l1'] = -1
+
+    def test_hit(self):
+        self.assertEqual(QuoteFinder().getCurrentPrice('YHOO'), 25.56)
+        price = QuoteFinder().getCurrentPrice('YHOO')
+        self.assertEqual(price, 25.56)
+        self.assertTrue(type(price) is float)
+        self.assertEqual(self.feed.requests, 1)
+
+    def test_na(self):
+        self.feed.set('YHOO', l1='N/A')
+        for attempt in range(2):
+            self.assertRaises(PortfolioError,
+                              QuoteFinder().getCurrentPrice, 'YHOO')
+        self.assertEqual(self.feed.requests, 1)
+
+    def test_stale(self):
+        QuoteFinder.max_stale = 300
+        self.expire()
+        QuoteFinder().getCurrentPrice('YHOO')
+        self.feed.set('YHOO', l1='26.00')
+        price = QuoteFinder().getCurrentPrice('YHOO')
+        self.assertTrue(isinstance(price, StalePrice))
+        self.assertEqual(price, 25.56)
+        self.wait_refresh()
+        self.assertEqual(self.feed.requests, 2)
+        self.assertEqual(get_cache().get_stale('YHOO', 'l1')[0], 26.0)
+
+    def test_stale_na(self):
+        QuoteFinder.max_stale = 300
+        self.expire()
+        self.feed.set('YHOO', l1='N/A')
+        self.assertRaises(PortfolioError, QuoteFinder().getCurrentPrice,
+                          'YHOO')
+        # the stale N/A is not a price, the feed is asked again
+        self.assertRaises(PortfolioError, QuoteFinder().getCurrentPrice,
+                          'YHOO')
+        self.assertEqual(self.feed.requests, 2)
+
+    def test_stale_many(self):
+        QuoteFinder.max_stale = 300
+        self.expire()
+        QuoteFinder().getCurrentPrice('YHOO')
+        self.feed.set('GOOG', l1='N/A')
+        self.assertRaises(PortfolioError, QuoteFinder().getCurrentPrice,
+                          'GOOG')
+        prices = QuoteFinder().getCurrentPrices(['YHOO'])
+        self.assertTrue(isinstance(prices['YHOO'], StalePrice))
+        self.assertEqual(QuoteFinder()._get_stale('GOOG'), None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+#
+
+"""
+Tests of YahooQuoteFinder and its quote cache.
+"""
+
+import time
+import unittest
+import threading
+
+from pystocks.YahooFinance import YahooQuoteFinder, FeedError, NA
+from pystocks.YahooFinance.QuoteCache import get_cache
+from pystocks.YahooFinance.SingleFlight import get_flights
+from pystocks.Tests import install_feed, restore_feed
+
+__revision__ = "$Id$"
+
+FIELDS = ['company', 'last_price', 'change_percent', 'volume_daily',
+          'day_low']
+
+class QuoteCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.feed = install_feed()
+
+    def tearDown(self):
+        restore_feed(self.feed)
+
+    def values(self, quote):
+        return (quote.company, quote.last_price, quote.change_percent,
+                quote.volume_daily, quote.day_low, quote.day_hi)
+
+    def test_hit_returns_parsed_values(self):
+        fetched = YahooQuoteFinder('YHOO', FIELDS)
+        cached = YahooQuoteFinder('YHOO', FIELDS)
+        self.assertEqual(self.feed.requests, 1)
+        self.assertEqual(get_cache().stats()['hits'], 1)
+        self.assertEqual(self.values(cached), self.values(fetched))
+        self.assertEqual(self.values(cached),
+                         ('YAHOO INC', 25.56, -1.31, 17512345, 25.40,
+                          26.05))
+
+    def test_hit_returns_na(self):
+        self.feed.set('YHOO', l1='N/A', m='N/A')
+        fetched = YahooQuoteFinder('YHOO', FIELDS)
+        cached = YahooQuoteFinder('YHOO', FIELDS)
+        self.assertEqual(self.feed.requests, 1)
+        for quote in (fetched, cached):
+            self.assertTrue(quote.last_price is NA)
+            self.assertTrue(quote.day_low is NA)
+            self.assertTrue(quote.day_hi is NA)
+
+    def test_hit_strips_markup(self):
+        self.feed.set('YHOO', n='<b>YAHOO INC</b>')
+        YahooQuoteFinder('YHOO', FIELDS)
+        self.assertEqual(YahooQuoteFinder('YHOO', FIELDS).company,
+                         'YAHOO INC')
+        self.assertEqual(get_cache().get('YHOO', 'n'), 'YAHOO INC')
+
+    def test_fetch_many_hit(self):
+        fetched = YahooQuoteFinder.fetch_many(['YHOO', 'GOOG'],
+                                              fields=FIELDS)
+        cached = YahooQuoteFinder.fetch_many(['YHOO', 'GOOG'],
+                                             fields=FIELDS)
+        self.assertEqual(self.feed.requests, 1)
+        for symbol in ('YHOO', 'GOOG'):
+            self.assertEqual(self.values(cached[symbol]),
+                             self.values(fetched[symbol]))
+
+    def test_fresh_skips_cache(self):
+        YahooQuoteFinder.fetch_many(['YHOO'], fields=FIELDS)
+        self.feed.set('YHOO', l1='26.00')
+        quotes = YahooQuoteFinder.fetch_many(['YHOO'], fresh=True,
+                                             fields=FIELDS)
+        self.assertEqual(quotes['YHOO'].last_price, 26.0)
+        self.assertEqual(YahooQuoteFinder('YHOO', FIELDS).last_price, 26.0)
+
+    def test_key_ignores_case(self):
+        self.feed.set('YHOO', s='Yhoo')
+        YahooQuoteFinder('yhoo', FIELDS)
+        YahooQuoteFinder('YHOO', FIELDS)
+        YahooQuoteFinder.fetch_many(['yHoo'], fields=FIELDS)
+        self.assertEqual(self.feed.requests, 1)
+        self.assertEqual(get_cache().stats()['hits'], 2)
+
+    def test_malformed_value(self):
+        self.feed.set('YHOO', l1='25.x6')
+        self.assertRaises(FeedError, YahooQuoteFinder, 'YHOO', FIELDS)
+        quotes = YahooQuoteFinder.fetch_many(['YHOO', 'GOOG'],
+                                             fields=FIELDS)
+        self.assertTrue(isinstance(quotes['YHOO'], FeedError))
+        self.assertEqual(quotes['GOOG'].last_price, 455.58)
+        self.assertEqual(get_cache().get('YHOO', 'l1'), None)
+
+    def test_rows_matched_by_symbol(self):
+        self.feed.blank.add('GOOG')
+        quotes = YahooQuoteFinder.fetch_many(['YHOO', 'GOOG', 'msft'],
+                                             fields=FIELDS)
+        self.assertEqual(quotes['YHOO'].last_price, 25.56)
+        self.assertTrue(isinstance(quotes['GOOG'], FeedError))
+        self.assertEqual(quotes['msft'].last_price, 30.05)
+        self.assertEqual(get_cache().get('GOOG', 'l1'), None)
+        self.assertEqual(get_cache().get('MSFT', 'l1'), 30.05)
+
+    def test_short_row(self):
+        self.feed.short['YHOO'] = 2 # symbol and company only
+        self.assertRaises(FeedError, YahooQuoteFinder, 'YHOO', FIELDS)
+        quotes = YahooQuoteFinder.fetch_many(['YHOO', 'GOOG'],
+                                             fields=FIELDS)
+        self.assertTrue(isinstance(quotes['YHOO'], FeedError))
+        self.assertEqual(quotes['GOOG'].last_price, 455.58)
+        self.assertEqual(get_cache().get('YHOO', 'l1'), None)
+
+    def test_concurrent_fetch_many_share_a_request(self):
+        self.feed.gate = threading.Event()
+        calls = get_flights().stats()['calls']
+        results = []
+        def fetch():
+            results.append(YahooQuoteFinder.fetch_many(['YHOO', 'GOOG'],
+                                                       fields=FIELDS))
+        threads = [threading.Thread(target=fetch) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        # every thread claimed both symbols before the request returns
+        for i in range(500):
+            if get_flights().stats()['calls'] >= calls + 6:
+                break
+            time.sleep(0.01)
+        self.feed.gate.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(self.feed.requests, 1)
+        self.assertEqual(len(results), 3)
+        for quotes in results:
+            self.assertEqual(quotes['YHOO'].last_price, 25.56)
+            self.assertEqual(quotes['GOOG'].last_price, 455.58)
+        self.assertEqual(get_flights().stats()['in_flight'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
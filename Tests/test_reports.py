@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+#
+
+"""
+Tests of the rendering of reports and of format_number().
+"""
+
+import unittest
+
+from cStringIO import StringIO
+
+from pystocks import format_number
+from pystocks.Reports import render, QUOTE_COLUMNS
+from pystocks.YahooFinance import NA
+
+__revision__ = "$Id$"
+
+ROWS = [('YHOO', 'YAHOO INC', 25.56, -0.34, -1.31, 17512345),
+        ('GOOG', NA, NA, None, NA, NA)]
+
+class RenderTest(unittest.TestCase):
+    def render(self, format, chunk_size=1000):
+        out = StringIO()
+        self.assertEqual(render(QUOTE_COLUMNS, ROWS, out, format,
+                                chunk_size=chunk_size), 2)
+        return out.getvalue()
+
+    def test_text(self):
+        lines = self.render('text').splitlines()
+        self.assertEqual(lines[0].split(),
+                         ['symbol', 'company', 'price', 'change', '%',
+                          'volume'])
+        self.assertEqual(lines[1].split(),
+                         ['YHOO', 'YAHOO', 'INC', '25.56', '-0.34',
+                          '-1.31%', '17,512,345'])
+        self.assertEqual(lines[2].split(),
+                         ['GOOG', 'N/A', 'N/A', 'N/A', 'N/A'])
+
+    def test_csv(self):
+        self.assertEqual(self.render('csv', chunk_size=1),
+                         "symbol,company,price,change,%,volume\r\n"
+                         "YHOO,YAHOO INC,25.56,-0.34,-1.31,17512345\r\n"
+                         "GOOG,N/A,N/A,,N/A,N/A\r\n")
+
+    def test_json(self):
+        import json
+        objects = json.loads(self.render('json', chunk_size=1))
+        self.assertEqual(objects[0]['volume'], 17512345)
+        self.assertEqual(objects[1], {'symbol': 'GOOG', 'company': None,
+                                      'price': None, 'change': None,
+                                      'percent': None, 'volume': None})
+
+class FormatNumberTest(unittest.TestCase):
+    def test_integers(self):
+        self.assertEqual(format_number(-1234567), '-1,234,567')
+        self.assertEqual(format_number('1234'), '1,234')
+
+    def test_floats(self):
+        self.assertEqual(format_number(1234.5), '1,234.5')
+        self.assertEqual(format_number(2.0), '2.0')
+        self.assertEqual(format_number(1e20),
+                         '100,000,000,000,000,000,000.0')
+        self.assertEqual(format_number(-1234.5678, 2), '-1,234.57')
+
+if __name__ == '__main__':
+    unittest.main()
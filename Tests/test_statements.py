@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+#
+
+"""
+Tests of the import and export of CSV statements.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cStringIO import StringIO
+
+from pystocks.PortfolioManager.Statements import (StatementReader,
+                                                  StatementError,
+                                                  import_statement,
+                                                  export_statement)
+from pystocks.PortfolioManager.PortfolioManager import PortfolioManager
+
+__revision__ = "$Id$"
+
+STATEMENT = """\
+Brokerage statement,,,
+Account,12345,,
+,,,
+Ticker,Qty,Price Paid,Trade Date
+yhoo,100,$25.56,2006-12-22
+GOOG,"1,000",455.58,12/22/2006
+,,,
+Total,1100,,
+"""
+
+class FakeService:
+    def getCurrentPrice(self, symbol):
+        return 10.0
+
+class StatementReaderTest(unittest.TestCase):
+    def test_headers_after_preamble(self):
+        rows = list(StatementReader(StringIO(STATEMENT)))
+        self.assertEqual([row[:3] for row in rows],
+                         [('YHOO', 100, 25.56), ('GOOG', 1000, 455.58)])
+        self.assertEqual(rows[0][3], rows[1][3])
+
+    def test_columns(self):
+        reader = StatementReader(StringIO("Sym,Units\nYHOO,10\n"),
+                                 {'amount': 'Units'})
+        self.assertEqual(list(reader), [('YHOO', 10, None, None)])
+
+    def test_invalid_row(self):
+        statement = "Symbol,Amount\nYHOO,10\nGOOG,-5\nIBM,3\n"
+        reader = StatementReader(StringIO(statement))
+        self.assertRaises(StatementError, list, reader)
+
+        reader = StatementReader(StringIO(statement), strict=False)
+        self.assertEqual([row[0] for row in reader], ['YHOO', 'IBM'])
+        self.assertEqual(reader.errors, [(3, "Invalid amount: '-5'")])
+
+    def test_no_headers_closes_file(self):
+        (fd, path) = tempfile.mkstemp(suffix='.csv')
+        os.write(fd, "a,b\n1,2\n")
+        os.close(fd)
+        try:
+            opened = []
+            class Reader(StatementReader):
+                def _find_headers(self, columns):
+                    opened.append(self.file)
+                    return StatementReader._find_headers(self, columns)
+            self.assertRaises(StatementError, Reader, path)
+            self.assertTrue(opened[0].closed)
+        finally:
+            os.unlink(path)
+
+class ImportTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='pystocks-test-')
+        self.pm = PortfolioManager('test', self.directory, FakeService)
+
+    def tearDown(self):
+        self.pm.close()
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        self.assertEqual(import_statement(self.pm, StringIO(STATEMENT)), 2)
+        out = StringIO()
+        self.assertEqual(export_statement(self.pm, out), 2)
+        other = PortfolioManager('other', self.directory, FakeService)
+        try:
+            import_statement(other, StringIO(out.getvalue()))
+            self.assertEqual(sorted(other.storage.rows()),
+                             sorted(self.pm.storage.rows()))
+        finally:
+            other.close()
+
+    def test_caller_file_stays_open(self):
+        path = os.path.join(self.directory, 'statement.csv')
+        f = open(path, "wb")
+        f.write(STATEMENT)
+        f.close()
+        f = open(path, "rb")
+        try:
+            self.assertEqual(import_statement(self.pm, f), 2)
+            self.assertFalse(f.closed)
+        finally:
+            f.close()
+        reader = StatementReader(path)
+        list(reader)
+        reader.close()
+        self.assertTrue(reader.file.closed)
+
+    def test_single_record(self):
+        import_statement(self.pm, StringIO(STATEMENT))
+        self.assertEqual(self.pm.storage.journal.records, 1)
+
+    def test_snapshot_over_chunk_size(self):
+        statement = "Symbol,Amount,Price,Epoch\n" + "YHOO,1,2.5,1000\n" * 5
+        reader = StatementReader(StringIO(statement))
+        self.assertEqual(self.pm.storage.add_many(reader, chunk_size=2), 5)
+        self.assertEqual(self.pm.storage.journal.records, 0)
+        self.pm.close()
+        self.pm = PortfolioManager('test', self.directory, FakeService)
+        self.assertEqual(len(list(self.pm.storage.rows())), 5)
+
+    def test_nothing_added_on_error(self):
+        statement = "Symbol,Amount\nYHOO,10\nGOOG,x\n"
+        self.assertRaises(StatementError, import_statement, self.pm,
+                          StringIO(statement))
+        self.assertEqual(list(self.pm.storage.rows()), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+#
+
+"""
+Tests of ResilientTransport retries, of its CircuitBreaker and of the
+ConnectionPool used by PooledTransport.
+"""
+
+import socket
+import urllib2
+import unittest
+import threading
+import StringIO
+
+from pystocks.YahooFinance import Transport
+
+__revision__ = "$Id$"
+
+URL = 'http://feed.example.com/d/quotes.csv'
+
+class Clock:
+    """
+    Clock moved forward by hand or by the retries sleeping.
+    """
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+
+class FailingTransport(Transport.Transport):
+    """
+    Transport failing the first `failures' requests with error.
+    """
+    def __init__(self, failures, error=None, clock=None, duration=0):
+        self.failures = failures
+        self.error = error or socket.error("connection refused")
+        self.clock = clock
+        self.duration = duration
+        self.requests = 0
+        self.timeouts = []
+
+    def open(self, url, timeout=None):
+        self.requests += 1
+        self.timeouts.append(timeout)
+        if self.clock is not None:
+            self.clock.now += self.duration
+        if self.requests <= self.failures:
+            raise self.error
+        return StringIO.StringIO('ok')
+
+class StubResponse:
+    def __init__(self, body, will_close=False):
+        self.status = 200
+        self.reason = 'OK'
+        self.msg = {}
+        self.will_close = will_close
+        self.body = body
+
+    def read(self):
+        return self.body
+
+class StubSocket:
+    timeout = None
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+class StubConnection:
+    """
+    Connection answering every request with its own number, or failing
+    once its socket was dropped by the feed.
+    """
+    def __init__(self, number, scheme, host, port, timeout):
+        self.number = number
+        self.args = (scheme, host, port, timeout)
+        self.sock = StubSocket()
+        self.requests = 0
+        self.closed = False
+
+    def request(self, method, path):
+        if self.sock is None:
+            raise socket.error("connection reset by peer")
+        self.requests += 1
+
+    def getresponse(self):
+        return StubResponse(str(self.number))
+
+    def close(self):
+        self.closed = True
+        self.sock = None
+
+class StubFactory:
+    def __init__(self):
+        self.connections = []
+
+    def __call__(self, scheme, host, port, timeout):
+        connection = StubConnection(len(self.connections), scheme, host,
+                                    port, timeout)
+        self.connections.append(connection)
+        return connection
+
+class ResilientTransportTest(unittest.TestCase):
+    def transport(self, failures, **kwargs):
+        self.clock = Clock()
+        self.feed = FailingTransport(failures, kwargs.pop('error', None),
+                                     self.clock, kwargs.pop('duration', 0))
+        options = {'retries': 2, 'backoff': 0.2, 'max_backoff': 2.0,
+                   'timeout': 10, 'deadline': 20, 'threshold': 100,
+                   'reset_timeout': 30}
+        options.update(kwargs)
+        return Transport.ResilientTransport(self.feed, clock=self.clock,
+                                            sleep=self.clock.sleep,
+                                            **options)
+
+    def test_retries_until_success(self):
+        transport = self.transport(2)
+        self.assertEqual(transport.open(URL).read(), 'ok')
+        self.assertEqual(self.feed.requests, 3)
+        self.assertEqual(len(self.clock.sleeps), 2)
+        self.assertEqual(transport.stats(),
+                         {'feed.example.com': ('closed', 0)})
+
+    def test_gives_up_after_retries(self):
+        transport = self.transport(10, retries=2)
+        self.assertRaises(socket.error, transport.open, URL)
+        self.assertEqual(self.feed.requests, 3)
+        self.assertEqual(len(self.clock.sleeps), 2)
+
+    def test_backoff_is_capped(self):
+        transport = self.transport(10, retries=6, backoff=0.5,
+                                   max_backoff=1.0, deadline=100)
+        self.assertRaises(socket.error, transport.open, URL)
+        self.assertEqual(self.feed.requests, 7)
+        # full jitter below backoff * 2 ** attempt, never above the cap
+        for delay in self.clock.sleeps:
+            self.assertTrue(0 <= delay <= 1.0)
+
+    def test_deadline_stops_retries(self):
+        transport = self.transport(10, retries=10, timeout=30,
+                                   deadline=20, duration=8)
+        self.assertRaises(socket.error, transport.open, URL)
+        self.assertTrue(self.feed.requests <= 3)
+        # every retry only gets the time left before the deadline
+        self.assertEqual(self.feed.timeouts[0], 20)
+        self.assertTrue(self.feed.timeouts[1] <= 20 - 8)
+
+    def test_client_errors_are_not_retried(self):
+        error = urllib2.HTTPError(URL, 404, 'Not Found', {}, None)
+        transport = self.transport(10, error=error)
+        self.assertRaises(urllib2.HTTPError, transport.open, URL)
+        self.assertEqual(self.feed.requests, 1)
+        self.assertEqual(self.clock.sleeps, [])
+        self.assertEqual(transport.stats(),
+                         {'feed.example.com': ('closed', 0)})
+
+    def test_server_errors_are_retried(self):
+        error = urllib2.HTTPError(URL, 503, 'Unavailable', {}, None)
+        transport = self.transport(1, error=error)
+        self.assertEqual(transport.open(URL).read(), 'ok')
+        self.assertEqual(self.feed.requests, 2)
+
+    def test_open_circuit_refuses_requests(self):
+        transport = self.transport(10, retries=0, threshold=2)
+        self.assertRaises(socket.error, transport.open, URL)
+        self.assertRaises(socket.error, transport.open, URL)
+        self.assertRaises(Transport.CircuitOpenError, transport.open, URL)
+        self.assertEqual(self.feed.requests, 2)
+        self.assertEqual(transport.stats(),
+                         {'feed.example.com': ('open', 2)})
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.breaker = Transport.CircuitBreaker(3, 30, self.clock)
+
+    def open_circuit(self):
+        for i in range(3):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.failure()
+        self.assertEqual(self.breaker.state, 'open')
+
+    def test_closed_below_threshold(self):
+        self.breaker.failure()
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, 'closed')
+        self.breaker.success()
+        self.breaker.failure()
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, 'closed')
+        self.assertTrue(self.breaker.allow())
+
+    def test_open_until_reset_timeout(self):
+        self.open_circuit()
+        self.assertFalse(self.breaker.allow())
+        self.clock.now += 29.9
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.state, 'open')
+
+    def test_half_open_allows_one_trial(self):
+        self.open_circuit()
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, 'half-open')
+        self.assertFalse(self.breaker.allow())
+
+    def test_half_open_success_closes(self):
+        self.open_circuit()
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.success()
+        self.assertEqual(self.breaker.state, 'closed')
+        self.assertEqual(self.breaker.failures, 0)
+        self.assertTrue(self.breaker.allow())
+
+    def test_half_open_failure_reopens(self):
+        self.open_circuit()
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, 'open')
+        self.assertFalse(self.breaker.allow())
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow())
+
+class ConnectionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.factory = StubFactory()
+        self.pool = Transport.ConnectionPool(2, 30, self.factory,
+                                             self.clock)
+
+    def get(self, host='feed.example.com'):
+        return self.pool.get('http', host, 80, 10)
+
+    def test_released_connection_is_reused(self):
+        first = self.get()
+        self.assertFalse(first.reused)
+        self.assertEqual(first.args, ('http', 'feed.example.com', 80, 10))
+        self.pool.release(first)
+        second = self.get()
+        self.assertTrue(second is first)
+        self.assertTrue(second.reused)
+        self.assertEqual(second.sock.timeout, 10)
+        self.assertEqual(len(self.factory.connections), 1)
+        stats = self.pool.stats()
+        self.assertEqual((stats['opened'], stats['reused'],
+                          stats['active'], stats['idle']), (1, 1, 1, 0))
+
+    def test_hosts_do_not_share_connections(self):
+        self.pool.release(self.get('a.example.com'))
+        connection = self.get('b.example.com')
+        self.assertFalse(connection.reused)
+        self.assertEqual(len(self.factory.connections), 2)
+
+    def test_not_reusable_connection_is_closed(self):
+        connection = self.get()
+        self.pool.release(connection, False)
+        self.assertTrue(connection.closed)
+        self.assertFalse(self.get() is connection)
+        self.assertEqual(self.pool.stats()['closed'], 1)
+
+    def test_dead_connection_is_closed(self):
+        connection = self.get()
+        connection.sock = None # dropped by the feed
+        self.pool.release(connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(self.pool.stats()['idle'], 0)
+        self.assertFalse(self.get() is connection)
+
+    def test_idle_connection_is_evicted(self):
+        connection = self.get()
+        self.pool.release(connection)
+        self.clock.now += 29.9
+        self.assertTrue(self.get() is connection)
+        self.pool.release(connection)
+        self.clock.now += 30
+        self.assertFalse(self.get() is connection)
+        self.assertTrue(connection.closed)
+        stats = self.pool.stats()
+        self.assertEqual((stats['evicted'], stats['closed']), (1, 1))
+
+    def test_per_host_limit_waits_for_a_release(self):
+        first = self.get()
+        second = self.get()
+        self.assertEqual(self.pool.stats()['active'], 2)
+        got = []
+        waiter = threading.Thread(target=lambda: got.append(self.get()))
+        waiter.start()
+        waiter.join(0.2)
+        self.assertTrue(waiter.isAlive())
+        self.assertEqual(got, [])
+        self.pool.release(first)
+        waiter.join(5)
+        self.assertFalse(waiter.isAlive())
+        self.assertTrue(got[0] is first)
+        self.assertEqual(len(self.factory.connections), 2)
+        self.assertEqual(self.pool.stats()['waited'], 1)
+        self.pool.release(second)
+        self.pool.release(got[0])
+
+    def test_transport_retries_a_dropped_connection(self):
+        transport = Transport.PooledTransport(self.pool)
+        self.assertEqual(transport.open(URL).read(), '0')
+        self.factory.connections[0].sock = None # dropped while idle
+        self.assertEqual(transport.open(URL).read(), '1')
+        self.assertEqual(len(self.factory.connections), 2)
+        self.assertEqual(self.pool.stats()['idle'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
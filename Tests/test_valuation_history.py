@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+#
+
+"""
+Tests of the recording and the queries of ValuationHistory.
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import threading
+
+from pystocks.PortfolioManager.PortfolioManager import (PortfolioManager,
+                                                        PortfolioError,
+                                                        QuoteFinder)
+from pystocks.PortfolioManager.ValuationHistory import ValuationHistory
+from pystocks.Tests import install_feed, restore_feed
+
+__revision__ = "$Id$"
+
+class FakeService:
+    def getCurrentPrice(self, symbol):
+        return 25.0
+
+# prices of every snapshot, recorded at 1000, 1060, 1120, ...
+PRICES = [
+    {'YHOO': 25.0, 'GOOG': 400.0},
+    {'YHOO': 25.0, 'GOOG': 410.0},
+    {'YHOO': 26.0, 'GOOG': 410.0},
+    {'YHOO': 26.0, 'GOOG': 410.0},
+    {'YHOO': 27.0, 'GOOG': 420.0},
+]
+
+class ValuationHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='pystocks-test-')
+        self.pm = PortfolioManager('test', self.directory, FakeService)
+        self.pm.add('YHOO', 100, 20.0, 500)
+        self.pm.add('GOOG', 10, 400.0, 500)
+        self.history = self.open()
+
+    def tearDown(self):
+        self.history.close()
+        self.pm.close()
+        shutil.rmtree(self.directory)
+
+    def open(self):
+        return ValuationHistory(self.pm, keyframe_every=3)
+
+    def reopen(self):
+        self.history.close()
+        self.history = self.open()
+
+    def record(self, count=len(PRICES)):
+        return [self.history.record(prices, 1000 + pos * 60)
+                for (pos, prices) in enumerate(PRICES[:count])]
+
+    def test_record_writes_changes(self):
+        changed = self.record()
+        self.assertEqual(sorted(changed[0]), ['GOOG', 'YHOO'])
+        self.assertEqual(changed[1], ['GOOG'])
+        self.assertEqual(changed[2], ['YHOO'])
+        self.assertEqual(sorted(changed[3]), ['GOOG', 'YHOO']) # keyframe
+        self.assertEqual(len(self.history), 5)
+        self.assertRaises(ValueError, self.history.record, PRICES[0], 999)
+
+    def test_curve(self):
+        self.record()
+        curve = self.history.curve()
+        self.assertEqual(list(curve.time), [1000, 1060, 1120, 1180, 1240])
+        self.assertEqual(list(curve.cost), [6000.0] * 5)
+        self.assertEqual(list(curve.value),
+                         [6500.0, 6600.0, 6700.0, 6700.0, 6900.0])
+        self.assertEqual(list(curve.gain),
+                         [500.0, 600.0, 700.0, 700.0, 900.0])
+        self.assertEqual(list(self.history.curve(1060, 1120).time),
+                         [1060, 1120])
+
+    def test_symbol(self):
+        self.record()
+        curve = self.history.symbol('YHOO', 1060)
+        self.assertEqual(list(curve.time), [1060, 1120, 1180, 1240])
+        self.assertEqual(list(curve.price), [25.0, 26.0, 26.0, 27.0])
+        self.assertEqual(list(curve.amount), [100] * 4)
+        self.assertEqual(list(curve.gain), [500.0, 600.0, 600.0, 700.0])
+        self.assertEqual(len(self.history.symbol('MSFT')), 5)
+        self.assertEqual(list(self.history.symbol('MSFT').value), [0.0] * 5)
+
+    def test_sold_symbol(self):
+        self.record(2)
+        self.pm.remove('GOOG')
+        self.history.record(PRICES[2], 1120)
+        curve = self.history.symbol('GOOG')
+        self.assertEqual(list(curve.amount), [10, 10, 0])
+        self.assertEqual(sorted(self.history.at(1120)), ['YHOO'])
+        self.assertEqual(list(self.history.curve().cost),
+                         [6000.0, 6000.0, 2000.0])
+
+    def test_at(self):
+        self.record()
+        values = self.history.at(1150)
+        self.assertEqual(sorted(values), ['GOOG', 'YHOO'])
+        self.assertEqual(values['YHOO'].price, 26.0)
+        self.assertEqual(values['YHOO'].gain, 600.0)
+        self.assertEqual(values['GOOG'].value, 4100.0)
+        self.assertEqual(self.history.at(999), {})
+
+    def test_keyframe_replay(self):
+        self.record()
+        self.reopen()
+        # rebuilt from the keyframe of the fourth snapshot
+        self.assertEqual(len(self.history), 5)
+        self.assertEqual(self.history.at(1240)['YHOO'].price, 27.0)
+        # the state is known: unchanged prices write no delta
+        self.assertEqual(self.history.record(PRICES[4], 1300), [])
+        self.assertEqual(self.history.curve().value[-1], 6900.0)
+        self.assertEqual(list(self.history.symbol('GOOG').price),
+                         [400.0, 410.0, 410.0, 410.0, 420.0, 420.0])
+
+    def test_truncated_tail(self):
+        self.record(4)
+        self.history.close()
+        # a crash in the middle of the fifth snapshot
+        for name in ('deltas.symbol', 'deltas.amount', 'snapshots.time'):
+            f = open(os.path.join(self.history.directory, name), "ab")
+            f.write("\0" * 5)
+            f.close()
+        self.history = self.open()
+        self.assertEqual(len(self.history), 4)
+        self.history.record(PRICES[4], 1240)
+        self.assertEqual(list(self.history.curve().value),
+                         [6500.0, 6600.0, 6700.0, 6700.0, 6900.0])
+        self.assertEqual(list(self.history.symbol('YHOO').price),
+                         [25.0, 25.0, 26.0, 26.0, 27.0])
+
+class RunTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='pystocks-test-')
+        self.feed = install_feed()
+        self.pm = PortfolioManager('test', self.directory, QuoteFinder)
+        self.pm.add('YHOO', 100, 20.0, 500)
+        self.history = ValuationHistory(self.pm)
+
+    def tearDown(self):
+        self.history.stop()
+        self.history.close()
+        self.pm.close()
+        restore_feed(self.feed)
+        shutil.rmtree(self.directory)
+
+    def wait(self, condition):
+        for i in range(500):
+            if condition():
+                return True
+            time.sleep(0.01)
+        return False
+
+    def test_run_survives_feed_errors(self):
+        self.feed.fail = True
+        runner = threading.Thread(target=self.history.run, args=(0.01,))
+        runner.setDaemon(True)
+        runner.start()
+        self.assertTrue(self.wait(lambda: self.history.error is not None))
+        self.assertTrue(isinstance(self.history.error, PortfolioError))
+        self.assertTrue(runner.isAlive())
+        self.assertEqual(len(self.history), 0)
+
+        self.feed.fail = False
+        self.assertTrue(self.wait(lambda: len(self.history)))
+        self.history.stop()
+        runner.join(5)
+        self.assertFalse(runner.isAlive())
+        self.assertEqual(self.history.error, None)
+        self.assertEqual(self.history.curve().value[0], 2556.0)
+
+if __name__ == '__main__':
+    unittest.main()
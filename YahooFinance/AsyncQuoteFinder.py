@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+#
+
+"""
+Concurrent quote lookups.
+
+AsyncQuoteFinder sends the requests for many symbols at the same time
+from a bounded pool of worker threads, so looking up N symbols takes
+about as long as the slowest request instead of the sum of all of them.
+Requests can be waited on with a timeout and cancelled while pending.
+
+Example:
+
+    >>> finder = AsyncQuoteFinder(concurrency=4)
+    >>> request = finder.getCurrentPrice('YHOO')
+    >>> # ... do something else ...
+    >>> request.result(timeout=5)
+    25.56
+    >>> finder.getCurrentPrices(['YHOO', 'GOOG'])
+    {'GOOG': 455.58, 'YHOO': 25.56}
+    >>> finder.shutdown()
+"""
+
+import time
+import Queue
+import threading
+
+from pystocks.YahooFinance.YahooFinance import (YahooQuoteFinder,
+                                                FeedError,
+                                                SymbolError,
+                                                NA)
+
+__revision__ = "$Id$"
+
+class CancelledError(FeedError):
+    """
+    Raised when waiting on a cancelled request.
+    """
+    pass
+
+class QuoteRequest:
+    """
+    Pending quote lookup of one symbol.
+    """
+    PENDING, RUNNING, DONE, CANCELLED = range(4)
+
+    def __init__(self, symbol, transform=None, fields=None):
+        """
+        symbol: stock symbol
+        transform: callable applied to the quote by result()
+        fields: attributes to download (default: all of them)
+        """
+        self.symbol = symbol
+        self.fields = fields
+        self._transform = transform
+        self._state = self.PENDING
+        self._quote = None
+        self._error = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def cancel(self):
+        """
+        Cancel the request if it was not sent yet.
+
+        Returns True if the request was cancelled.
+        """
+        self._lock.acquire()
+        try:
+            if self._state != self.PENDING:
+                return self._state == self.CANCELLED
+            self._state = self.CANCELLED
+        finally:
+            self._lock.release()
+        self._done.set()
+        return True
+
+    def cancelled(self):
+        return self._state == self.CANCELLED
+
+    def done(self):
+        return self._done.isSet()
+
+    def result(self, timeout=None):
+        """
+        Wait for the quote and return it.
+
+        timeout: seconds to wait (default: wait until done)
+
+        Raises FeedError if the request timed out, was cancelled
+        (CancelledError) or failed, SymbolError if the symbol is invalid.
+        """
+        if not self._done.wait(timeout):
+            raise FeedError("Timed out waiting for: %s" % self.symbol)
+        if self._state == self.CANCELLED:
+            raise CancelledError("Request cancelled: %s" % self.symbol)
+        if self._error is not None:
+            raise self._error
+        if self._transform is not None:
+            return self._transform(self._quote)
+        return self._quote
+
+    def _start(self):
+        self._lock.acquire()
+        try:
+            if self._state != self.PENDING:
+                return False
+            self._state = self.RUNNING
+            return True
+        finally:
+            self._lock.release()
+
+    def _finish(self, quote=None, error=None):
+        self._quote = quote
+        self._error = error
+        self._state = self.DONE
+        self._done.set()
+
+# attributes downloaded to obtain a price
+PRICE_FIELDS = ('last_price',)
+
+def _last_price(quote):
+    if quote.last_price is NA:
+        raise FeedError("No price available for: %s" % quote.symbol)
+    return quote.last_price
+
+class AsyncQuoteFinder:
+    """
+    Look up quotes of many symbols concurrently.
+    """
+    def __init__(self, concurrency=8, timeout=10, batch_size=50):
+        """
+        concurrency: maximum amount of requests sent at the same time
+                     (default: 8)
+        timeout: seconds to wait for each request (default: 10)
+        batch_size: maximum amount of symbols per request (default: 50)
+        """
+        if concurrency < 1:
+            raise ValueError("concurrency must be positive")
+        if batch_size < 1:
+            raise ValueError("batch_size must be positive")
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self._queue = Queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+
+    def submit(self, symbols, transform=None, fields=None):
+        """
+        Queue the lookup of symbols.
+
+        fields: attributes to download, see YahooQuoteFinder
+                (default: all of them)
+
+        Returns a dictionary mapping every symbol to its QuoteRequest.
+        """
+        requests = {}
+        batch = []
+        for symbol in symbols:
+            if symbol in requests:
+                continue
+            requests[symbol] = QuoteRequest(symbol, transform, fields)
+            batch.append(requests[symbol])
+            if len(batch) == self.batch_size:
+                self._put(batch)
+                batch = []
+        if batch:
+            self._put(batch)
+        return requests
+
+    def fetch(self, symbols, timeout=None):
+        """
+        Look up symbols concurrently and wait for all of them.
+
+        timeout: seconds to wait for all the lookups (default: no limit)
+
+        Returns a dictionary like YahooQuoteFinder.fetch_many(): every
+        symbol maps to its quote or to the error that occured.
+        """
+        return self._wait(self.submit(symbols), timeout)
+
+    def getCurrentPrice(self, symbol):
+        """
+        Queue the lookup of the price per share of symbol.
+
+        Returns a QuoteRequest whose result() is a float.
+        """
+        return self.submit([symbol], _last_price, PRICE_FIELDS)[symbol]
+
+    def getCurrentPrices(self, symbols, timeout=None):
+        """
+        Look up the price per share of symbols concurrently.
+
+        Returns a dictionary mapping every symbol to a float, or to the
+        error that occured.
+        """
+        return self._wait(self.submit(symbols, _last_price, PRICE_FIELDS),
+                          timeout)
+
+    def cancel(self):
+        """
+        Cancel every request that was not sent yet.
+        """
+        while True:
+            try:
+                batch = self._queue.get_nowait()
+            except Queue.Empty:
+                break
+            if batch is None:
+                self._queue.put(None)
+                break
+            for request in batch:
+                request.cancel()
+
+    def shutdown(self):
+        """
+        Cancel pending requests and stop the worker threads.
+        """
+        self.cancel()
+        self._lock.acquire()
+        try:
+            for worker in self._workers:
+                self._queue.put(None)
+            for worker in self._workers:
+                worker.join()
+            self._workers = []
+        finally:
+            self._lock.release()
+
+    def _wait(self, requests, timeout):
+        if timeout is not None:
+            deadline = time.time() + timeout
+        results = {}
+        for (symbol, request) in requests.items():
+            if timeout is not None:
+                wait = max(deadline - time.time(), 0)
+            else:
+                wait = None
+            try:
+                results[symbol] = request.result(wait)
+            except (FeedError, SymbolError), e:
+                request.cancel()
+                results[symbol] = e
+        return results
+
+    def _put(self, batch):
+        self._lock.acquire()
+        try:
+            if len(self._workers) < self.concurrency:
+                worker = threading.Thread(target=self._work)
+                worker.setDaemon(True)
+                worker.start()
+                self._workers.append(worker)
+        finally:
+            self._lock.release()
+        self._queue.put(batch)
+
+    def _work(self):
+        while True:
+            batch = self._queue.get()
+            if batch is None:
+                break
+            requests = [r for r in batch if r._start()]
+            if not requests:
+                continue
+            try:
+                quotes = YahooQuoteFinder.fetch_many(
+                    [r.symbol for r in requests], self.timeout,
+                    fields=requests[0].fields)
+            except Exception, e:
+                quotes = {}
+                for request in requests:
+                    quotes[request.symbol] = FeedError(
+                        "Could not fetch %s: %s" % (request.symbol, e))
+            for request in requests:
+                quote = quotes[request.symbol]
+                if isinstance(quote, Exception):
+                    request._finish(error=quote)
+                else:
+                    request._finish(quote)
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+#
+
+"""
+On-disk cache and concurrent download of chart images.
+
+ChartCache keeps the images downloaded for YahooChartFinder charts in
+files named after the SHA-1 of their normalized URL, so the same chart
+requested with its indicators or overlays in another order is only
+downloaded once. Images expire with the range of the chart: a one day
+chart changes all day long, a five years chart does not.
+
+ChartFetcher downloads the images of many charts concurrently and
+serves the ones that did not expire from the cache:
+
+    >>> fetcher = ChartFetcher(concurrency=4)
+    >>> charts = [YahooChartFinder(s, '1y', 'line', 'small', 'linear')
+    ...           for s in ('YHOO', 'GOOG', 'MSFT')]
+    >>> images = fetcher.fetch(charts)
+    >>> images[charts[0]][:6]
+    'GIF89a'
+"""
+
+import os
+import time
+import Queue
+import thread
+import urllib
+import hashlib
+import urlparse
+import threading
+
+from pystocks.YahooFinance.YahooFinance import FeedError
+
+__revision__ = "$Id$"
+
+# seconds a chart image is served from the cache, by range
+EXPIRY = {
+    '1d': 300,
+    '5d': 900,
+    '3m': 3600,
+    '6m': 3600,
+    '1y': 4 * 3600,
+    '2y': 12 * 3600,
+    '5y': 86400,
+    'max': 86400,
+}
+
+# query parameters holding comma separated lists in any order
+_list_parameters = ('a', 'c', 'p')
+
+def normalize_url(url):
+    """
+    Return url with its query parameters, and the items of the ones
+    holding lists, sorted.
+    """
+    (scheme, netloc, path, query, fragment) = urlparse.urlsplit(url)
+    parameters = []
+    for (name, value) in urlparse.parse_qsl(query, keep_blank_values=True):
+        if name in _list_parameters:
+            value = ",".join(sorted([v for v in value.split(",") if v]))
+        parameters.append((name, value))
+    parameters.sort()
+    return urlparse.urlunsplit((scheme.lower(), netloc.lower(), path,
+                                urllib.urlencode(parameters), ''))
+
+def chart_key(chart):
+    """
+    Return the cache key of a YahooChartFinder chart.
+    """
+    return hashlib.sha1(normalize_url(chart._build_url())).hexdigest()
+
+class ChartCache:
+    """
+    Chart images stored on disk.
+    """
+    def __init__(self,
+                 directory=os.path.expanduser("~/.pystocks/charts"),
+                 expiry=EXPIRY):
+        """
+        directory: where the images are kept (default: ~/.pystocks/charts)
+        expiry: seconds an image is kept, by chart range (default: EXPIRY)
+        """
+        self.directory = directory
+        self.expiry = expiry
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, chart):
+        """
+        Return the file holding the image of chart.
+        """
+        key = chart_key(chart)
+        return os.path.join(self.directory, key[:2], key + ".img")
+
+    def get(self, chart):
+        """
+        Return the image of chart, or None if it is not cached or
+        expired.
+        """
+        path = self.path(chart)
+        try:
+            age = time.time() - os.path.getmtime(path)
+            if age > self.expiry.get(chart.range, 0):
+                image = None
+            else:
+                f = open(path, "rb")
+                try:
+                    image = f.read()
+                finally:
+                    f.close()
+        except (IOError, OSError):
+            image = None
+        self._count(image is not None)
+        return image
+
+    def set(self, chart, image):
+        """
+        Store the image of chart. Raises IOError or OSError if the
+        image can not be written, leaving no file behind.
+        """
+        path = self.path(chart)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                pass # created by another thread
+        tmp = "%s.%d.%d.tmp" % (path, os.getpid(), thread.get_ident())
+        try:
+            f = open(tmp, "wb")
+            try:
+                f.write(image)
+            finally:
+                f.close()
+            if os.name == 'nt' and os.path.exists(path):
+                os.remove(path) # rename does not replace files
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def purge(self):
+        """
+        Remove every image older than the longest expiry.
+
+        Returns the amount of images removed.
+        """
+        oldest = time.time() - max(self.expiry.values())
+        removed = 0
+        for (directory, names, files) in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(directory, name)
+                try:
+                    if os.path.getmtime(path) < oldest:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    pass
+        return removed
+
+    def stats(self):
+        """
+        Return a dictionary of the cache hits and misses.
+        """
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def _count(self, hit):
+        self._lock.acquire()
+        try:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        finally:
+            self._lock.release()
+
+class ChartFetcher:
+    """
+    Download the images of many charts concurrently, through a
+    ChartCache.
+    """
+    def __init__(self, cache=None, concurrency=4, timeout=10):
+        """
+        cache: ChartCache (default: one in ~/.pystocks/charts)
+        concurrency: maximum amount of downloads at the same time
+                     (default: 4)
+        timeout: seconds to wait for each download (default: 10)
+        """
+        if concurrency < 1:
+            raise ValueError("concurrency must be positive")
+        if cache is None:
+            cache = ChartCache()
+        self.cache = cache
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+    def get(self, chart):
+        """
+        Return the image of chart, from the cache when it did not
+        expire. Raises FeedError if it can not be downloaded.
+        """
+        image = self.fetch([chart])[chart]
+        if isinstance(image, FeedError):
+            raise image
+        return image
+
+    def fetch(self, charts):
+        """
+        Obtain the images of charts, downloading the ones that are not
+        cached concurrently. Charts with the same normalized URL are
+        downloaded once.
+
+        Returns a dictionary mapping every chart to its image, or to
+        the FeedError raised downloading it.
+        """
+        images = {}
+        missing = {} # key: charts with this key
+        for chart in charts:
+            image = self.cache.get(chart)
+            if image is not None:
+                images[chart] = image
+                continue
+            missing.setdefault(chart_key(chart), []).append(chart)
+        if not missing:
+            return images
+
+        queue = Queue.Queue()
+        for same in missing.values():
+            queue.put(same)
+        lock = threading.Lock()
+        workers = []
+        for i in range(min(self.concurrency, len(missing))):
+            worker = threading.Thread(target=self._work,
+                                      args=(queue, images, lock))
+            worker.setDaemon(True)
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.join()
+        return images
+
+    def _work(self, queue, images, lock):
+        while True:
+            try:
+                same = queue.get_nowait()
+            except Queue.Empty:
+                break
+            try:
+                image = same[0].download(self.timeout)
+            except FeedError, e:
+                image = e
+            else:
+                try:
+                    self.cache.set(same[0], image)
+                except (IOError, OSError):
+                    pass # a full or read-only disk: serve it uncached
+            lock.acquire()
+            try:
+                for chart in same:
+                    images[chart] = image
+            finally:
+                lock.release()
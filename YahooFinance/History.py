@@ -0,0 +1,484 @@
+#!/usr/bin/env python
+#
+
+"""
+Historical daily bars (open, high, low, close, volume).
+
+fetch_history() downloads the daily bars of a symbol from the
+Yahoo! Finance historical prices table. HistoryStore keeps them on disk,
+one directory per symbol and one file per column of fixed size values,
+and only downloads the dates it does not have yet, before or after the
+bars it holds:
+
+    >>> store = HistoryStore()
+    >>> store.update('YHOO', '5y')
+    1258
+    >>> store.update('YHOO', '5y')  # the next day
+    1
+    >>> bars = store.bars('YHOO')
+    >>> bars.close[-1]
+    25.56
+
+The columns are memory-mapped: with NumPy installed, the columns of
+Bars are read-only numpy.memmap arrays, so series of years of thousands
+of symbols are scanned without being loaded as Python objects. Without
+NumPy they are array.array copies of the files.
+"""
+
+import os
+import sys
+import csv
+import shutil
+import mmap
+import array
+import bisect
+import urllib
+import urllib2
+import datetime
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from pystocks.YahooFinance.YahooFinance import FeedError, SymbolError
+from pystocks.YahooFinance.Transport import get_transport, TRANSPORT_ERRORS
+
+__revision__ = "$Id$"
+
+HISTORY_URL = ("http://ichart.finance.yahoo.com/table.csv?s=%s"
+               "&a=%d&b=%d&c=%d&d=%d&e=%d&f=%d&g=d&ignore=.csv")
+
+# days covered by the ranges of YahooChartFinder, None is everything
+RANGES = {
+    '1d': 1,
+    '5d': 5,
+    '3m': 92,
+    '6m': 183,
+    '1y': 366,
+    '2y': 731,
+    '5y': 1827,
+    'max': None,
+}
+
+# first date of `max'
+EPOCH = datetime.date(1962, 1, 2)
+
+# (name, numpy type, array typecode) of every column, stored little-endian;
+# dates are proleptic Gregorian ordinals (datetime.date.toordinal())
+COLUMNS = (
+    ('date', '<i4', 'i'),
+    ('open', '<f8', 'd'),
+    ('high', '<f8', 'd'),
+    ('low', '<f8', 'd'),
+    ('close', '<f8', 'd'),
+    ('volume', '<f8', 'd'),
+    ('adj_close', '<f8', 'd'),
+)
+
+def _date(value):
+    (year, month, day) = value.split('-')
+    return datetime.date(int(year), int(month), int(day))
+
+def fetch_history(symbol, start=None, end=None, timeout=None):
+    """
+    Download the daily bars of symbol between start and end
+    (datetime.date, inclusive, default: everything up to today).
+
+    Returns a list of (date ordinal, open, high, low, close, volume,
+    adjusted close) tuples, oldest first.
+    """
+    start = start or EPOCH
+    end = end or datetime.date.today()
+    url = HISTORY_URL % (urllib.quote(symbol),
+                         start.month - 1, start.day, start.year,
+                         end.month - 1, end.day, end.year)
+    try:
+        f = get_transport().open(url, timeout)
+    except urllib2.HTTPError, e:
+        if e.code == 404:
+            raise SymbolError("Invalid symbol: %s" % symbol)
+        raise FeedError("Could not fetch history: %s" % symbol)
+    except TRANSPORT_ERRORS, e:
+        raise FeedError("Could not fetch history: %s" % symbol)
+
+    bars = []
+    try:
+        reader = csv.reader(f)
+        try:
+            reader.next() # Date,Open,High,Low,Close,Volume,Adj Close
+            for row in reader:
+                if not row:
+                    continue
+                bars.append((_date(row[0]).toordinal(),
+                             float(row[1]), float(row[2]), float(row[3]),
+                             float(row[4]), float(row[5]), float(row[6])))
+        except StopIteration:
+            pass
+        except (IndexError, ValueError), e:
+            raise FeedError("Malformed history for %s: %s" % (symbol, e))
+    finally:
+        f.close()
+
+    # the table lists the most recent day first
+    bars.sort()
+    return bars
+
+class Bars:
+    """
+    Daily bars of a symbol, as columns.
+
+    date: dates, as ordinals
+    open, high, low, close, volume, adj_close: values of every day
+    """
+    def __init__(self, symbol, columns):
+        self.symbol = symbol
+        for (name, dtype, typecode) in COLUMNS:
+            setattr(self, name, columns[name])
+
+    def __len__(self):
+        return len(self.date)
+
+    def dates(self):
+        """
+        Return the dates as a list of datetime.date.
+        """
+        return [datetime.date.fromordinal(int(d)) for d in self.date]
+
+    def between(self, start=None, end=None):
+        """
+        Return the Bars from start to end (datetime.date, inclusive).
+        With NumPy, the columns are views of these columns.
+        """
+        first = 0
+        last = len(self.date)
+        if start is not None:
+            first = bisect.bisect_left(self.date, start.toordinal())
+        if end is not None:
+            last = bisect.bisect_right(self.date, end.toordinal())
+        columns = {}
+        for (name, dtype, typecode) in COLUMNS:
+            columns[name] = getattr(self, name)[first:last]
+        return Bars(self.symbol, columns)
+
+    def rows(self):
+        """
+        Iterate over the (date, open, high, low, close, volume,
+        adjusted close) of every day.
+        """
+        columns = [getattr(self, name) for (name, d, t) in COLUMNS]
+        for pos in xrange(len(self.date)):
+            row = [column[pos] for column in columns]
+            row[0] = datetime.date.fromordinal(int(row[0]))
+            yield tuple(row)
+
+    def __repr__(self):
+        return "<Bars %s: %d days>" % (self.symbol, len(self))
+
+class HistoryStore:
+    """
+    On-disk store of the daily bars of many symbols.
+    """
+    def __init__(self, directory=os.path.expanduser("~/.pystocks/history")):
+        """
+        directory: where the bars are kept (default: ~/.pystocks/history)
+        """
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def symbols(self):
+        """
+        Return the symbols held by the store.
+        """
+        return sorted([name for name in os.listdir(self.directory)
+                       if (not name.startswith('.') and
+                           os.path.isdir(os.path.join(self.directory,
+                                                      name)))])
+
+    def __contains__(self, symbol):
+        return os.path.isdir(self._path(symbol))
+
+    def __len__(self):
+        return len(self.symbols())
+
+    def first_date(self, symbol):
+        """
+        Return the date (datetime.date) of the first bar of symbol,
+        or None.
+        """
+        if not self._count(symbol):
+            return None
+        f = open(self._column_path(symbol, 'date'), "rb")
+        try:
+            value = _load('i', f.read(4))[0]
+        finally:
+            f.close()
+        return datetime.date.fromordinal(value)
+
+    def start_date(self, symbol):
+        """
+        Return the first date (datetime.date) downloaded for symbol,
+        on or before its first bar, or None.
+        """
+        first = self.first_date(symbol)
+        if first is None:
+            return None
+        try:
+            f = open(self._column_path(symbol, 'start'), "r")
+            try:
+                start = datetime.date.fromordinal(int(f.read()))
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            return first
+        return min(start, first)
+
+    def last_date(self, symbol):
+        """
+        Return the date (datetime.date) of the last bar of symbol,
+        or None.
+        """
+        path = self._column_path(symbol, 'date')
+        count = self._count(symbol)
+        if not count:
+            return None
+        f = open(path, "rb")
+        try:
+            f.seek((count - 1) * 4)
+            value = _load('i', f.read(4))[0]
+        finally:
+            f.close()
+        return datetime.date.fromordinal(value)
+
+    def append(self, symbol, bars):
+        """
+        Append bars to the history of symbol; the bars dated on or
+        before the last bar held are ignored.
+
+        bars: (date ordinal, open, high, low, close, volume,
+              adjusted close) tuples, oldest first
+
+        Returns the amount of bars appended.
+        """
+        last = self.last_date(symbol)
+        if last is not None:
+            last = last.toordinal()
+            bars = [bar for bar in bars if bar[0] > last]
+        if not bars:
+            return 0
+        if not os.path.isdir(self._path(symbol)):
+            os.makedirs(self._path(symbol))
+
+        for (pos, (name, dtype, typecode)) in enumerate(COLUMNS):
+            values = array.array(typecode, [bar[pos] for bar in bars])
+            if sys.byteorder != 'little':
+                values.byteswap()
+            f = open(self._column_path(symbol, name), "ab")
+            try:
+                values.tofile(f)
+            finally:
+                f.close()
+        return len(bars)
+
+    def prepend(self, symbol, bars):
+        """
+        Insert bars before the history of symbol; the bars dated on or
+        after the first bar held are ignored. The columns are rewritten
+        in a new directory which then replaces the previous one, a
+        crash leaves the previous bars as they were.
+
+        bars: (date ordinal, open, high, low, close, volume,
+              adjusted close) tuples, oldest first
+
+        Returns the amount of bars inserted.
+        """
+        first = self.first_date(symbol)
+        if first is None:
+            return self.append(symbol, bars)
+        first = first.toordinal()
+        bars = [bar for bar in bars if bar[0] < first]
+        if not bars:
+            return 0
+
+        path = self._path(symbol)
+        new = os.path.join(self.directory, "." + symbol.upper() + ".new")
+        old = os.path.join(self.directory, "." + symbol.upper() + ".old")
+        for directory in (new, old):
+            if os.path.isdir(directory):
+                shutil.rmtree(directory)
+        os.makedirs(new)
+        count = self._count(symbol)
+        for (pos, (name, dtype, typecode)) in enumerate(COLUMNS):
+            values = array.array(typecode, [bar[pos] for bar in bars])
+            if sys.byteorder != 'little':
+                values.byteswap()
+            size = count * values.itemsize
+            source = open(self._column_path(symbol, name), "rb")
+            try:
+                f = open(os.path.join(new, name), "wb")
+                try:
+                    values.tofile(f)
+                    f.write(source.read(size))
+                finally:
+                    f.close()
+            finally:
+                source.close()
+        start = os.path.join(path, 'start')
+        if os.path.exists(start):
+            shutil.copy(start, os.path.join(new, 'start'))
+        os.rename(path, old)
+        os.rename(new, path)
+        shutil.rmtree(old)
+        return len(bars)
+
+    def update(self, symbol, range='max', end=None, timeout=None):
+        """
+        Download the bars of symbol missing from the store: the days of
+        range before the first bar held, and the days after the last.
+
+        range: period to hold, see RANGES (default: max)
+        end: last date to download (default: today)
+
+        Returns the amount of bars added.
+        """
+        if range not in RANGES:
+            raise ValueError("Invalid range: %s" % range)
+        end = end or datetime.date.today()
+        if RANGES[range] is None:
+            start = EPOCH
+        else:
+            start = end - datetime.timedelta(days=RANGES[range])
+        one_day = datetime.timedelta(days=1)
+        added = 0
+        first = self.start_date(symbol)
+        if first is not None and start < first:
+            # an earlier range was downloaded first, fill in the days
+            # before it
+            added += self.prepend(symbol, fetch_history(symbol, start,
+                                                        first - one_day,
+                                                        timeout))
+            self._set_start(symbol, start)
+        last = self.last_date(symbol)
+        if last is not None:
+            start = max(start, last + one_day)
+        if start > end:
+            return added
+        added += self.append(symbol, fetch_history(symbol, start, end,
+                                                   timeout))
+        if first is None:
+            self._set_start(symbol, start)
+        return added
+
+    def update_many(self, symbols, range='max', end=None, timeout=None):
+        """
+        Update many symbols.
+
+        Returns a dictionary of the amount of bars appended, or of the
+        SymbolError or FeedError raised, by symbol.
+        """
+        results = {}
+        for symbol in symbols:
+            try:
+                results[symbol] = self.update(symbol, range, end, timeout)
+            except (SymbolError, FeedError), e:
+                results[symbol] = e
+        return results
+
+    def bars(self, symbol):
+        """
+        Return the Bars of symbol.
+        """
+        if symbol not in self:
+            raise KeyError(symbol)
+        count = self._count(symbol)
+        columns = {}
+        for (name, dtype, typecode) in COLUMNS:
+            path = self._column_path(symbol, name)
+            columns[name] = _map(path, dtype, typecode, count)
+        return Bars(symbol, columns)
+
+    def remove(self, symbol):
+        """
+        Remove the history of symbol.
+        """
+        for (name, dtype, typecode) in COLUMNS:
+            path = self._column_path(symbol, name)
+            if os.path.exists(path):
+                os.remove(path)
+        path = self._column_path(symbol, 'start')
+        if os.path.exists(path):
+            os.remove(path)
+        if os.path.isdir(self._path(symbol)):
+            os.rmdir(self._path(symbol))
+
+    def _path(self, symbol):
+        return os.path.join(self.directory, symbol.upper())
+
+    def _column_path(self, symbol, name):
+        return os.path.join(self._path(symbol), name)
+
+    def _set_start(self, symbol, start):
+        """
+        Record that the days of symbol from start on were downloaded,
+        the days without bars before the first bar are not asked again.
+        """
+        if not os.path.isdir(self._path(symbol)):
+            return # nothing was found
+        f = open(self._column_path(symbol, 'start'), "w")
+        try:
+            f.write("%d\n" % start.toordinal())
+        finally:
+            f.close()
+
+    def _count(self, symbol):
+        """
+        Return the amount of complete bars of symbol. Columns left
+        longer than the others by an interrupted append are cut.
+        """
+        sizes = []
+        for (name, dtype, typecode) in COLUMNS:
+            path = self._column_path(symbol, name)
+            size = 0
+            if os.path.exists(path):
+                size = os.path.getsize(path)
+            sizes.append(size // array.array(typecode).itemsize)
+        count = min(sizes)
+        if count != max(sizes):
+            for (name, dtype, typecode) in COLUMNS:
+                path = self._column_path(symbol, name)
+                if os.path.exists(path):
+                    f = open(path, "r+b")
+                    try:
+                        f.truncate(count * array.array(typecode).itemsize)
+                    finally:
+                        f.close()
+        return count
+
+def _load(typecode, data):
+    values = array.array(typecode)
+    values.fromstring(data)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+def _map(path, dtype, typecode, count):
+    """
+    Return the first count values of a column file.
+    """
+    if numpy is not None:
+        if not count:
+            return numpy.zeros(0, dtype)
+        return numpy.memmap(path, dtype=dtype, mode='r', shape=(count,))
+    if not count:
+        return array.array(typecode)
+    f = open(path, "rb")
+    try:
+        view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return _load(typecode,
+                         view[:count * array.array(typecode).itemsize])
+        finally:
+            view.close()
+    finally:
+        f.close()
@@ -0,0 +1,518 @@
+#!/usr/bin/env python
+#
+
+"""
+Technical indicators computed locally.
+
+The indicators and overlays YahooChartFinder can draw on a chart are
+computed here from the daily bars of a symbol (see History), so the
+indicators of many symbols are computed in one batch instead of
+downloading a chart image per symbol and per indicator.
+
+Every indicator is a class updated one bar at a time in constant time,
+for streaming use:
+
+    >>> rsi = RSI(14)
+    >>> for price in prices:
+    ...     value = rsi.update(price)  # None until enough bars were seen
+
+and a function computing it over whole series, returning NumPy arrays
+when NumPy is installed, lists otherwise, with NaN where the indicator
+is not defined yet. With NumPy, sma(), roc() and bollinger() are
+computed with vectorized operations; the other functions run their
+class over the series:
+
+    >>> sma(bars.close, 50)
+    >>> (middle, upper, lower) = bollinger(bars.close, 20, 2)
+
+compute() takes the names of the YahooChartFinder attributes:
+
+    >>> compute(store.bars('YHOO'), ['macd', 'rsi', 'm50', 'e20'])
+    {'macd': (...), 'rsi': [...], 'm50': [...], 'e20': [...]}
+"""
+
+import re
+
+from collections import deque
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__revision__ = "$Id$"
+
+NAN = float('nan')
+
+class SMA:
+    """
+    Simple moving average.
+    """
+    def __init__(self, period):
+        if period < 1:
+            raise ValueError("period must be positive")
+        self.period = period
+        self._window = deque()
+        self._sum = 0.0
+
+    def update(self, value):
+        self._window.append(value)
+        self._sum += value
+        if len(self._window) > self.period:
+            self._sum -= self._window.popleft()
+        if len(self._window) < self.period:
+            return None
+        return self._sum / self.period
+
+class EMA:
+    """
+    Exponential moving average, started from the simple average of
+    the first `period' values.
+    """
+    def __init__(self, period):
+        if period < 1:
+            raise ValueError("period must be positive")
+        self.period = period
+        self.alpha = 2.0 / (period + 1)
+        self.value = None
+        self._seed = SMA(period)
+
+    def update(self, value):
+        if self.value is None:
+            self.value = self._seed.update(value)
+        else:
+            self.value += self.alpha * (value - self.value)
+        return self.value
+
+class MACD:
+    """
+    Moving Average Convergence/Divergence: (macd, signal, histogram).
+    """
+    def __init__(self, fast=12, slow=26, signal=9):
+        self._fast = EMA(fast)
+        self._slow = EMA(slow)
+        self._signal = EMA(signal)
+
+    def update(self, value):
+        fast = self._fast.update(value)
+        slow = self._slow.update(value)
+        if fast is None or slow is None:
+            return (None, None, None)
+        macd = fast - slow
+        signal = self._signal.update(macd)
+        if signal is None:
+            return (macd, None, None)
+        return (macd, signal, macd - signal)
+
+class RSI:
+    """
+    Relative Strength Index, with Wilder's smoothing.
+    """
+    def __init__(self, period=14):
+        if period < 1:
+            raise ValueError("period must be positive")
+        self.period = period
+        self._previous = None
+        self._count = 0
+        self._gain = 0.0
+        self._loss = 0.0
+
+    def update(self, value):
+        previous = self._previous
+        self._previous = value
+        if previous is None:
+            return None
+        change = value - previous
+        gain = max(change, 0.0)
+        loss = max(-change, 0.0)
+        period = self.period
+        if self._count < period:
+            self._count += 1
+            self._gain += gain / period
+            self._loss += loss / period
+            if self._count < period:
+                return None
+        else:
+            self._gain = (self._gain * (period - 1) + gain) / period
+            self._loss = (self._loss * (period - 1) + loss) / period
+        if self._loss == 0:
+            return 100.0
+        return 100.0 - 100.0 / (1 + self._gain / self._loss)
+
+class ROC:
+    """
+    Rate Of Change, in percent.
+    """
+    def __init__(self, period=12):
+        if period < 1:
+            raise ValueError("period must be positive")
+        self.period = period
+        self._window = deque()
+
+    def update(self, value):
+        self._window.append(value)
+        if len(self._window) <= self.period:
+            return None
+        previous = self._window.popleft()
+        if previous == 0:
+            return None
+        return (value - previous) * 100.0 / previous
+
+class MFI:
+    """
+    Money Flow Index, updated with (high, low, close, volume).
+    """
+    def __init__(self, period=14):
+        if period < 1:
+            raise ValueError("period must be positive")
+        self.period = period
+        self._previous = None
+        self._flows = deque()
+        self._positive = 0.0
+        self._negative = 0.0
+
+    def update(self, high, low, close, volume):
+        typical = (high + low + close) / 3.0
+        previous = self._previous
+        self._previous = typical
+        if previous is None:
+            return None
+        flow = typical * volume
+        if typical > previous:
+            flow = (flow, 0.0)
+        elif typical < previous:
+            flow = (0.0, flow)
+        else:
+            flow = (0.0, 0.0)
+        self._flows.append(flow)
+        self._positive += flow[0]
+        self._negative += flow[1]
+        if len(self._flows) > self.period:
+            (positive, negative) = self._flows.popleft()
+            self._positive -= positive
+            self._negative -= negative
+        if len(self._flows) < self.period:
+            return None
+        if self._negative <= 0:
+            return 100.0
+        return 100.0 - 100.0 / (1 + self._positive / self._negative)
+
+class _Extreme:
+    """
+    Highest (or lowest) of the last `period' values, in amortized
+    constant time.
+    """
+    def __init__(self, period, highest=True):
+        self.period = period
+        self.highest = highest
+        self._window = deque() # (position, value), best first
+        self._position = 0
+
+    def update(self, value):
+        window = self._window
+        if self.highest:
+            while window and window[-1][1] <= value:
+                window.pop()
+        else:
+            while window and window[-1][1] >= value:
+                window.pop()
+        window.append((self._position, value))
+        if window[0][0] <= self._position - self.period:
+            window.popleft()
+        self._position += 1
+        if self._position < self.period:
+            return None
+        return window[0][1]
+
+class Stochastic:
+    """
+    Stochastic oscillator (%K, %D), updated with (high, low, close).
+    The slow oscillator smoothes %K once more.
+    """
+    def __init__(self, period=14, smooth=3, slow=False):
+        self._highest = _Extreme(period, True)
+        self._lowest = _Extreme(period, False)
+        self._k = None
+        if slow:
+            self._k = SMA(smooth)
+        self._d = SMA(smooth)
+
+    def update(self, high, low, close):
+        highest = self._highest.update(high)
+        lowest = self._lowest.update(low)
+        if highest is None:
+            return (None, None)
+        if highest == lowest:
+            k = 50.0
+        else:
+            k = (close - lowest) * 100.0 / (highest - lowest)
+        if self._k is not None:
+            k = self._k.update(k)
+            if k is None:
+                return (None, None)
+        return (k, self._d.update(k))
+
+class Williams:
+    """
+    Williams %R, updated with (high, low, close).
+    """
+    def __init__(self, period=14):
+        self._highest = _Extreme(period, True)
+        self._lowest = _Extreme(period, False)
+
+    def update(self, high, low, close):
+        highest = self._highest.update(high)
+        lowest = self._lowest.update(low)
+        if highest is None:
+            return None
+        if highest == lowest:
+            return -50.0
+        return (highest - close) * -100.0 / (highest - lowest)
+
+class Bollinger:
+    """
+    Bollinger Bands: (middle, upper, lower).
+    """
+    def __init__(self, period=20, width=2.0):
+        if period < 1:
+            raise ValueError("period must be positive")
+        self.period = period
+        self.width = width
+        self._window = deque()
+        self._sum = 0.0
+        self._squares = 0.0
+
+    def update(self, value):
+        self._window.append(value)
+        self._sum += value
+        self._squares += value * value
+        if len(self._window) > self.period:
+            old = self._window.popleft()
+            self._sum -= old
+            self._squares -= old * old
+        if len(self._window) < self.period:
+            return (None, None, None)
+        mean = self._sum / self.period
+        deviation = max(self._squares / self.period - mean * mean, 0.0) ** 0.5
+        return (mean, mean + self.width * deviation,
+                mean - self.width * deviation)
+
+class ParabolicSAR:
+    """
+    Wilder's Parabolic Stop And Reverse, updated with (high, low).
+    """
+    def __init__(self, step=0.02, maximum=0.2):
+        self.step = step
+        self.maximum = maximum
+        self._bars = deque(maxlen=2) # previous (high, low)
+        self._rising = None
+        self._sar = None
+        self._extreme = None
+        self._factor = step
+
+    def update(self, high, low):
+        bars = self._bars
+        if not bars:
+            bars.append((high, low))
+            return None
+        if self._rising is None:
+            (previous_high, previous_low) = bars[-1]
+            self._rising = high >= previous_high
+            if self._rising:
+                (self._sar, self._extreme) = (previous_low, high)
+            else:
+                (self._sar, self._extreme) = (previous_high, low)
+            bars.append((high, low))
+            return self._sar
+
+        sar = self._sar + self._factor * (self._extreme - self._sar)
+        if self._rising:
+            sar = min([sar] + [bar[1] for bar in bars])
+            if low < sar:
+                (self._rising, sar) = (False, self._extreme)
+                (self._extreme, self._factor) = (low, self.step)
+            elif high > self._extreme:
+                self._extreme = high
+                self._factor = min(self._factor + self.step, self.maximum)
+        else:
+            sar = max([sar] + [bar[0] for bar in bars])
+            if high > sar:
+                (self._rising, sar) = (True, self._extreme)
+                (self._extreme, self._factor) = (high, self.step)
+            elif low < self._extreme:
+                self._extreme = low
+                self._factor = min(self._factor + self.step, self.maximum)
+        self._sar = sar
+        bars.append((high, low))
+        return sar
+
+def _series(values):
+    """
+    Return values as an array (or list without NumPy), None as NaN.
+    """
+    values = [NAN if v is None else v for v in values]
+    if numpy is not None:
+        return numpy.array(values, dtype=numpy.float64)
+    return values
+
+def _run(indicator, *columns):
+    """
+    Update indicator with every row of columns and return the series
+    of its values, or a tuple of series for indicators returning many.
+    """
+    values = [indicator.update(*row) for row in zip(*columns)]
+    if values and type(values[0]) is tuple:
+        return tuple([_series(series) for series in zip(*values)])
+    return _series(values)
+
+def _array(values):
+    return numpy.asarray(values, dtype=numpy.float64)
+
+def _moving_sum(values, period):
+    total = numpy.cumsum(values)
+    total[period:] = total[period:] - total[:-period]
+    total[:period - 1] = NAN
+    return total
+
+def sma(values, period):
+    """
+    Simple moving average of values.
+    """
+    if numpy is not None:
+        if period < 1:
+            raise ValueError("period must be positive")
+        return _moving_sum(_array(values), period) / period
+    return _run(SMA(period), values)
+
+def ema(values, period):
+    """
+    Exponential moving average of values.
+    """
+    return _run(EMA(period), values)
+
+def macd(values, fast=12, slow=26, signal=9):
+    """
+    (macd, signal, histogram) of values.
+    """
+    return _run(MACD(fast, slow, signal), values)
+
+def rsi(values, period=14):
+    """
+    Relative Strength Index of values.
+    """
+    return _run(RSI(period), values)
+
+def roc(values, period=12):
+    """
+    Rate Of Change of values, in percent, NaN where the previous value
+    is zero (as ROC).
+    """
+    if numpy is not None:
+        if period < 1:
+            raise ValueError("period must be positive")
+        values = _array(values)
+        result = numpy.empty(len(values))
+        result[:period] = NAN
+        previous = values[:-period]
+        zero = previous == 0
+        change = ((values[period:] - previous) * 100.0 /
+                  numpy.where(zero, 1.0, previous))
+        change[zero] = NAN
+        result[period:] = change
+        return result
+    return _run(ROC(period), values)
+
+def mfi(high, low, close, volume, period=14):
+    """
+    Money Flow Index.
+    """
+    return _run(MFI(period), high, low, close, volume)
+
+def stochastic(high, low, close, period=14, smooth=3, slow=False):
+    """
+    (%K, %D) of the stochastic oscillator.
+    """
+    return _run(Stochastic(period, smooth, slow), high, low, close)
+
+def williams(high, low, close, period=14):
+    """
+    Williams %R.
+    """
+    return _run(Williams(period), high, low, close)
+
+def bollinger(values, period=20, width=2.0):
+    """
+    (middle, upper, lower) Bollinger Bands of values.
+    """
+    if numpy is not None:
+        if period < 1:
+            raise ValueError("period must be positive")
+        values = _array(values)
+        mean = _moving_sum(values, period) / period
+        squares = _moving_sum(values * values, period) / period
+        deviation = numpy.sqrt(numpy.maximum(squares - mean * mean, 0.0))
+        return (mean, mean + width * deviation, mean - width * deviation)
+    return _run(Bollinger(period, width), values)
+
+def parabolic_sar(high, low, step=0.02, maximum=0.2):
+    """
+    Parabolic SAR.
+    """
+    return _run(ParabolicSAR(step, maximum), high, low)
+
+_average_re = re.compile(r'^([me])([0-9]+)$')
+
+def compute(bars, names):
+    """
+    Compute indicators over bars.
+
+    bars: History.Bars, or any object with high, low, close and
+          volume columns
+    names: YahooChartFinder indicator and overlay names (macd, mfi,
+           roc, rsi, stoch_s, stoch_f, will, boll, para, m5 ... m200,
+           e5 ... e200)
+
+    Returns a dictionary of the series of every indicator.
+    """
+    results = {}
+    for name in names:
+        match = _average_re.match(name)
+        if match:
+            (kind, period) = match.groups()
+            if kind == 'm':
+                results[name] = sma(bars.close, int(period))
+            else:
+                results[name] = ema(bars.close, int(period))
+        elif name == 'macd':
+            results[name] = macd(bars.close)
+        elif name == 'mfi':
+            results[name] = mfi(bars.high, bars.low, bars.close, bars.volume)
+        elif name == 'roc':
+            results[name] = roc(bars.close)
+        elif name == 'rsi':
+            results[name] = rsi(bars.close)
+        elif name == 'stoch_s':
+            results[name] = stochastic(bars.high, bars.low, bars.close,
+                                       slow=True)
+        elif name == 'stoch_f':
+            results[name] = stochastic(bars.high, bars.low, bars.close)
+        elif name == 'will':
+            results[name] = williams(bars.high, bars.low, bars.close)
+        elif name == 'boll':
+            results[name] = bollinger(bars.close)
+        elif name == 'para':
+            results[name] = parabolic_sar(bars.high, bars.low)
+        else:
+            raise ValueError("Can not compute: %s" % name)
+    return results
+
+def compute_many(store, symbols, names):
+    """
+    Compute indicators for many symbols of a History.HistoryStore.
+
+    Returns a dictionary of the compute() results by symbol.
+    """
+    results = {}
+    for symbol in symbols:
+        results[symbol] = compute(store.bars(symbol), names)
+    return results
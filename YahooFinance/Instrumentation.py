@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+#
+
+"""
+Counters and latency histograms of the feed lookups and portfolio
+storage.
+
+Instrumentation is disabled by default and then costs a single test of
+`enabled' at every instrumented call. Once enabled, the quote lookups,
+QuoteFinder.getCurrentPrice and the portfolio storages record:
+
+    feed.requests, feed.bytes      requests sent to the feeds, bytes read
+    feed.request                   network time of every request
+    quote.csv, quote.parse         csv splitting and parsing time
+    quote.stripped                 values cleaned by the tag-stripping regex
+    quote.cache.hits, .misses      quote cache lookups
+    quote.stale                    stale prices given by QuoteFinder
+    quote.refresh.errors           failed background price refreshes
+    feed.retries                   requests sent again after a failure
+    feed.circuit.opened, .refused  circuits opened, requests refused
+    portfolio.price                QuoteFinder.getCurrentPrice time
+    storage.append                 journal record writing time
+    storage.save                   snapshot writing and SQLite commit time
+    storage.reload                 snapshot and journal loading time,
+                                   SQLite lots reading time
+
+Example:
+
+    >>> from pystocks.YahooFinance import Instrumentation
+    >>> Instrumentation.enable()
+    >>> pm.getTotalProfits()
+    >>> Instrumentation.snapshot()['histograms']['feed.request']['p99']
+    0.0512
+
+Callbacks given to subscribe() receive every event as (kind, name,
+value), kind being 'count' or 'observe', e.g. to forward them to a
+monitoring system.
+"""
+
+import threading
+
+__revision__ = "$Id$"
+
+# checked by the instrumented code before recording anything
+enabled = False
+
+# upper bounds of the histogram buckets, in seconds: 100us to ~52s
+BOUNDS = tuple([0.0001 * 2 ** i for i in range(20)])
+
+class Histogram:
+    """
+    Distribution of durations in exponential buckets.
+    """
+    def __init__(self, bounds=BOUNDS):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        pos = 0
+        for bound in self.bounds:
+            if value <= bound:
+                break
+            pos += 1
+        self.buckets[pos] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        """
+        Return the upper bound of the bucket holding the percentile,
+        or the largest value observed for the last bucket.
+        """
+        if not self.count:
+            return None
+        rank = self.count * percent / 100.0
+        seen = 0
+        for (pos, count) in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and count:
+                if pos < len(self.bounds):
+                    return min(self.bounds[pos], self.max)
+                return self.max
+        return self.max
+
+    def snapshot(self):
+        mean = None
+        if self.count:
+            mean = self.sum / self.count
+        return {'count': self.count,
+                'sum': self.sum,
+                'min': self.min,
+                'max': self.max,
+                'mean': mean,
+                'p50': self.percentile(50),
+                'p99': self.percentile(99),
+                'buckets': zip(self.bounds + (None,), self.buckets)}
+
+class Metrics:
+    """
+    Named counters and histograms.
+    """
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.callbacks = []
+        self._lock = threading.Lock()
+
+    def count(self, name, amount=1):
+        self._lock.acquire()
+        try:
+            self.counters[name] = self.counters.get(name, 0) + amount
+        finally:
+            self._lock.release()
+        for callback in self.callbacks:
+            callback('count', name, amount)
+
+    def observe(self, name, value):
+        self._lock.acquire()
+        try:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+        finally:
+            self._lock.release()
+        for callback in self.callbacks:
+            callback('observe', name, value)
+
+    def snapshot(self):
+        """
+        Return a dictionary of the counters and of the snapshot of
+        every histogram.
+        """
+        self._lock.acquire()
+        try:
+            histograms = {}
+            for (name, histogram) in self.histograms.items():
+                histograms[name] = histogram.snapshot()
+            return {'counters': dict(self.counters),
+                    'histograms': histograms}
+        finally:
+            self._lock.release()
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            self.counters.clear()
+            self.histograms.clear()
+        finally:
+            self._lock.release()
+
+metrics = Metrics()
+
+def enable():
+    """
+    Start recording.
+    """
+    global enabled
+    enabled = True
+
+def disable():
+    """
+    Stop recording, what was recorded is kept.
+    """
+    global enabled
+    enabled = False
+
+def count(name, amount=1):
+    """
+    Add amount to the counter name.
+    """
+    metrics.count(name, amount)
+
+def observe(name, value):
+    """
+    Record a duration (seconds) in the histogram name.
+    """
+    metrics.observe(name, value)
+
+def snapshot():
+    """
+    Return the counters and histograms recorded so far.
+    """
+    return metrics.snapshot()
+
+def reset():
+    """
+    Forget every counter and histogram.
+    """
+    metrics.reset()
+
+def subscribe(callback):
+    """
+    Call callback(kind, name, value) on every event recorded.
+    """
+    metrics.callbacks.append(callback)
+
+def unsubscribe(callback):
+    metrics.callbacks.remove(callback)
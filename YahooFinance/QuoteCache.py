@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+#
+
+"""
+Process-wide cache of the quote attributes downloaded from the feeds.
+
+Every attribute (feed tag) of a symbol is kept with its own expiry:
+prices move every few seconds while the amount of outstanding shares
+changes a few times a year. Symbols are evicted in least recently used
+order once the cache holds `max_symbols' of them. Expired attributes are
+kept until their symbol is evicted, get_stale() returns them with their
+age, e.g. to answer with the last known price while the feed is down.
+
+YahooQuoteFinder and PortfolioManager.QuoteFinder use the cache returned
+by get_cache() transparently.
+
+Example:
+
+    >>> from pystocks.YahooFinance import QuoteCache
+    >>> cache = QuoteCache.get_cache()
+    >>> cache.stats()
+    {'hits': 0, 'misses': 0, 'evictions': 0, 'symbols': 0}
+    >>> cache.invalidate('YHOO')
+"""
+
+import time
+import threading
+
+from collections import OrderedDict
+
+__revision__ = "$Id$"
+
+# seconds an attribute stays valid unless it is listed in TTLS
+DEFAULT_TTL = 60
+
+TTLS = {
+    # trading day attributes
+    'a2': 3600, 'p': 3600, 'o': 3600, 'w': 3600, 'q': 3600, 'r1': 3600,
+    'd': 3600, 'y': 3600, 'e': 3600, 'r': 3600, 'x': 3600,
+    # analysts' estimates and ratios
+    's7': 3600, 't8': 3600, 'e7': 3600, 'e8': 3600, 'e9': 3600,
+    'r6': 3600, 'r7': 3600, 'r5': 3600, 'b4': 3600, 'p6': 3600,
+    'p5': 3600, 'j4': 3600, 'm3': 3600, 'm4': 3600,
+    # fundamentals
+    'n': 86400, 'j2': 86400, 'f6': 86400,
+}
+
+class QuoteCache:
+    """
+    Bounded LRU cache of quote attributes with per-attribute expiry.
+    """
+    def __init__(self, max_symbols=1000, ttl=DEFAULT_TTL, ttls=TTLS):
+        """
+        max_symbols: amount of symbols kept before evicting the least
+                     recently used one (default: 1000)
+        ttl: seconds an attribute stays valid (default: DEFAULT_TTL)
+        ttls: dictionary of tag specific expiry times (default: TTLS)
+        """
+        if max_symbols < 1:
+            raise ValueError("max_symbols must be positive")
+        self.max_symbols = max_symbols
+        self.ttl = ttl
+        self.ttls = dict(ttls)
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        """
+        Remove every symbol and reset the statistics.
+        """
+        self._lock.acquire()
+        try:
+            self._symbols = OrderedDict()
+            self._hits = 0
+            self._misses = 0
+            self._evictions = 0
+        finally:
+            self._lock.release()
+
+    def get(self, symbol, tag, default=None):
+        """
+        Return the cached value of `tag' for `symbol' or `default' if
+        it is not cached or has expired.
+        """
+        values = self.get_many(symbol, [tag])
+        if values is None:
+            return default
+        return values[0]
+
+    def get_many(self, symbol, tags):
+        """
+        Return the list of cached values of `tags' for `symbol' or None
+        if any of them is not cached or has expired.
+        """
+        symbol = symbol.upper()
+        now = time.time()
+        self._lock.acquire()
+        try:
+            entry = self._symbols.get(symbol)
+            values = []
+            if entry is not None:
+                for tag in tags:
+                    item = entry.get(tag)
+                    if item is None or item[1] <= now:
+                        break
+                    values.append(item[0])
+            if entry is None or len(values) != len(tags):
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._touch(symbol, entry)
+            return values
+        finally:
+            self._lock.release()
+
+    def get_stale(self, symbol, tag):
+        """
+        Return the (value, age in seconds) of `tag' for `symbol', even if
+        it has expired, or None if it is not cached.
+        """
+        symbol = symbol.upper()
+        self._lock.acquire()
+        try:
+            entry = self._symbols.get(symbol)
+            if entry is None or tag not in entry:
+                return None
+            (value, expiry, when) = entry[tag]
+            return (value, time.time() - when)
+        finally:
+            self._lock.release()
+
+    def set_many(self, symbol, tags, values):
+        """
+        Cache `values' of `tags' for `symbol'.
+        """
+        symbol = symbol.upper()
+        now = time.time()
+        self._lock.acquire()
+        try:
+            entry = self._symbols.get(symbol)
+            if entry is None:
+                entry = {}
+            for (tag, value) in zip(tags, values):
+                entry[tag] = (value, now + self.ttls.get(tag, self.ttl), now)
+            self._touch(symbol, entry)
+            while len(self._symbols) > self.max_symbols:
+                self._evict()
+        finally:
+            self._lock.release()
+
+    def invalidate(self, symbol=None, tags=None):
+        """
+        Forget cached attributes.
+
+        symbol: only forget this symbol (default: every symbol)
+        tags: only forget these attributes (default: every attribute)
+        """
+        self._lock.acquire()
+        try:
+            if symbol is None:
+                symbols = list(self._symbols)
+            else:
+                symbols = [symbol.upper()]
+            for symbol in symbols:
+                if symbol not in self._symbols:
+                    continue
+                if tags is None:
+                    del self._symbols[symbol]
+                    continue
+                entry = self._symbols[symbol]
+                for tag in tags:
+                    entry.pop(tag, None)
+                if not entry:
+                    del self._symbols[symbol]
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        """
+        Return a dictionary of the cache statistics.
+        """
+        self._lock.acquire()
+        try:
+            return {'hits': self._hits,
+                    'misses': self._misses,
+                    'evictions': self._evictions,
+                    'symbols': len(self._symbols)}
+        finally:
+            self._lock.release()
+
+    def __contains__(self, symbol):
+        return symbol.upper() in self._symbols
+
+    def __len__(self):
+        return len(self._symbols)
+
+    def _touch(self, symbol, entry):
+        # re-inserting moves the symbol to the most recently used end
+        self._symbols.pop(symbol, None)
+        self._symbols[symbol] = entry
+
+    def _evict(self):
+        self._symbols.popitem(last=False)
+        self._evictions += 1
+
+_cache = QuoteCache()
+
+def get_cache():
+    """
+    Return the cache used by all quote lookups, None when disabled.
+    """
+    return _cache
+
+def set_cache(cache):
+    """
+    Replace the cache used by all quote lookups, None disables caching.
+
+    Returns the previous cache.
+    """
+    global _cache
+    previous = _cache
+    _cache = cache
+    return previous
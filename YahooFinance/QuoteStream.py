@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+#
+
+"""
+Streaming quote subscription.
+
+QuoteStream polls the quotes of a watchlist on a schedule and only
+reports what moved: every refresh is compared to the previous one and a
+QuoteChange (symbol, field, old, new) is yielded for every attribute
+whose value changed. Only the last values of the watched attributes are
+kept, so memory does not grow however long the stream runs.
+
+Example:
+
+    >>> stream = QuoteStream(['YHOO', 'GOOG'], interval=30,
+    ...                      fields=['last_price', 'volume_daily'])
+    >>> for change in stream:
+    ...     print change.symbol, change.field, change.old, change.new
+    YHOO last_price None 25.56
+    ...
+    YHOO last_price 25.56 25.6
+
+The first refresh reports every value with None as the old value.
+"""
+
+import time
+
+from collections import namedtuple
+
+from pystocks.YahooFinance.YahooFinance import (YahooQuoteFinder,
+                                                FeedError,
+                                                SymbolError,
+                                                _QUOTE_SLOTS)
+
+__revision__ = "$Id$"
+
+QuoteChange = namedtuple('QuoteChange', 'symbol field old new')
+
+# attributes watched by default
+FIELDS = tuple([name for name in _QUOTE_SLOTS if name != 'symbol'] +
+               ['restricted', 'dividend_value'])
+
+class QuoteStream:
+    """
+    Poll the quotes of a watchlist and yield their changes.
+    """
+    def __init__(self,
+                 symbols,
+                 interval=60,
+                 fields=FIELDS,
+                 timeout=None,
+                 initial=True,
+                 finder=YahooQuoteFinder):
+        """
+        symbols: watchlist of stock symbols
+        interval: seconds between the start of two refreshes
+                  (default: 60)
+        fields: quote attributes to watch (default: all of them)
+        timeout: seconds to wait for each request (default: no timeout)
+        initial: report the values of the first refresh (default: True)
+        finder: class providing `fetch_many' (default: YahooQuoteFinder)
+        """
+        for field in fields:
+            if field not in FIELDS:
+                raise ValueError("Unknown quote attribute: %s" % field)
+        self.symbols = []
+        for symbol in symbols:
+            self.add(symbol)
+        self.interval = interval
+        self.fields = tuple(fields)
+        self.timeout = timeout
+        self.initial = initial
+        self.finder = finder
+        self.errors = {}     # last error of the symbols that failed
+        self._values = {}    # last values of the watched fields, by symbol
+        self._stopped = False
+
+    def add(self, symbol):
+        """
+        Watch symbol.
+        """
+        if symbol not in self.symbols:
+            self.symbols.append(symbol)
+
+    def remove(self, symbol):
+        """
+        Stop watching symbol.
+        """
+        if symbol in self.symbols:
+            self.symbols.remove(symbol)
+        self._values.pop(symbol, None)
+        self.errors.pop(symbol, None)
+
+    def poll(self):
+        """
+        Refresh the watchlist once and return its QuoteChange list.
+
+        Symbols that could not be looked up keep their previous values
+        and their SymbolError or FeedError is kept in `errors'.
+        """
+        quotes = self.finder.fetch_many(self.symbols, self.timeout,
+                                        fresh=True, fields=self.fields)
+        changes = []
+        for symbol in self.symbols:
+            quote = quotes.get(symbol)
+            if quote is None:
+                continue
+            if isinstance(quote, (SymbolError, FeedError)):
+                self.errors[symbol] = quote
+                continue
+            self.errors.pop(symbol, None)
+
+            values = tuple([getattr(quote, field) for field in self.fields])
+            previous = self._values.get(symbol)
+            self._values[symbol] = values
+            if previous is None:
+                if self.initial:
+                    changes.extend([QuoteChange(symbol, field, None, new)
+                                    for (field, new) in
+                                    zip(self.fields, values)])
+                continue
+            if values == previous:
+                continue
+            for (field, old, new) in zip(self.fields, previous, values):
+                if old != new:
+                    changes.append(QuoteChange(symbol, field, old, new))
+        return changes
+
+    def snapshot(self, symbol):
+        """
+        Return a dictionary of the last values of symbol.
+        """
+        return dict(zip(self.fields, self._values[symbol]))
+
+    def stop(self):
+        """
+        End the iteration after the current refresh.
+        """
+        self._stopped = True
+
+    def __iter__(self):
+        """
+        Refresh the watchlist every `interval' seconds and yield
+        every change, until stop() is called.
+        """
+        self._stopped = False
+        while not self._stopped:
+            start = time.time()
+            for change in self.poll():
+                yield change
+            if self._stopped:
+                break
+            wait = self.interval - (time.time() - start)
+            if wait > 0:
+                time.sleep(wait)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+#
+
+"""
+Coalescing of concurrent identical requests.
+
+When many threads look up the same symbol at the same time, only the
+first one (the leader) sends the request; the others wait for it and
+receive the same result, or the same error. YahooQuoteFinder and
+fetch_many() go through the shared SingleFlight returned by
+get_flights(), keyed by symbol and requested tags.
+
+Example:
+
+    >>> from pystocks.YahooFinance import SingleFlight
+    >>> SingleFlight.get_flights().stats()
+    {'calls': 12, 'leaders': 4, 'coalesced': 8, 'in_flight': 0}
+"""
+
+import threading
+
+__revision__ = "$Id$"
+
+class Flight:
+    """
+    A request in flight.
+    """
+    def __init__(self, key):
+        self.key = key
+        self.result = None
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        """
+        Wait for the leader and return its result, or None if timeout
+        seconds passed.
+        """
+        self._done.wait(timeout)
+        return self.result
+
+    def done(self):
+        return self._done.isSet()
+
+class SingleFlight:
+    """
+    Table of the requests in flight.
+    """
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.leaders = 0
+
+    def claim(self, key):
+        """
+        Return the (Flight, leader) of key. The caller is the leader
+        when no request for key is in flight: it must send the request
+        and give its result (or the error raised) to finish().
+        Otherwise it waits on the Flight.
+        """
+        self._lock.acquire()
+        try:
+            self.calls += 1
+            flight = self._flights.get(key)
+            if flight is not None:
+                return (flight, False)
+            flight = self._flights[key] = Flight(key)
+            self.leaders += 1
+            return (flight, True)
+        finally:
+            self._lock.release()
+
+    def finish(self, flight, result):
+        """
+        Give result to every caller waiting on flight.
+        """
+        self._lock.acquire()
+        try:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+        finally:
+            self._lock.release()
+        flight.result = result
+        flight._done.set()
+
+    def stats(self):
+        """
+        Return a dictionary of the calls made, the calls that sent a
+        request (leaders), the calls that shared a request in flight
+        (coalesced) and the amount of requests in flight.
+        """
+        self._lock.acquire()
+        try:
+            return {'calls': self.calls,
+                    'leaders': self.leaders,
+                    'coalesced': self.calls - self.leaders,
+                    'in_flight': len(self._flights)}
+        finally:
+            self._lock.release()
+
+_flights = SingleFlight()
+
+def get_flights():
+    """
+    Return the SingleFlight shared by all quote lookups.
+    """
+    return _flights
@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+#
+
+"""
+Local stand-in for the Yahoo! Finance quote and chart servers.
+
+Serves recorded quotes (see misc/recorded_quotes.csv) for any `f='
+format string, and made-up daily bars of the recorded symbols for the
+historical prices table, so the pipeline can be load-tested and
+benchmarked without a network. Latency, error rate and the rate of malformed rows
+can be configured; a seed makes a run reproducible.
+
+Example:
+
+    >>> from pystocks.YahooFinance import Transport, StandInServer
+    >>> server = StandInServer.StandInServer(latency=0.05)
+    >>> server.start()
+    >>> previous = Transport.set_transport(server.transport())
+    >>> YahooQuoteFinder('YHOO').last_price
+    25.56
+    >>> server.stop()
+
+It can also be started from the command line:
+
+    $ python StandInServer.py --port 8080 --latency 0.05 --error-rate 0.01
+"""
+
+import os
+import re
+import csv
+import sys
+import time
+import random
+import datetime
+import urlparse
+import threading
+import BaseHTTPServer
+import SocketServer
+
+from pystocks.YahooFinance.Transport import RedirectTransport
+
+__revision__ = "$Id$"
+
+RECORDINGS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "misc", "recorded_quotes.csv")
+
+# tags of a `f=' format string are a letter optionally followed by a digit
+_tag_re = re.compile(r'[a-z][0-9]?')
+_number_re = re.compile(r'^[-+]?[0-9]*\.?[0-9]+$')
+
+# The feed does not quote these and writes them with thousands separators.
+_unquoted_tags = ('j2', 'f6')
+
+# 1x1 transparent gif returned in place of chart images
+CHART_IMAGE = ("GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff"
+               "!\xf9\x04\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01"
+               "\x00\x00\x02\x02D\x01\x00;")
+
+def load_recordings(path=RECORDINGS):
+    """
+    Read recorded quotes.
+
+    The first row of the file lists the tags of every column, each
+    following row is the answer of the feed for one symbol. Rows shorter
+    than the header are served cut short, as the feed sometimes does.
+
+    Returns a (tags, recordings) tuple where recordings maps a symbol to
+    a dictionary of tag values.
+    """
+    f = open(path, "rb")
+    try:
+        reader = csv.reader(f)
+        tags = reader.next()
+        recordings = {}
+        for row in reader:
+            if not row:
+                continue
+            recordings[row[0].upper()] = dict(zip(tags, row))
+    finally:
+        f.close()
+    return (tags, recordings)
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Answer quote (/d), chart (/z) and historical prices (/table.csv)
+    requests from the recordings.
+    """
+    # keep connections alive
+    protocol_version = "HTTP/1.1"
+    # send the headers and body of an answer at once, written line by
+    # line they make every keep-alive request wait for a delayed ACK
+    wbufsize = -1
+
+    def do_GET(self):
+        server = self.server
+        server.delay()
+        if server.fail():
+            self.send_error(503, "Service Unavailable")
+            return
+
+        (scheme, netloc, path, query, fragment) = urlparse.urlsplit(self.path)
+        query = urlparse.parse_qs(query)
+        if path == '/d':
+            tags = _tag_re.findall(query.get('f', [''])[0])
+            symbols = query.get('s', [''])[0].split()
+            lines = [server.render(symbol, tags) for symbol in symbols]
+            self.reply("text/csv", "".join([l + "\r\n" for l in lines]))
+        elif path == '/z':
+            self.reply("image/gif", CHART_IMAGE)
+        elif path == '/table.csv':
+            symbol = query.get('s', [''])[0].upper()
+            if symbol not in server.recordings:
+                self.send_error(404, "Not Found")
+                return
+            def date(year, month, day):
+                return datetime.date(int(query[year][0]),
+                                     int(query[month][0]) + 1,
+                                     int(query[day][0]))
+            self.reply("text/csv", server.history(symbol,
+                                                  date('c', 'a', 'b'),
+                                                  date('f', 'd', 'e')))
+        else:
+            self.send_error(404, "Not Found")
+
+    def reply(self, content_type, body):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format,
+                                                              *args)
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Threaded HTTP server answering like the Yahoo! Finance servers.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self,
+                 address=('127.0.0.1', 0),
+                 recordings=RECORDINGS,
+                 latency=0.0,
+                 jitter=0.0,
+                 error_rate=0.0,
+                 malformed_rate=0.0,
+                 seed=None,
+                 verbose=False):
+        """
+        address: (host, port) to listen on (default: a free local port)
+        recordings: recorded quotes file (default: misc/recorded_quotes.csv)
+        latency: seconds waited before answering each request
+        jitter: up to this many seconds are randomly added to latency
+        error_rate: probability of answering with a 503 error
+        malformed_rate: probability of cutting a quote row short
+        seed: random seed, for reproducible runs
+        verbose: log every request to stderr
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, address, StandInHandler)
+        (self.tags, self.recordings) = load_recordings(recordings)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.verbose = verbose
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def random(self):
+        self._lock.acquire()
+        try:
+            return self._random.random()
+        finally:
+            self._lock.release()
+
+    def delay(self):
+        wait = self.latency
+        if self.jitter:
+            wait += self.random() * self.jitter
+        if wait > 0:
+            time.sleep(wait)
+
+    def fail(self):
+        return self.error_rate > 0 and self.random() < self.error_rate
+
+    def render(self, symbol, tags):
+        """
+        Return the csv line answering `tags' for `symbol'.
+        """
+        symbol = symbol.upper()
+        record = self.recordings.get(symbol, {'s': symbol})
+        items = []
+        for tag in tags:
+            if tag in record:
+                value = record[tag]
+            elif symbol in self.recordings and tag in self.tags:
+                break # recorded row was cut short
+            else:
+                value = 'N/A'
+
+            if tag in _unquoted_tags or value == 'N/A' or (
+                _number_re.match(value)):
+                items.append(value)
+            else:
+                items.append('"%s"' % value.replace('"', '""'))
+
+        if items and self.malformed_rate and (
+            self.random() < self.malformed_rate):
+            items = items[:int(self.random() * len(items))]
+        return ",".join(items)
+
+    def history(self, symbol, start, end):
+        """
+        Return the historical prices table of `symbol' from start to end.
+        The bars are made up around the recorded price, the same ones
+        are returned for a date on every request.
+        """
+        try:
+            base = float(self.recordings[symbol].get('l1', ''))
+        except ValueError:
+            base = 10.0
+        lines = ["Date,Open,High,Low,Close,Volume,Adj Close"]
+        day = end
+        while day >= start:
+            if day.weekday() < 5:
+                r = random.Random("%s%d" % (symbol, day.toordinal()))
+                (o, c) = [base * (0.9 + r.random() * 0.2) for i in range(2)]
+                high = max(o, c) * (1 + r.random() * 0.02)
+                low = min(o, c) * (1 - r.random() * 0.02)
+                lines.append("%s,%.2f,%.2f,%.2f,%.2f,%d,%.2f" % (
+                    day.isoformat(), o, high, low, c,
+                    r.randint(100000, 10000000), c))
+            day -= datetime.timedelta(days=1)
+        return "".join([l + "\n" for l in lines])
+
+    def start(self):
+        """
+        Serve requests from a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop serving requests started with start().
+        """
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def transport(self):
+        """
+        Return a transport sending the feed requests to this server.
+        """
+        (host, port) = self.server_address[:2]
+        return RedirectTransport(host, port)
+
+def main(argv=sys.argv[1:]):
+    from optparse import OptionParser
+
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--host", default="127.0.0.1")
+    parser.add_option("--port", type="int", default=8080)
+    parser.add_option("--recordings", default=RECORDINGS)
+    parser.add_option("--latency", type="float", default=0.0)
+    parser.add_option("--jitter", type="float", default=0.0)
+    parser.add_option("--error-rate", type="float", default=0.0)
+    parser.add_option("--malformed-rate", type="float", default=0.0)
+    parser.add_option("--seed", type="int", default=None)
+    parser.add_option("-v", "--verbose", action="store_true", default=False)
+    (options, args) = parser.parse_args(argv)
+
+    server = StandInServer((options.host, options.port),
+                           options.recordings,
+                           options.latency,
+                           options.jitter,
+                           options.error_rate,
+                           options.malformed_rate,
+                           options.seed,
+                           options.verbose)
+    print "Serving recorded quotes on %s:%d" % server.server_address[:2]
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,504 @@
+#!/usr/bin/env python
+#
+
+"""
+Transports used to download data from the feeds.
+
+Every request made by YahooQuoteFinder and YahooChartFinder goes
+through the transport returned by get_transport(). Transports must
+provide an open(url, timeout=None) methode returning a file-like object
+and raise one of TRANSPORT_ERRORS when the feed can not be reached.
+
+The default transport is a ResilientTransport over a PooledTransport:
+connections to the feeds are kept open and reused for the following
+requests, failed requests are retried with jittered exponential backoff
+within a deadline, and a CircuitBreaker per host makes requests fail at
+once while a feed keeps failing.
+
+Example (send every request to a local stand-in server):
+
+    >>> from pystocks.YahooFinance import Transport
+    >>> Transport.set_transport(Transport.RedirectTransport('127.0.0.1',
+    ...                                                     8080))
+"""
+
+import time
+import random
+import socket
+import httplib
+import urllib2
+import urlparse
+import threading
+import StringIO
+
+from pystocks.YahooFinance import Instrumentation
+
+__revision__ = "$Id$"
+
+# errors raised by transports and the file-like objects they return
+# (urllib2.URLError and socket.error are IOErrors)
+TRANSPORT_ERRORS = (IOError, httplib.HTTPException)
+
+class CircuitOpenError(IOError):
+    """
+    Raised instead of sending a request to a host whose circuit is open.
+    """
+    pass
+
+class Transport:
+    """
+    Base class of all transports.
+    """
+    def open(self, url, timeout=None):
+        """
+        Return a file-like object reading the content of url.
+
+        timeout: seconds to wait for the feed (default: no timeout)
+        """
+        raise NotImplementedError
+
+class UrllibTransport(Transport):
+    """
+    Download with urllib2, directly from the feed.
+    """
+    def open(self, url, timeout=None):
+        if timeout is None:
+            return urllib2.urlopen(url)
+        return urllib2.urlopen(url, timeout=timeout)
+
+class Response(StringIO.StringIO):
+    """
+    Body of a response downloaded by PooledTransport.
+    """
+    def __init__(self, url, code, headers, body):
+        StringIO.StringIO.__init__(self, body)
+        self.url = url
+        self.code = code
+        self.headers = headers
+
+    def geturl(self):
+        return self.url
+
+    def info(self):
+        return self.headers
+
+class ConnectionPool:
+    """
+    Keep-alive HTTP connections, shared by host.
+    """
+    def __init__(self, max_per_host=4, idle_timeout=30, factory=None,
+                 clock=time.time):
+        """
+        max_per_host: maximum amount of connections opened to a host at
+                      the same time, others wait for one to be released
+                      (default: 4)
+        idle_timeout: seconds after which an unused connection is closed
+                      (default: 30)
+        factory: callable taking (scheme, host, port, timeout) and
+                 returning a new connection (default: an httplib
+                 HTTPConnection or HTTPSConnection)
+        clock: callable returning the current time (default: time.time)
+        """
+        if max_per_host < 1:
+            raise ValueError("max_per_host must be positive")
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.factory = factory or _connect
+        self.clock = clock
+        self._idle = {}   # host -> [(connection, last used), ...]
+        self._active = {} # host -> amount of connections in use
+        self._counters = {'opened': 0, 'reused': 0,
+                          'evicted': 0, 'closed': 0, 'waited': 0}
+        self._lock = threading.Condition()
+
+    def get(self, scheme, host, port, timeout=None):
+        """
+        Return a connection to host, opening one if none is idle.
+        """
+        key = (scheme, host, port)
+        self._lock.acquire()
+        try:
+            while True:
+                self._evict(self.clock())
+                idle = self._idle.get(key)
+                if idle:
+                    connection = idle.pop()[0]
+                    self._counters['reused'] += 1
+                    break
+                if self._active.get(key, 0) < self.max_per_host:
+                    connection = None
+                    self._counters['opened'] += 1
+                    break
+                self._counters['waited'] += 1
+                self._lock.wait()
+            self._active[key] = self._active.get(key, 0) + 1
+        finally:
+            self._lock.release()
+
+        if connection is None:
+            try:
+                connection = self.factory(scheme, host, port, timeout)
+            except:
+                self._lock.acquire()
+                try:
+                    self._active[key] -= 1
+                    self._lock.notify()
+                finally:
+                    self._lock.release()
+                raise
+            connection.key = key
+            connection.reused = False
+        else:
+            connection.reused = True
+            if connection.sock is not None:
+                connection.sock.settimeout(timeout)
+        return connection
+
+    def release(self, connection, reusable=True):
+        """
+        Give back a connection obtained with get(). Connections
+        that are not reusable are closed.
+        """
+        self._lock.acquire()
+        try:
+            key = connection.key
+            self._active[key] -= 1
+            if reusable and connection.sock is not None:
+                self._idle.setdefault(key, []).append((connection,
+                                                       self.clock()))
+            else:
+                connection.close()
+                self._counters['closed'] += 1
+            self._lock.notify()
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """
+        Close every idle connection.
+        """
+        self._lock.acquire()
+        try:
+            for idle in self._idle.values():
+                for (connection, used) in idle:
+                    connection.close()
+                    self._counters['closed'] += 1
+            self._idle = {}
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        """
+        Return a dictionary of the connection counters.
+
+        opened: connections opened
+        reused: requests sent over an already opened connection
+        evicted: connections closed after being idle too long
+        closed: connections closed
+        waited: times a request waited for the per-host limit
+        idle: connections currently idle
+        active: connections currently in use
+        """
+        self._lock.acquire()
+        try:
+            stats = dict(self._counters)
+            stats['idle'] = sum([len(i) for i in self._idle.values()])
+            stats['active'] = sum(self._active.values())
+            return stats
+        finally:
+            self._lock.release()
+
+    def _evict(self, now):
+        for (key, idle) in self._idle.items():
+            while idle and idle[0][1] + self.idle_timeout <= now:
+                idle.pop(0)[0].close()
+                self._counters['evicted'] += 1
+                self._counters['closed'] += 1
+
+def _connect(scheme, host, port, timeout):
+    if scheme == 'https':
+        return httplib.HTTPSConnection(host, port, timeout=timeout)
+    return httplib.HTTPConnection(host, port, timeout=timeout)
+
+class PooledTransport(Transport):
+    """
+    Download over keep-alive connections from a ConnectionPool.
+    """
+    max_redirects = 5
+
+    def __init__(self, pool=None):
+        """
+        pool: ConnectionPool to use (default: a new pool)
+        """
+        self.pool = pool or ConnectionPool()
+
+    def open(self, url, timeout=None):
+        for redirect in range(self.max_redirects + 1):
+            response = self._request(url, timeout)
+            if response.status in (301, 302, 303, 307):
+                url = urlparse.urljoin(url, response.getheader('location'))
+                continue
+            if response.status != 200:
+                raise urllib2.HTTPError(url, response.status,
+                                        response.reason, response.msg,
+                                        None)
+            return Response(url, response.status, response.msg,
+                            response.body)
+        raise urllib2.URLError("Too many redirects: %s" % url)
+
+    def _request(self, url, timeout):
+        parts = urlparse.urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise urllib2.URLError("Unsupported scheme: %s" % parts.scheme)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        while True:
+            connection = self.pool.get(parts.scheme, parts.hostname,
+                                       parts.port, timeout)
+            try:
+                connection.request("GET", path)
+                response = connection.getresponse()
+                response.body = response.read()
+            except (httplib.HTTPException, socket.error), e:
+                self.pool.release(connection, False)
+                # the feed may close an idle connection at any time,
+                # retry once on a new connection
+                if connection.reused:
+                    continue
+                if isinstance(e, socket.error):
+                    raise urllib2.URLError(e)
+                raise
+            except:
+                self.pool.release(connection, False)
+                raise
+            self.pool.release(connection, not response.will_close)
+            return response
+
+class RedirectTransport(Transport):
+    """
+    Send every request to another host, keeping the path and query.
+    """
+    def __init__(self, host, port=80, transport=None):
+        """
+        host: host receiving the requests
+        port: port receiving the requests (default: 80)
+        transport: transport used for the redirected requests
+                   (default: a new PooledTransport)
+        """
+        self.host = host
+        self.port = port
+        self.transport = transport or PooledTransport()
+
+    def open(self, url, timeout=None):
+        return self.transport.open(self.rewrite(url), timeout)
+
+    def rewrite(self, url):
+        (scheme, netloc, path, query, fragment) = urlparse.urlsplit(url)
+        netloc = "%s:%d" % (self.host, self.port)
+        return urlparse.urlunsplit(("http", netloc, path, query, fragment))
+
+class CircuitBreaker:
+    """
+    Stop sending requests to a failing host.
+
+    After `threshold' consecutive failures the circuit opens and requests
+    are refused for `reset_timeout' seconds. A single request is then let
+    through (half-open): its success closes the circuit, its failure
+    opens it again.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold=5, reset_timeout=30, clock=time.time):
+        """
+        threshold: consecutive failures opening the circuit (default: 5)
+        reset_timeout: seconds the circuit stays open (default: 30)
+        clock: callable returning the current time (default: time.time)
+        """
+        if threshold < 1:
+            raise ValueError("threshold must be positive")
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Return True if a request may be sent.
+        """
+        self._lock.acquire()
+        try:
+            if self.state == self.CLOSED:
+                return True
+            if (self.state == self.OPEN and
+                self.clock() - self.opened >= self.reset_timeout):
+                self.state = self.HALF_OPEN
+                return True
+            return False # open, or the half-open trial is in flight
+        finally:
+            self._lock.release()
+
+    def success(self):
+        self._lock.acquire()
+        try:
+            self.state = self.CLOSED
+            self.failures = 0
+        finally:
+            self._lock.release()
+
+    def failure(self):
+        self._lock.acquire()
+        try:
+            self.failures += 1
+            if (self.state == self.HALF_OPEN or
+                self.failures >= self.threshold):
+                if self.state != self.OPEN and Instrumentation.enabled:
+                    Instrumentation.count('feed.circuit.opened')
+                self.state = self.OPEN
+                self.opened = self.clock()
+        finally:
+            self._lock.release()
+
+class ResilientTransport(Transport):
+    """
+    Retry failed requests and break the circuit of failing hosts.
+    """
+    def __init__(self,
+                 transport=None,
+                 retries=2,
+                 backoff=0.2,
+                 max_backoff=2.0,
+                 timeout=10,
+                 deadline=20,
+                 threshold=5,
+                 reset_timeout=30,
+                 clock=time.time,
+                 sleep=time.sleep):
+        """
+        transport: transport sending the requests
+                   (default: a new PooledTransport)
+        retries: requests sent again after a failure (default: 2)
+        backoff: seconds the delay before a retry is drawn below,
+                 doubled at every retry (default: 0.2)
+        max_backoff: longest delay before a retry (default: 2)
+        timeout: seconds to wait for the feed when open() is given
+                 no timeout (default: 10)
+        deadline: seconds after which a request is not retried, the
+                  timeout of every retry is cut to what is left
+                  (default: 20)
+        threshold, reset_timeout, clock: see CircuitBreaker
+        sleep: callable waiting before a retry (default: time.sleep)
+        """
+        self.transport = transport or PooledTransport()
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.deadline = deadline
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.sleep = sleep
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def open(self, url, timeout=None):
+        host = urlparse.urlsplit(url)[1]
+        breaker = self.breaker(host)
+        if timeout is None:
+            timeout = self.timeout
+        stop = self.clock() + self.deadline
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                if Instrumentation.enabled:
+                    Instrumentation.count('feed.circuit.refused')
+                raise CircuitOpenError("Circuit open for %s" % host)
+            try:
+                f = self.transport.open(url, min(timeout,
+                                                 stop - self.clock()))
+            except TRANSPORT_ERRORS, e:
+                if not _retryable(e):
+                    breaker.success() # the host answered
+                    raise
+                breaker.failure()
+                attempt += 1
+                # full jitter: clients retrying together do not all
+                # come back at the same time
+                delay = random.uniform(0, min(self.max_backoff,
+                                              self.backoff * 2 ** attempt))
+                if attempt > self.retries or self.clock() + delay >= stop:
+                    raise
+                if Instrumentation.enabled:
+                    Instrumentation.count('feed.retries')
+                self.sleep(delay)
+                continue
+            except:
+                breaker.failure() # never leave a half-open circuit stuck
+                raise
+            breaker.success()
+            return f
+
+    def breaker(self, host):
+        """
+        Return the CircuitBreaker of host.
+        """
+        self._lock.acquire()
+        try:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = self._breakers[host] = CircuitBreaker(
+                    self.threshold, self.reset_timeout, self.clock)
+            return breaker
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        """
+        Return a dictionary of the (state, consecutive failures) of the
+        circuit of every host.
+        """
+        self._lock.acquire()
+        try:
+            return dict([(host, (breaker.state, breaker.failures))
+                         for (host, breaker) in self._breakers.items()])
+        finally:
+            self._lock.release()
+
+def _retryable(error):
+    """
+    Return True if the request failing with error may succeed if it is
+    sent again: the feed could not be reached, timed out or failed.
+    """
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, urllib2.HTTPError):
+        return error.code >= 500 or error.code == 429
+    return True
+
+_transport = ResilientTransport(PooledTransport())
+
+def get_transport():
+    """
+    Return the transport used by all feed requests.
+    """
+    return _transport
+
+def set_transport(transport):
+    """
+    Replace the transport used by all feed requests.
+
+    Returns the previous transport.
+    """
+    global _transport
+    if not hasattr(transport, 'open'):
+        raise ValueError("transport must provide an `open' methode")
+    previous = _transport
+    _transport = transport
+    return previous
@@ -3,12 +3,59 @@
 # http://pystocks.berlios.de/
 #
 
-import urllib2
+import urllib
+import time
 import csv
 import re
 
+from pystocks.YahooFinance import Instrumentation
+from pystocks.YahooFinance.Transport import get_transport, TRANSPORT_ERRORS
+from pystocks.YahooFinance.QuoteCache import get_cache
+from pystocks.YahooFinance.SingleFlight import get_flights
+
 __revision__ = "$Id$"
 
+# 44 stock & quotation attributes, see misc/YahooFinanceDataVariables.lst
+QUOTE_FORMAT = ("snl1d1t1c1p2va2bapomwerr1dyj1xs7t8e7e8e9r6r7r5b4p6p5j4m3m4"
+                "b2b3k2k1c6m2j3q")
+
+# The outstanding (j2) and float (f6) shares are not quoted by the feed
+# and their thousands separators make csv split them in several items.
+# The symbol (s) is requested in between them to mark where one ends and
+# the other begins.
+FUNDAMENTALS_FORMAT = "j2sf6"
+
+# tags of the attributes of a parsed quote row, in order
+QUOTE_TAGS = re.findall('[a-z][0-9]?', QUOTE_FORMAT) + ['j2', 'f6']
+
+QUOTE_URL = "http://quote.yahoo.com/d?f=%s&s=%s"
+
+# The feed refuses requests with more symbols than this or with URLs
+# longer than what its front-end accepts.
+MAX_SYMBOLS_PER_REQUEST = 200
+MAX_URL_LENGTH = 2000
+
+_sgml_re = re.compile('<[^>]*>')
+
+class NotAvailable(object):
+    """
+    Value of the attributes the feed does not provide (`N/A').
+    """
+    __slots__ = ()
+
+    def __nonzero__(self):
+        return False
+
+    def __repr__(self):
+        return 'N/A'
+
+    __str__ = __repr__
+
+    def __reduce__(self):
+        return 'NA'
+
+NA = NotAvailable()
+
 class FeedError(Exception):
     pass
 
@@ -189,19 +236,260 @@ class YahooChartFinder:
                 ) and (key not in self._overlays):
                 raise ValueError("Invalid attribute: %s" % key)
         
+    def download(self, timeout=None):
+        """
+        Download the chart image and return it as a string.
+
+        timeout: seconds to wait for the request (default: no timeout)
+        """
+        try:
+            f = get_transport().open(self._build_url(), timeout)
+            try:
+                return f.read()
+            finally:
+                f.close()
+        except TRANSPORT_ERRORS, e:
+            raise FeedError("Could not fetch chart: %s" % self.symbol)
+
     def __repr__(self):
         return self._build_url()
 
     __str__ = __repr__
         
-class YahooQuoteFinder:
+def _text(value):
+    return value
+
+def _number(value):
+    return float(value)
+
+def _integer(value):
+    return int(value)
+
+def _percent(value):
+    return float(value.rstrip('%'))
+
+_magnitudes = {'K': 1e3, 'M': 1e6, 'B': 1e9, 'T': 1e12}
+
+def _magnitude(value):
+    """
+    Convert numbers like 35.46B to floats.
+    """
+    if value[-1] in _magnitudes:
+        return float(value[:-1]) * _magnitudes[value[-1]]
+    return float(value)
+
+def _pair(first, second):
+    """
+    Return a converter splitting `a - b' values in two.
+    """
+    def convert(value):
+        (a, b) = value.split(' - ', 1)
+        a = a.strip()
+        b = b.strip()
+        if a == 'N/A':
+            a = NA
+        else:
+            a = first(a)
+        if b == 'N/A':
+            b = NA
+        else:
+            b = second(b)
+        return (a, b)
+    return convert
+
+_range = _pair(_number, _number)
+
+# Attributes set from every column of a quote row (see QUOTE_TAGS), with
+# the converter of the column. Columns holding two values set a pair of
+# attributes, None drops a value.
+_QUOTE_FIELDS = (
+    ('symbol', _text),                                            # s
+    ('company', _text),                                           # n
+    ('last_price', _number),                                      # l1
+    ('last_trade_date', _text),                                   # d1
+    ('last_trade_time', _text),                                   # t1
+    ('change_cash', _number),                                     # c1
+    ('change_percent', _percent),                                 # p2
+    ('volume_daily', _integer),                                   # v
+    ('volume_average', _integer),                                 # a2
+    ('bid', _number),                                             # b
+    ('ask', _number),                                             # a
+    ('p_close', _number),                                         # p
+    ('l_close', _number),                                         # o
+    (('day_low', 'day_hi'), _range),                              # m
+    (('year_low', 'year_hi'), _range),                            # w
+    ('EPS', _number),                                             # e
+    ('PE', _number),                                              # r
+    ('dividend_pay_date', _text),                                 # r1
+    ('dividend_per_share', _number),                              # d
+    ('dividend_yeild', _number),                                  # y
+    ('capital', _magnitude),                                      # j1
+    ('exchange', _text),                                          # x
+    ('short_ratio', _number),                                     # s7
+    ('target_52w', _number),                                      # t8
+    ('EPS_est_current_year', _number),                            # e7
+    ('EPS_est_next_year', _number),                               # e8
+    ('EPS_est_next_quarter', _number),                            # e9
+    ('price_EPS_est_current_year', _number),                      # r6
+    ('price_EPS_est_next_year', _number),                         # r7
+    ('PEG', _number),                                             # r5
+    ('book_value', _number),                                      # b4
+    ('price_book', _number),                                      # p6
+    ('price_sales', _number),                                     # p5
+    ('EBITDA', _magnitude),                                       # j4
+    ('average_move_d50', _number),                                # m3
+    ('average_move_d200', _number),                               # m4
+    ('realtime_ask', _number),                                    # b2
+    ('realtime_bid', _number),                                    # b3
+    ((None, 'realtime_change_percent'), _pair(_text, _percent)),  # k2
+    (('realtime_last_trade_date',
+      'realtime_last_trade_price'), _pair(_text, _number)),       # k1
+    ('realtime_change_cash', _number),                            # c6
+    (('realtime_day_low', 'realtime_day_high'), _range),          # m2
+    ('realtime_capital', _magnitude),                             # j3
+    ('dividend_previous', _text),                                 # q
+    ('outstanding', _integer),                                    # j2
+    ('float', _integer),                                          # f6
+)
+
+def _compile_fields(fields):
+    """
+    Return the (names, converter, pair) parsers and the attribute
+    names of fields.
+    """
+    parsers = []
+    slots = []
+    for (names, convert) in fields:
+        pair = type(names) is tuple
+        parsers.append((names, convert, pair))
+        if pair:
+            slots.extend([name for name in names if name])
+        else:
+            slots.append(names)
+    return (parsers, slots)
+
+(_QUOTE_PARSERS, _QUOTE_SLOTS) = _compile_fields(_QUOTE_FIELDS)
+
+# parser of every tag
+_TAG_PARSERS = dict(zip(QUOTE_TAGS, _QUOTE_PARSERS))
+
+# tags downloaded together when one of their attributes is first used
+FIELD_GROUPS = {
+    'basic': ('s', 'n', 'l1', 'd1', 't1', 'c1', 'p2', 'v', 'a2', 'b', 'a',
+              'p', 'o', 'm', 'w', 'e', 'r', 'r1', 'd', 'y', 'j1', 'x', 'q'),
+    'extended': ('s7', 't8', 'e7', 'e8', 'e9', 'r6', 'r7', 'r5', 'b4', 'p6',
+                 'p5', 'j4', 'm3', 'm4'),
+    'realtime': ('b2', 'b3', 'k2', 'k1', 'c6', 'm2', 'j3'),
+    'fundamental': ('j2', 'f6'),
+}
+
+# attributes computed from the value of other tags
+_DERIVED_TAGS = {
+    'restricted': ('j2', 'f6'),
+    'dividend_value': ('d', 'y'),
+}
+
+def _field_tags():
+    """
+    Return the tags needed by every attribute and the tags of the
+    group every attribute is loaded with.
+    """
+    groups = {}
+    for tags in FIELD_GROUPS.values():
+        for tag in tags:
+            groups[tag] = tags
+    needed = dict(_DERIVED_TAGS)
+    for (tag, (names, convert, pair)) in _TAG_PARSERS.items():
+        if not pair:
+            names = (names,)
+        for name in names:
+            if name:
+                needed[name] = (tag,)
+    lazy = {}
+    for (name, tags) in needed.items():
+        if name == 'symbol':
+            continue # always downloaded
+        group = []
+        for tag in tags:
+            group.extend(groups[tag])
+        lazy[name] = tuple(group)
+    return (needed, lazy)
+
+(_FIELD_TAGS, _LAZY_TAGS) = _field_tags()
+
+def _projection(fields):
+    """
+    Return the tags to request for fields, a list of attribute and
+    FIELD_GROUPS names, in feed order. None is every tag.
+    """
+    if fields is None:
+        return _ALL_TAGS
+    tags = []
+    for field in fields:
+        if field in FIELD_GROUPS:
+            tags.extend(FIELD_GROUPS[field])
+        elif field in _FIELD_TAGS:
+            tags.extend(_FIELD_TAGS[field])
+        else:
+            raise ValueError("Unknown quote attribute: %s" % field)
+    return _request_tags(tags)
+
+def _request_tags(tags):
+    """
+    Return the tags of a request obtaining tags, in feed order.
+    """
+    wanted = {'s': True, 'v': True} # symbol, and volume to validate it
+    for tag in tags:
+        wanted[tag] = True
+    if 'j2' in wanted or 'f6' in wanted:
+        # obtained together, see FUNDAMENTALS_FORMAT
+        wanted['j2'] = wanted['f6'] = True
+    return tuple([tag for tag in QUOTE_TAGS if tag in wanted])
+
+_ALL_TAGS = tuple(QUOTE_TAGS)
+
+_layouts = {}
+
+def _layout(tags):
+    """
+    Return the (format string, parsers, position of the volume,
+    amount of columns before the fundamentals or None) of a request
+    of tags.
+    """
+    layout = _layouts.get(tags)
+    if layout is None:
+        regular = [tag for tag in tags if tag not in ('j2', 'f6')]
+        format = "".join(regular)
+        joined = None
+        if len(regular) < len(tags):
+            format += FUNDAMENTALS_FORMAT
+            joined = len(regular)
+        layout = (format, [_TAG_PARSERS[tag] for tag in tags],
+                  tags.index('v'), joined)
+        _layouts[tags] = layout
+    return layout
+
+class YahooQuoteFinder(object):
     """
     Find stocks quotes from over 50 worldwide exanges.
     """
+    __slots__ = tuple(_QUOTE_SLOTS) + ('url',
+                                       'restricted',
+                                       'dividend_value',
+                                       '_tags')
 
-    def __init__(self, symbol):
+    def __init__(self, symbol, fields=None):
         """
         Download stock's attributes and attribute them to this object.
+
+        fields: attributes to download, attribute names (e.g.
+                'last_price') or FIELD_GROUPS names ('basic',
+                'extended', 'realtime' and 'fundamental')
+                (default: all of them)
+
+        When fields are given, only their tags are requested; the other
+        attributes are downloaded, with the rest of their group, the
+        first time they are used.
         
         * Basic attributes:
 
@@ -294,6 +582,12 @@ class YahooQuoteFinder:
             restricted: amount of shares not on the market
             float: amount of shares on the market
 
+        Prices, ratios and volumes are numbers, dates and names are
+        strings. Attributes the feed does not provide are set to NA.
+
+        Every value of the dictionaries above is also available as a
+        flat attribute, e.g. last_trade_date, day_hi or realtime_bid.
+
         Example:
 
             >>> YHOO = YahooQuoteFinder('YHOO')
@@ -301,173 +595,458 @@ class YahooQuoteFinder:
             'YHOO'
             >>> YHOO.realtime['last_trade']['date']
             'Dec 23'
-            >>>
+            >>> YHOO.range['day']['hi']
+            26.05
+            >>> YahooQuoteFinder('YHOO', ['last_price']).last_price
+            25.56
         """
         self.symbol = symbol
-        
-        # request of 44 stock & quotation attributes
-        self.url = ("http://quote.yahoo.com/d?f=snl1d1t1c1p2va2bapomwerr1dyj"
-                    "1xs7t8e7e8e9r6r7r5b4p6p5j4m3m4b2b3k2k1c6m2j3q&s=%s" %
-                    symbol)
+        self._tags = ()
+        tags = _projection(fields)
+        self.url = self._build_url([symbol], tags)
+        self._load(tags)
 
+    def _load(self, tags):
+        """
+        Download (or find in the cache) the tags of this quote.
+        """
+        # the feed may echo the symbol in another case
+        symbol = self.symbol
+        values = self._cached(symbol, tags)
+        if values is not None:
+            self._set(values, tags)
+            return
+
+        data = self._fetch_data([symbol], tags)[symbol]
+        if isinstance(data, Exception):
+            raise data
+        self._cache(symbol, self._parse(data, tags), tags)
+
+    def __getattr__(self, name):
+        """
+        Download the group of an attribute that was not requested.
+        """
+        tags = _LAZY_TAGS.get(name)
+        if tags is None:
+            raise AttributeError(name)
         try:
-            f = urllib2.urlopen(self.url)
-        except urllib2.URLError, e:
-            raise FeedError("Could not fetch stocks attributes")
+            loaded = self._tags
+        except AttributeError:
+            raise AttributeError(name) # nothing was downloaded yet
+        missing = [tag for tag in tags if tag not in loaded]
+        if not missing:
+            raise AttributeError(name)
+        self._load(_request_tags(missing))
+        return object.__getattribute__(self, name)
+
+    def fetch_many(cls, symbols, timeout=None, fresh=False, fields=None):
+        """
+        Download the attributes of many stocks at once.
+
+        symbols: list of stock symbols
+        timeout: seconds to wait for each request (default: no timeout)
+        fresh: download every symbol, even when its attributes are
+               cached (default: False)
+        fields: attributes to download, see __init__ (default: all)
+
+        The symbols are packed in as few requests as the feed allows
+        and the fundamental attributes are obtained in the same
+        round-trip.
+
+        Returns a dictionary mapping every requested symbol to its
+        quote object. Symbols that could not be looked up map to the
+        SymbolError (invalid symbol) or FeedError (feed unavailable,
+        malformed data) instance describing the failure instead.
+
+        Example:
+
+            >>> quotes = YahooQuoteFinder.fetch_many(['YHOO', 'GOOG'])
+            >>> quotes['GOOG'].last_price
+            455.58
+        """
+        tags = _projection(fields)
+        quotes = {}
+        missing = []
+        for symbol in symbols:
+            if fresh:
+                values = None
+            else:
+                values = cls._cached(symbol, tags)
+            if values is None:
+                missing.append(symbol)
+                continue
+            quote = cls.__new__(cls)
+            quote.symbol = symbol
+            quote.url = cls._build_url([symbol], tags)
+            quote._set(values, tags)
+            quotes[symbol] = quote
+
+        for (symbol, data) in cls._fetch_data(missing, tags,
+                                              timeout).items():
+            if isinstance(data, Exception):
+                quotes[symbol] = data
+                continue
+            quote = cls.__new__(cls)
+            quote.symbol = symbol
+            quote.url = cls._build_url([symbol], tags)
+            try:
+                values = quote._parse(data, tags)
+            except (SymbolError, FeedError), e:
+                quote = e
+            else:
+                cls._cache(symbol, values, tags)
+            quotes[symbol] = quote
+        return quotes
+
+    fetch_many = classmethod(fetch_many)
 
+    def _fetch_data(cls, symbols, tags, timeout=None):
+        """
+        Download the rows of tags of symbols.
 
-        # read the csv file, create the list of our attributes
-        # and remove unwanted sgml tags
-        reader = csv.reader(f)
-        for l in reader: self.data = l
-        for (pos, item) in enumerate(self.data):
-            self.data[pos] = re.sub ('<[^>]*>', '', self.data[pos])
+        Symbols already being downloaded by another thread with the
+        same tags are not requested again: their row is waited for
+        (see SingleFlight).
 
+        Returns a dictionary mapping every symbol to its row, or to the
+        FeedError describing why it could not be downloaded.
+        """
+        flights = get_flights()
+        leading = []
+        waiting = {}
+        for symbol in symbols:
+            if symbol in waiting:
+                continue
+            (flight, leader) = flights.claim((symbol, tags))
+            waiting[symbol] = flight
+            if leader:
+                leading.append(symbol)
+        if Instrumentation.enabled and len(waiting) > len(leading):
+            Instrumentation.count('quote.coalesced',
+                                  len(waiting) - len(leading))
+
+        try:
+            for chunk in cls._chunk(leading, tags):
+                url = cls._build_url(chunk, tags)
+                try:
+                    rows = cls._fetch_rows(url, timeout, tags)
+                except TRANSPORT_ERRORS, e:
+                    rows = None
+
+                # rows are matched by the symbol they echo: the feed
+                # leaves some symbols out instead of answering N/A
+                found = {}
+                if rows is not None:
+                    column = tags.index('s')
+                    for row in rows:
+                        if len(row) > column:
+                            found.setdefault(row[column].strip().upper(),
+                                             row)
+                for symbol in chunk:
+                    if rows is None:
+                        data = FeedError("Could not fetch stocks"
+                                         " attributes: %s" % symbol)
+                    else:
+                        data = found.get(symbol.upper())
+                        if data is None:
+                            data = FeedError("No data returned for: %s" %
+                                             symbol)
+                    flights.finish(waiting[symbol], data)
+        finally:
+            for symbol in leading:
+                if not waiting[symbol].done():
+                    flights.finish(waiting[symbol],
+                                   FeedError("Could not fetch stocks"
+                                             " attributes: %s" % symbol))
+
+        results = {}
+        for (symbol, flight) in waiting.items():
+            data = flight.wait(timeout)
+            if data is None:
+                data = FeedError("Timed out waiting for: %s" % symbol)
+            results[symbol] = data
+        return results
+
+    _fetch_data = classmethod(_fetch_data)
+
+    def _chunk(cls, symbols, tags=_ALL_TAGS):
+        """
+        Split symbols in lists small enough for a single request.
+        Duplicates are only requested once.
+        """
+        chunk = []
+        length = len(cls._build_url([], tags))
+        seen = {}
+        for symbol in symbols:
+            if symbol in seen:
+                continue
+            seen[symbol] = True
+
+            size = len(urllib.quote(symbol)) + 1
+            if chunk and (len(chunk) >= MAX_SYMBOLS_PER_REQUEST or
+                          length + size > MAX_URL_LENGTH):
+                yield chunk
+                chunk = []
+                length = len(cls._build_url([], tags))
+            chunk.append(symbol)
+            length += size
+        if chunk:
+            yield chunk
+
+    _chunk = classmethod(_chunk)
+
+    def _build_url(cls, symbols, tags=_ALL_TAGS):
+        return QUOTE_URL % (_layout(tags)[0],
+                            "+".join([urllib.quote(s) for s in symbols]))
+
+    _build_url = classmethod(_build_url)
+
+    def _cached(cls, symbol, tags=_ALL_TAGS):
+        """
+        Return the cached values of the tags of symbol, as returned by
+        _parse(), or None.
+        """
+        cache = get_cache()
+        if cache is None:
+            return None
+        values = cache.get_many(symbol.upper(), tags)
+        if Instrumentation.enabled:
+            if values is None:
+                Instrumentation.count('quote.cache.misses')
+            else:
+                Instrumentation.count('quote.cache.hits')
+        return values
+
+    _cached = classmethod(_cached)
+
+    def _cache(cls, symbol, values, tags=_ALL_TAGS):
+        """
+        Cache the values of the tags of symbol returned by _parse().
+        """
+        cache = get_cache()
+        if cache is not None:
+            cache.set_many(symbol.upper(), tags, values)
+
+    _cache = classmethod(_cache)
+
+    def _fetch_rows(cls, url, timeout=None, tags=_ALL_TAGS):
+        """
+        Download url, a request of tags, and return its csv rows.
+        """
+        joined = _layout(tags)[3]
+        start = Instrumentation.enabled and time.time()
+        f = get_transport().open(url, timeout)
+        try:
+            body = f.read()
+        finally:
+            f.close()
+        if start:
+            parsing = time.time()
+            Instrumentation.count('feed.requests')
+            Instrumentation.count('feed.bytes', len(body))
+            Instrumentation.observe('feed.request', parsing - start)
+
+        rows = []
+        for row in csv.reader(body.splitlines()):
+            if not row:
+                continue
+            if joined is not None:
+                row = _join_fundamentals(row, joined)
+            rows.append(row)
+        if start:
+            Instrumentation.observe('quote.csv', time.time() - parsing)
+        return rows
+
+    _fetch_rows = classmethod(_fetch_rows)
+
+    def _parse(self, data, tags=_ALL_TAGS):
+        """
+        Set this object's attributes from a row of the feed, a request
+        of tags, in a single pass.
+
+        Returns the typed value of every tag, NA when the feed does not
+        provide it and a pair of values for the columns holding two,
+        as kept in the quote cache. Raises a FeedError when the row is
+        cut short or holds a value of the wrong type.
+        """
+        (format, parsers, volume, joined) = _layout(tags)
+        if len(data) < len(parsers):
+            raise FeedError("Malformed data for %s: expected %d attributes,"
+                            " got %d" % (self.symbol, len(parsers),
+                                         len(data)))
         # If the volume of shares is not available,
         # it is an invalid symbol
-        if self.data[7] == 'N/A':
-            raise SymbolError("Invalid symbol: %s" % symbol)
+        if data[volume] == 'N/A':
+            raise SymbolError("Invalid symbol: %s" % self.symbol)
+        start = Instrumentation.enabled and time.time()
+
+        values = []
+        for ((names, convert, pair), value) in zip(parsers, data):
+            if '<' in value:
+                value = _sgml_re.sub('', value)
+                if start:
+                    Instrumentation.count('quote.stripped')
+            if value != 'N/A':
+                try:
+                    values.append(convert(value))
+                except ValueError, e:
+                    raise FeedError("Malformed data for %s: %s" %
+                                    (self.symbol, e))
+            elif pair:
+                values.append((NA, NA))
+            else:
+                values.append(NA)
+        self._set(values, tags)
+        if start:
+            Instrumentation.observe('quote.parse', time.time() - start)
+        return values
 
-        
+    def _set(self, values, tags=_ALL_TAGS):
         """
-        Basic Attributes
+        Set this object's attributes from the values of tags returned
+        by _parse().
         """
+        parsers = _layout(tags)[1]
+        for ((names, convert, pair), value) in zip(parsers, values):
+            if not pair:
+                setattr(self, names, value)
+                continue
+            for (name, value) in zip(names, value):
+                if name:
+                    setattr(self, name, value)
+
+        try:
+            loaded = self._tags
+        except AttributeError:
+            loaded = ()
+        if tags is not _ALL_TAGS:
+            tags = loaded + tuple([t for t in tags if t not in loaded])
+        self._tags = tags
+
+        # restricted is generated on the fly
+        if 'j2' not in tags or 'f6' not in tags:
+            pass
+        elif self.outstanding is NA or self.float is NA:
+            self.restricted = NA
+        else:
+            self.restricted = self.outstanding - self.float
 
-        (self.symbol, self.company, self.last_price) = self.data[:3]
+        # We might be able to calculate the historical price
+        # if there isn't a variable set to 'N/A'.
+        if 'd' not in tags or 'y' not in tags:
+            pass
+        elif self.dividend_per_share is not NA and self.dividend_yeild:
+            self.dividend_value = (self.dividend_per_share * 100 /
+                                   self.dividend_yeild)
+        else:
+            self.dividend_value = NA
+
+    """
+    Basic Attributes
+    """
 
+    def _get_last_trade(self):
         # date, time
-        self.last_trade = {
-            'date': self.data[3],
-            'time': self.data[4]
-        }
+        return {'date': self.last_trade_date,
+                'time': self.last_trade_time}
+
+    last_trade = property(_get_last_trade)
 
+    def _get_change(self):
         # money change, percent change
-        self.change = {
-            'cash': self.data[5],
-            'percent': self.data[6]
-        }
+        return {'cash': self.change_cash,
+                'percent': self.change_percent}
+
+    change = property(_get_change)
 
+    def _get_volume(self):
         # total volume, average daily volume
-        self.volume = {
-            'daily': self.data[7],
-            'average': self.data[8]
-        }
+        return {'daily': self.volume_daily,
+                'average': self.volume_average}
 
-        # company value, share bid, share ask,
-        #  previous close, last close
-        self.value = {
-            'bid': self.data[9],
-            'ask': self.data[10],
-            'p_close': self.data[11],
-            'l_close': self.data[12]
-        }
+    volume = property(_get_volume)
 
-        # day range, 52weeks range
-        self.range = {
-            'day': {'hi': self.data[13].split(' - ')[1],
-                    'low': self.data[13].split(' - ')[0],
-            },
-            'year': {'hi': self.data[14].split(' - ')[1],
-                     'low': self.data[14].split(' - ')[0]
-            }
-        }
-        
-        (self.EPS, self.PE) = (self.data[15], self.data[16])
+    def _get_value(self):
+        # share bid, share ask, previous close, last close
+        return {'bid': self.bid,
+                'ask': self.ask,
+                'p_close': self.p_close,
+                'l_close': self.l_close}
 
-        # div pay date, div per share, div yeild
-        self.dividend = {
-            'pay_date': self.data[17],
-            'per_share': self.data[18],
-            'yeild': self.data[19],
-            'previous': self.data[43],
-            'value': None
-        }
-        # We might be able to calculate the historical price
-        # if there isn't a variable set to 'N/A'. If we can't
-        # obtain it, we'll set the value to 'N/A' as well.
-        try:
-            value = (float(self.dividend["per_share"]) * 100 /
-                     float(self.dividend["yeild"]))
-        except TypeError:
-            value = 'N/A'
-        except ValueError:
-            value = 'N/A'
-        self.dividend['value'] = value
+    value = property(_get_value)
 
+    def _get_range(self):
+        # day range, 52weeks range
+        return {'day': {'hi': self.day_hi, 'low': self.day_low},
+                'year': {'hi': self.year_hi, 'low': self.year_low}}
 
-        (self.capital, self.exchange) = (self.data[20], self.data[21])
+    range = property(_get_range)
 
-        
-        """
-        Extended Attributes
-        """
+    def _get_dividend(self):
+        # div pay date, div per share, div yeild
+        return {'pay_date': self.dividend_pay_date,
+                'per_share': self.dividend_per_share,
+                'yeild': self.dividend_yeild,
+                'previous': self.dividend_previous,
+                'value': self.dividend_value}
 
-        (self.short_ratio,
-         self.target_52w) = self.data[22:24]
-        
-        # estimate EPS - current year, next year, next quarter
-        self.EPS_est = {
-            'current_year': self.data[24],
-            'next_year': self.data[25],
-            'next_quarter': self.data[26]
-        }
-        
-        # estimate price and EPS
-        self.price_EPS_est = {
-            'current_year': self.data[27],
-            'next_year': self.data[28],
-            'next_quarter': self.data[29]
-        }
+    dividend = property(_get_dividend)
 
-        (self.PEG,
-         self.book_value,
-         self.price_book,
-         self.price_sales,
-         self.EBITDA) = self.data[29:34]
+    """
+    Extended Attributes
+    """
 
-        self.average_move = {
-            'd50': self.data[34],
-            'd200': self.data[35]
-        }
+    def _get_EPS_est(self):
+        # estimate EPS - current year, next year, next quarter
+        return {'current_year': self.EPS_est_current_year,
+                'next_year': self.EPS_est_next_year,
+                'next_quarter': self.EPS_est_next_quarter}
 
+    EPS_est = property(_get_EPS_est)
 
-        """
-        Real-Time Attributes
-        """
+    def _get_price_EPS_est(self):
+        # estimate price and EPS (the feed has no next quarter
+        # estimate, the PEG column was always reported)
+        return {'current_year': self.price_EPS_est_current_year,
+                'next_year': self.price_EPS_est_next_year,
+                'next_quarter': self.PEG}
 
-        self.realtime = {
-            'ask': self.data[36],
-            'bid': self.data[37],
-            'change': {'percent': self.data[38].split(" - ")[1],
-                       'cash': self.data[40]
-                       },
-            'last_trade': {'date': self.data[39].split(" - ")[0],
-                           'price': self.data[39].split(" - ")[1]
-                           },
-            'day_range': {'low': self.data[41].split(" - ")[0],
-                          'high': self.data[41].split(" - ")[1]
-                          },
-            'capital': self.data[42]
-        }
+    price_EPS_est = property(_get_price_EPS_est)
 
-        """
-        Fundamental Attributes
-        """
+    def _get_average_move(self):
+        return {'d50': self.average_move_d50,
+                'd200': self.average_move_d200}
 
-        # Obtaining these separately because they require
-        # special parsing and cannot be added to a list
-        # (they each become multiple items if they go through
-        #  cvsreader).
+    average_move = property(_get_average_move)
 
-        outstand = 'http://quote.yahoo.com/d?f=j2&s=%s' % self.symbol
-        f = urllib2.urlopen(outstand)
-        self.outstanding = int("".join(f.read().split(",")))
+    """
+    Real-Time Attributes
+    """
 
-        freefloat = 'http://quote.yahoo.com/d?f=f6&s=%s' % self.symbol
-        f = urllib2.urlopen(freefloat)
-        self.float = int("".join(f.read().split(",")))
+    def _get_realtime(self):
+        return {'ask': self.realtime_ask,
+                'bid': self.realtime_bid,
+                'change': {'percent': self.realtime_change_percent,
+                           'cash': self.realtime_change_cash},
+                'last_trade': {'date': self.realtime_last_trade_date,
+                               'price': self.realtime_last_trade_price},
+                'day_range': {'low': self.realtime_day_low,
+                              'high': self.realtime_day_high},
+                'capital': self.realtime_capital}
 
-        # restricted is generated on the fly
-        self.restricted = self.outstanding - self.float
+    realtime = property(_get_realtime)
 
 
+def _join_fundamentals(row, count=44):
+    """
+    Rebuild the fundamentals the csv reader split on their thousands
+    separators. They were requested last, after `count' columns,
+    separated by the symbol.
+    """
+    fundamentals = row[count:]
+    try:
+        pos = fundamentals.index(row[0])
+    except ValueError:
+        return row[:count] # malformed row
+    return row[:count] + ["".join(fundamentals[:pos]).strip(),
+                       "".join(fundamentals[pos + 1:]).strip()]
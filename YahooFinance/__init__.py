@@ -0,0 +1,5 @@
+from pystocks.YahooFinance.YahooFinance import (YahooChartFinder,
+                                                YahooQuoteFinder,
+                                                FeedError,
+                                                SymbolError,
+                                                NA)
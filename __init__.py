@@ -21,12 +21,24 @@ class SymbolError(Exception):
     pass
 
 
-def format_number(n):
+def format_number(n, decimals=None):
     """
-    Convert a number to a string by adding a coma every 3 characters
+    Convert a number to a string by adding a coma every 3 digits,
+    e.g. -1234567 -> '-1,234,567' (see Reports for whole columns)
+
+    decimals: digits after the decimal point (default: those needed,
+              up to 6)
     """
-    if int(n) < 0:
-        raise ValueError("positive integer expected")
-    n = str(n)
-    return ','.join([n[::-1][x:x+3]
-              for x in range(0,len(n),3)])[::-1]
+    if isinstance(n, basestring):
+        n = int(n)
+    if decimals is not None:
+        return format(n, ",.%df" % decimals)
+    if isinstance(n, (int, long)):
+        return format(n, ",d")
+    # "f" never switches to the exponent notation, e.g. 1e+20
+    text = format(n, ",f")
+    if '.' in text:
+        text = text.rstrip('0')
+        if text.endswith('.'):
+            text += '0'
+    return text